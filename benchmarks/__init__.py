@@ -0,0 +1,5 @@
+"""
+Offline benchmarks of the bot. Telegram Bot API, Instagram and yt-dlp are
+replaced by local stand-ins, so the numbers depend only on the bot code,
+the database and the machine. Run with `python -m benchmarks.run --help`
+"""
@@ -0,0 +1,121 @@
+"""
+Benchmark of the platform extractors without the handlers.
+
+Every registered extractor resolves, downloads and streams `--media`
+distinct links served by the local stand-ins (Instagram server, fake
+yt-dlp), `--concurrency` at once. The report has latency percentiles and
+errors per platform and operation, so a new extractor can be checked
+before it is wired to real traffic.
+
+    python -m benchmarks.extractors --media 50 --concurrency 10
+    python -m benchmarks.extractors --platform tiktok --ytdlp-delay 0.1
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+from benchmarks.stand import Stand, add_stand_arguments, execute, percentile
+
+
+OPERATIONS = ("resolve", "download", "stream")
+
+
+def media_links(stand: Stand, platform: str, count: int) -> list:
+    """Links of distinct media of the platform served by the stand-ins"""
+    tag = "".join(random.choices("abcdefghijklmnopqrstuvwxyz", k=5))
+    if platform == "instagram":
+        kinds = ("image", "video", "carousel")
+        return [stand.instagram.post_url(kinds[n % len(kinds)], f"{tag}{n:06d}")
+                for n in range(count)]
+    if platform == "youtube":
+        ids = [f"{tag}{n:06d}" for n in range(count)]
+        for video_id in ids:
+            stand.seed_video(video_id)
+        return [f"https://youtu.be/{video_id}" for video_id in ids]
+    if platform == "tiktok":
+        base = random.randrange(10 ** 18, 9 * 10 ** 18)
+        return [f"https://www.tiktok.com/@bench/video/{base + n}" for n in range(count)]
+    raise ValueError(f"No stand-in links for {platform}")
+
+
+async def run_operation(extractor, operation: str, links: list, concurrency: int) -> dict:
+    from tgbot.misc.media_key import canonicalize
+
+    latencies = []
+    errors = 0
+    streamed = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(url: str):
+        nonlocal errors, streamed
+        key = canonicalize(url)
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if operation == "resolve":
+                    await extractor.resolve(key, url)
+                elif operation == "download":
+                    if extractor.direct:
+                        await extractor.download(key, url)
+                    else:
+                        await extractor.download(key, url, type="audio", format_id="140")
+                else:
+                    async for chunk in extractor.stream(key, url):
+                        streamed += len(chunk)
+            except Exception as e:
+                errors += 1
+                if errors == 1:
+                    print(f"{extractor.platform} {operation} failed: {e!r}", file=sys.stderr)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[call(url) for url in links])
+    elapsed = time.perf_counter() - started
+    return {
+        "calls": len(links),
+        "errors": errors,
+        "elapsed": elapsed,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_max": max(latencies, default=None),
+        "streamed_bytes": streamed,
+    }
+
+
+async def bench_extractors(args) -> dict:
+    stand = Stand(args)
+    try:
+        await stand.start()
+        extractors = stand.bot['extractors']
+        results = {}
+        for platform in args.platform or extractors.platforms:
+            extractor = extractors.get(platform)
+            links = media_links(stand, platform, args.media)
+            results[platform] = {
+                operation: await run_operation(extractor, operation, links, args.concurrency)
+                for operation in OPERATIONS
+            }
+        results["upstream_requests"] = stand.instagram.requests
+        return results
+    finally:
+        await stand.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--platform", action="append",
+                        help="platform to measure, all registered by default")
+    parser.add_argument("--media", type=int, default=20, help="distinct links per platform")
+    add_stand_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    execute(args, "extractors", bench_extractors)
+
+
+if __name__ == '__main__':
+    main()
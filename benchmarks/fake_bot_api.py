@@ -0,0 +1,155 @@
+import asyncio
+import itertools
+import json
+import time
+
+from collections import Counter, defaultdict, deque
+
+from aiohttp import web
+
+
+BOT_ID = 1000000
+BOT_USERNAME = "BenchmarkBot"
+
+
+class FakeBotApi:
+    """
+    Local Bot API server for the `bot_api_server` setting. Every method
+    returns a plausible result after `latency` seconds and is counted,
+    uploaded files are read completely, as Telegram would do. Errors of
+    Telegram can be injected for requests to the given chat with fail(),
+    updates for long polling are queued with push_updates()
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        # chat id -> requests of the chat which were answered with success
+        self.chats = Counter()
+        self.uploaded_bytes = 0
+        self._failures = defaultdict(deque)
+        self._updates = deque()
+        self._updates_pushed = asyncio.Event()
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self.app = web.Application(client_max_size=2 * 1024 ** 3)
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+        self.app.router.add_get("/bot{token}/{method}", self.handle)
+        self._runner = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start the server and return its base url"""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def reset(self):
+        self.calls.clear()
+        self.chats.clear()
+        self.uploaded_bytes = 0
+        self._failures.clear()
+        self._updates.clear()
+
+    def fail(self, chat_id: int, error_code: int, description: str,
+             retry_after: int = None, times: int = 1):
+        """
+        Answer the next `times` requests to the chat with the error, e.g.
+        fail(chat_id, 429, "Too Many Requests: retry after 1", retry_after=1)
+        or fail(chat_id, 403, "Forbidden: bot was blocked by the user")
+        """
+        error = {"ok": False, "error_code": error_code, "description": description}
+        if retry_after is not None:
+            error["parameters"] = {"retry_after": retry_after}
+        self._failures[str(chat_id)].extend([error] * times)
+
+    def push_updates(self, updates: list):
+        """Queue updates (dicts) for getUpdates"""
+        self._updates.extend(updates)
+        self._updates_pushed.set()
+
+    async def get_updates(self, data: dict) -> list:
+        """Queued updates from the offset, waits up to timeout for new ones"""
+        offset = int(data.get('offset') or 0)
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()
+        if not self._updates:
+            self._updates_pushed.clear()
+            try:
+                await asyncio.wait_for(self._updates_pushed.wait(),
+                                       float(data.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(self._updates, int(data.get('limit') or 100)))
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] += 1
+        data = {}
+        for key, value in (await request.post()).items():
+            if isinstance(value, web.FileField):
+                self.uploaded_bytes += len(value.file.read())
+            else:
+                data[key] = value
+        if method.lower() == "getupdates":
+            return web.json_response({"ok": True, "result": await self.get_updates(data)})
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        failures = self._failures.get(data.get('chat_id'))
+        if failures:
+            error = failures.popleft()
+            return web.json_response(error, status=error["error_code"])
+        if data.get('chat_id', "").lstrip("-").isdigit():
+            self.chats[int(data['chat_id'])] += 1
+        result = self.result(method, data)
+        return web.json_response({"ok": True, "result": result})
+
+    def result(self, method: str, data: dict):
+        method = method.lower()
+        if method == "getme":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "Benchmark",
+                    "username": BOT_USERNAME, "can_join_groups": True,
+                    "can_read_all_group_messages": False,
+                    "supports_inline_queries": False}
+        if method == "sendmediagroup":
+            media = json.loads(data.get('media', "[]"))
+            return [self.message(data, item.get('type', "photo")) for item in media]
+        if method == "copymessage":
+            return {"message_id": next(self._message_ids)}
+        if method.startswith("send") and method != "sendchataction":
+            return self.message(data, method[len("send"):])
+        if method.startswith("editmessage"):
+            return self.message(data, "text", message_id=data.get('message_id'))
+        return True
+
+    def message(self, data: dict, kind: str, message_id=None) -> dict:
+        chat_id = int(data.get('chat_id', 0))
+        message = {
+            "message_id": int(message_id or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id,
+                     "type": "private" if chat_id > 0 else "supergroup"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Benchmark",
+                     "username": BOT_USERNAME},
+        }
+        file = {"file_id": f"bench-file-{next(self._file_ids)}",
+                "file_unique_id": f"bench-{next(self._file_ids)}"}
+        if kind == "photo":
+            message["photo"] = [dict(file, width=1080, height=1080)]
+        elif kind == "video":
+            message["video"] = dict(file, width=1280, height=720, duration=10)
+        elif kind == "audio":
+            message["audio"] = dict(file, duration=10)
+        elif kind in ("document", "animation", "voice"):
+            message[kind] = file
+        else:
+            message["text"] = data.get('text', "")
+        if data.get('caption'):
+            message["caption"] = data['caption']
+        return message
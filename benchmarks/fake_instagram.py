@@ -0,0 +1,95 @@
+import asyncio
+import zlib
+
+from aiohttp import web
+
+
+# Synthetic post ids are "<kind>__<id>", kind of the other (e.g. recorded)
+# posts is selected by the id hash
+KINDS = ("image", "video", "carousel", "missing")
+CAROUSEL_SIZE = 4
+
+
+class FakeInstagram:
+    """
+    Local stand-in for the `api_base` setting of Instagram. /p/<id>/ answers
+    with post data in the shape of `?__a=1` responses, media and YouTube
+    thumbnails are served from /media/ and /thumb/ with `media_size` bytes
+    """
+
+    def __init__(self, media_size: int = 512 * 1024, latency: float = 0.0):
+        self.latency = latency
+        self.body = b"\0" * media_size
+        self.requests = 0
+        self.served_bytes = 0
+        self.base_url = None
+        self.app = web.Application()
+        self.app.router.add_get("/p/{post_id}/", self.handle_post)
+        self.app.router.add_get("/media/{post_id}/{name}", self.handle_media)
+        self.app.router.add_get("/thumb/{name}", self.handle_media)
+        self._runner = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    @staticmethod
+    def post_url(kind: str, post_id: str) -> str:
+        """Instagram link of the post, whose data is served by this server"""
+        return f"https://www.instagram.com/p/{kind}__{post_id}/"
+
+    @staticmethod
+    def post_kind(post_id: str) -> str:
+        kind, sep, _ = post_id.partition("__")
+        if sep and kind in KINDS:
+            return kind
+        return KINDS[zlib.crc32(post_id.encode()) % 3]
+
+    def media_url(self, post_id: str, name: str) -> str:
+        return f"{self.base_url}/media/{post_id}/{name}"
+
+    def thumb_url(self, name: str) -> str:
+        return f"{self.base_url}/thumb/{name}.jpg"
+
+    def item(self, post_id: str, name: str, video: bool) -> dict:
+        item = {"image_versions2": {"candidates": [
+            {"url": self.media_url(post_id, f"{name}.jpg"),
+             "width": 1080, "height": 1080}]}}
+        if video:
+            item["video_versions"] = [
+                {"url": self.media_url(post_id, f"{name}.mp4"),
+                 "width": 720, "height": 1280}]
+        return item
+
+    async def handle_post(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        post_id = request.match_info['post_id']
+        kind = self.post_kind(post_id)
+        if kind == "missing":
+            return web.json_response({"message": "Page not found"}, status=404)
+        if kind == "carousel":
+            item = {"carousel_media": [
+                self.item(post_id, str(index), video=index % 2 == 1)
+                for index in range(CAROUSEL_SIZE)]}
+        else:
+            item = self.item(post_id, "0", video=kind == "video")
+        item["code"] = post_id
+        return web.json_response({"items": [item]})
+
+    async def handle_media(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.served_bytes += len(self.body)
+        return web.Response(body=self.body, content_type="application/octet-stream")
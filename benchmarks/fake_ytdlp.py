@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Stand-in for yt-dlp with the options used by tgbot.api.youtube. Prints
+progress in the requested template and writes FAKE_YTDLP_SIZE bytes to
+the output file in FAKE_YTDLP_DELAY seconds, or to stdout with `-o -`.
+`-j` prints the info of the media instead. FAKE_YTDLP_FAIL=1 makes it
+exit with an error.
+
+Set `ytdlp_path = python3 benchmarks/fake_ytdlp.py` in [youtube]
+"""
+import json
+import os
+import sys
+import time
+
+
+STEPS = 5
+
+
+def option(args: list, name: str, default=None):
+    if name in args:
+        return args[args.index(name) + 1]
+    return default
+
+
+def main(args: list) -> int:
+    size = int(os.environ.get("FAKE_YTDLP_SIZE", 1024 * 1024))
+    delay = float(os.environ.get("FAKE_YTDLP_DELAY", 0.5))
+    if os.environ.get("FAKE_YTDLP_FAIL") == "1":
+        print("ERROR: [youtube] Video unavailable", file=sys.stderr)
+        return 1
+
+    if "-j" in args or "--dump-json" in args:
+        url = args[-1]
+        media_id = url.rstrip("/").rsplit("/", 1)[-1]
+        print(json.dumps({"id": media_id, "title": f"Fake {media_id}",
+                          "duration": 10, "ext": "mp4", "webpage_url": url}))
+        return 0
+
+    output = option(args, "-o")
+    if output == "-":
+        # Media to stdout, progress would go to stderr
+        time.sleep(delay)
+        sys.stdout.buffer.write(b"\0" * size)
+        sys.stdout.buffer.flush()
+        return 0
+    if output is None:
+        print("ERROR: no output template", file=sys.stderr)
+        return 2
+    audio = "--extract-audio" in args
+    output = output.replace("%(ext)s", option(args, "--audio-format", "mp3")
+                            if audio else "mp4")
+    # "download:[progress] %(...)s ..." -> "[progress]"
+    template = option(args, "--progress-template", "download:[download]")
+    prefix = template.split(":", 1)[-1].split()[0]
+
+    for step in range(1, STEPS + 1):
+        time.sleep(delay / STEPS)
+        downloaded = size * step // STEPS
+        speed = size / delay if delay else size
+        eta = int(delay * (STEPS - step) / STEPS)
+        print(f"{prefix} {downloaded} {size} NA {speed:.0f} {eta}", flush=True)
+    stage = "[ExtractAudio] Destination:" if audio else "[Merger] Merging formats into"
+    print(f"{stage} {output}", flush=True)
+
+    with open(output, "wb") as f:
+        f.write(b"\0" * size)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
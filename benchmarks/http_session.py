@@ -0,0 +1,98 @@
+"""
+Benchmark of upstream requests with a session per request against the
+application-scoped session.
+
+Requests post data and media of the Instagram stand-in `--concurrency` at
+once, in two modes:
+
+- fresh: a new aiohttp.ClientSession for every request, so every request
+  connects (and resolves the host) again;
+- pooled: the one session of create_http_session() with the [http]
+  settings of the config, as bot['http'] is shared by the handlers.
+
+The report has requests per second and latency percentiles of every mode
+and request kind.
+
+    python -m benchmarks.http_session --requests 2000 --concurrency 50
+    python -m benchmarks.http_session --upstream-latency 0.02 --media-size 1048576
+"""
+import argparse
+
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+from benchmarks.stand import ROOT, execute, measure_calls
+
+
+async def bench_session(session_for, urls: list, concurrency: int) -> dict:
+    """
+    measure_calls() of GET of every url, session_for() is an async
+    context manager with the session of a request
+    """
+    async def get(url: str):
+        async with session_for() as session:
+            async with session.get(url) as resp:
+                resp.raise_for_status()
+                await resp.read()
+
+    return await measure_calls(get, urls, concurrency)
+
+
+async def bench_http_session(args) -> dict:
+    from benchmarks.fake_instagram import FakeInstagram
+    from tgbot.config import load_config
+    from tgbot.services.http import create_http_session
+
+    instagram = FakeInstagram(args.media_size, args.upstream_latency)
+    await instagram.start()
+    pooled = create_http_session(load_config(args.config))
+
+    @asynccontextmanager
+    async def fresh_session():
+        async with aiohttp.ClientSession() as session:
+            yield session
+
+    @asynccontextmanager
+    async def pooled_session():
+        yield pooled
+
+    kinds = {
+        "post": [f"{instagram.base_url}/p/image__{n:06d}/" for n in range(args.requests)],
+        "media": [instagram.media_url(f"image__{n:06d}", "0.jpg") for n in range(args.requests)],
+    }
+    results = {}
+    try:
+        for mode, session_for in (("fresh", fresh_session), ("pooled", pooled_session)):
+            results[mode] = {kind: await bench_session(session_for, urls, args.concurrency)
+                             for kind, urls in kinds.items()}
+    finally:
+        await pooled.close()
+        await instagram.stop()
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default=str(ROOT / "bot.ini"),
+                        help="bot config with the [http] settings")
+    parser.add_argument("--requests", type=int, default=1000,
+                        help="requests of every kind in every mode")
+    parser.add_argument("--concurrency", type=int, default=20,
+                        help="requests at once")
+    parser.add_argument("--media-size", type=int, default=64 * 1024,
+                        help="bytes of every downloaded file")
+    parser.add_argument("--upstream-latency", type=float, default=0.0,
+                        help="stand-in response delay, seconds")
+    parser.add_argument("--workdir", help="directory of the run, temporary by default")
+    parser.add_argument("--output", help="result file, benchmarks/results/<name>-<time>.json by default")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    execute(args, "http_session", bench_http_session)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark of distributed mode scaling.
+
+Fills a fresh Redis job queue with `--jobs` stub jobs and drains it with
+every combination of `--processes` worker processes and
+`--concurrency-levels` consumers per process (worker_processes and
+worker_concurrency of [distributed]). A stub job reserves, sleeps
+`--job-time` seconds as a download would and acks, so the report shows
+jobs per second of the queue itself for every worker count. Needs Redis
+from the config (use_redis = true).
+
+    python -m benchmarks.job_queue --jobs 2000 --processes 1 2 4 --concurrency-levels 1 4 16
+"""
+import argparse
+import asyncio
+import multiprocessing
+import random
+import time
+
+from benchmarks.stand import ROOT, execute
+
+
+def create_queue(args, name: str):
+    from tgbot.config import load_config
+    from tgbot.services.job_queue import RedisJobQueue
+    from tgbot.services.redis_client import create_redis
+
+    redis = create_redis(load_config(args.config))
+    if redis is None:
+        raise SystemExit("Set use_redis = true in the config, the job queue is in Redis")
+    return RedisJobQueue(redis, name, max_attempts=args.max_attempts)
+
+
+async def drain(args, name: str, concurrency: int) -> tuple:
+    """Process jobs until the queue is empty, returns (jobs done, last ack time)"""
+    queue = create_queue(args, name)
+    done = 0
+    last_ack = 0.0
+
+    async def consume():
+        nonlocal done, last_ack
+        while True:
+            job = await queue.reserve(timeout=args.idle_timeout, poll_interval=0.01)
+            if job is None:
+                return
+            await asyncio.sleep(args.job_time)
+            await queue.ack(job)
+            done += 1
+            last_ack = time.time()
+
+    try:
+        await asyncio.gather(*[consume() for _ in range(concurrency)])
+    finally:
+        await queue.redis.close()
+    return done, last_ack
+
+
+def run_process(args, name: str, concurrency: int, results: multiprocessing.Queue):
+    try:
+        results.put(asyncio.new_event_loop().run_until_complete(
+            drain(args, name, concurrency)))
+    except BaseException:
+        # The parent waits for a result of every process
+        results.put((0, 0.0))
+        raise
+
+
+async def bench_level(args, processes: int, concurrency: int) -> dict:
+    name = f"bench_jobs_{random.randrange(10 ** 9)}"
+    queue = create_queue(args, name)
+    try:
+        for _ in range(args.jobs):
+            await queue.enqueue({"type": "bench"})
+        # Forked children would inherit the running event loop
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        workers = [context.Process(target=run_process,
+                                   args=(args, name, concurrency, results))
+                   for _ in range(processes)]
+        started = time.time()
+        for worker in workers:
+            worker.start()
+        drained = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        done = sum(count for count, _ in drained)
+        elapsed = max(last_ack for _, last_ack in drained) - started
+        stats = await queue.stats()
+    finally:
+        await queue.redis.delete(*queue._keys)
+        await queue.redis.close()
+    return {
+        "processes": processes,
+        "concurrency": concurrency,
+        "workers": processes * concurrency,
+        "jobs": done,
+        "elapsed": elapsed,
+        "jobs_per_sec": done / elapsed if elapsed > 0 else None,
+        # Upper bound of stub workers which only sleep
+        "ideal_jobs_per_sec": processes * concurrency / args.job_time if args.job_time else None,
+        "left": stats,
+    }
+
+
+async def bench_job_queue(args) -> dict:
+    levels = []
+    for processes in args.processes:
+        for concurrency in args.concurrency_levels:
+            level = await bench_level(args, processes, concurrency)
+            print(f"{processes} x {concurrency}: {level['jobs_per_sec']:.0f} jobs/s")
+            levels.append(level)
+    return {"levels": levels}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default=str(ROOT / "bot.ini"),
+                        help="bot config with the Redis settings")
+    parser.add_argument("--jobs", type=int, default=1000)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4],
+                        help="worker processes to measure")
+    parser.add_argument("--concurrency-levels", type=int, nargs="+", default=[1, 4, 16],
+                        help="consumers per process to measure")
+    parser.add_argument("--job-time", type=float, default=0.01,
+                        help="seconds every stub job takes")
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--idle-timeout", type=float, default=0.5,
+                        help="seconds a consumer waits on the empty queue before it exits")
+    parser.add_argument("--workdir", help="directory of the run, temporary by default")
+    parser.add_argument("--output", help="result file, benchmarks/results/<name>-<time>.json by default")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    execute(args, "job_queue", bench_job_queue)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark of link -> file lookups by cache tier.
+
+Saves `--links` links of distinct files to the database, then looks every
+link up `--concurrency` at once, pass by pass:
+
+- cold: empty link cache, every lookup is the link-file JOIN (and the
+  write-through to Redis with --redis);
+- redis: a new link cache whose local tier is empty, answered by Redis
+  filled by the cold pass (only with --redis);
+- local: the same cache again, answered by its in-process TTL cache.
+
+The report has lookups per second and latency percentiles of every pass.
+
+    python -m benchmarks.link_cache --links 2000 --concurrency 50
+    python -m benchmarks.link_cache --links 500 --redis
+"""
+import argparse
+import asyncio
+import random
+import string
+
+from benchmarks.stand import Stand, add_stand_arguments, execute, measure_calls
+
+
+async def save_links(stand: Stand, count: int, concurrency: int) -> list:
+    """Link keys of new links, every one to its own file"""
+    from tgbot.misc.media_key import link_key
+    from tgbot.models.file import File
+    from tgbot.models.link import Link
+
+    db = stand.bot['db']
+    tag = "".join(random.choices(string.ascii_lowercase, k=5))
+    urls = [stand.instagram.post_url("image", f"{tag}{n:06d}") for n in range(count)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def save(n: int, url: str):
+        async with semaphore:
+            file = await File.add_file(db, File("image", f"bench/{tag}{n}.jpg", f"bench-{tag}-{n}"))
+            await Link.add_link(db, Link(url, "INSTAGRAM", file.id, None))
+
+    await asyncio.gather(*[save(n, url) for n, url in enumerate(urls)])
+    return [link_key(url) for url in urls]
+
+
+async def bench_link_cache(args) -> dict:
+    from tgbot.services.link_cache import LinkCache
+
+    stand = Stand(args)
+    try:
+        await stand.start()
+        db = stand.bot['db']
+        redis = stand.bot['redis']
+        keys = await save_links(stand, args.links, args.concurrency)
+        prefix = f"bench_link_cache_{random.randrange(10 ** 9)}"
+
+        def lookup(cache: LinkCache):
+            async def get(key: str):
+                if await cache.get(db, key) is None:
+                    raise LookupError(key)
+            return get
+
+        results = {}
+        cold = LinkCache(redis=redis, prefix=prefix, redis_ttl=600)
+        results["cold"] = await measure_calls(lookup(cold), keys, args.concurrency)
+        results["cold"]["cache"] = cold.stats()
+
+        warm = LinkCache(redis=redis, prefix=prefix, redis_ttl=600)
+        if redis:
+            results["redis"] = await measure_calls(lookup(warm), keys, args.concurrency)
+            results["redis"]["cache"] = warm.stats()
+        else:
+            # The local tier is filled by database lookups instead
+            await measure_calls(lookup(warm), keys, args.concurrency)
+        results["local"] = await measure_calls(lookup(warm), keys, args.concurrency)
+        results["local"]["cache"] = warm.stats()
+        for cache in (cold, warm):
+            await cache.stop()
+        return results
+    finally:
+        await stand.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--links", type=int, default=1000, help="distinct links looked up")
+    add_stand_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    execute(args, "link_cache", bench_link_cache)
+
+
+if __name__ == '__main__':
+    main()
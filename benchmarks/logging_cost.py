@@ -0,0 +1,135 @@
+"""
+Benchmark of logging cost per handler.
+
+Runs a handler-sized unit of work `--units` times (`--concurrency` at once)
+under the sinks of tgbot/services/logs.py, configuration by configuration:
+
+- none: no sinks, the floor;
+- enqueue on and off of the file sinks ([logging] enqueue);
+- payload sampling: payload_sample_rate 0, `--sample-rate` and 1 with the
+  DEBUG sink enabled, so sampled units dump the post data.
+
+A unit logs what a download handler does (user, platform, status, saved
+file and success lines) around parsing the post data and sample_payload().
+The report has units per second and latency percentiles of the units, the
+time to flush the queued records and the bytes written.
+
+    python -m benchmarks.logging_cost --units 20000
+    python -m benchmarks.logging_cost --carousel 10 --sample-rate 0.05
+"""
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import shutil
+import time
+
+from loguru import logger
+
+from benchmarks.stand import ROOT, execute, measure_calls
+
+
+def post_data(items: int) -> str:
+    """Post data in the shape of the `?__a=1` responses"""
+    media = [{
+        "image_versions2": {"candidates": [
+            {"url": f"https://scontent.cdninstagram.com/v/{n}.jpg?stp=dst-jpg", "width": 1080,
+             "height": 1080}]},
+        "video_versions": [
+            {"url": f"https://scontent.cdninstagram.com/v/{n}.mp4?efg=vencode", "width": 720,
+             "height": 1280}],
+    } for n in range(items)]
+    return json.dumps({"items": [{"code": "bench", "carousel_media": media}]})
+
+
+async def handler_unit(n: int, data: str):
+    from tgbot.services.logs import sample_payload
+
+    url = f"https://www.instagram.com/p/bench{n}/"
+    logger.info(f"User {n} is trying to download {url}")
+    logger.info(f"User {n} url from instagram")
+    logger.info("Post status: 200")
+    post = json.loads(data)
+    if sample_payload():
+        logger.opt(lazy=True).debug("Post data:\n{}", lambda: json.dumps(post, indent=4))
+    for index, _ in enumerate(post["items"][0]["carousel_media"]):
+        logger.debug(f"File: media/instagram/carousels/bench{n}/{index}.mp4")
+        await asyncio.sleep(0)
+    logger.success(f"User {n} downloaded {url}")
+    logger.success(f"User {n} successfully sended {url}")
+
+
+def log_bytes() -> int:
+    return sum(entry.stat().st_size for entry in os.scandir("logs") if entry.is_file())
+
+
+async def bench_configuration(config, args, data: str) -> dict:
+    from tgbot.services.logs import setup_logging
+
+    shutil.rmtree("logs", ignore_errors=True)
+    if config is None:
+        logger.remove()
+    else:
+        setup_logging(config, name="bench")
+    units = await measure_calls(lambda n: handler_unit(n, data), range(args.units),
+                                args.concurrency)
+    # Waits for the queue of enqueue=True sinks and closes the files
+    started = time.perf_counter()
+    await logger.complete()
+    logger.remove()
+    flush = time.perf_counter() - started
+    return dict(units, flush_seconds=flush,
+                log_bytes=log_bytes() if os.path.isdir("logs") else 0)
+
+
+async def bench_logging(args) -> dict:
+    from tgbot.config import load_config
+
+    config = load_config(args.config)
+    base = dataclasses.replace(config.logging, console_level="", file_level="INFO",
+                               error_level="ERROR", debug_level="")
+    configurations = {"none": None}
+    for enqueue in (False, True):
+        configurations[f"enqueue_{'on' if enqueue else 'off'}"] = dataclasses.replace(
+            base, enqueue=enqueue, payload_sample_rate=0.0)
+    for rate in (0.0, args.sample_rate, 1.0):
+        configurations[f"debug_sample_{rate:g}"] = dataclasses.replace(
+            base, debug_level="DEBUG", enqueue=args.enqueue, payload_sample_rate=rate)
+
+    data = post_data(args.carousel)
+    results = {}
+    for name, conf in configurations.items():
+        if conf is not None:
+            conf = dataclasses.replace(config, logging=conf)
+        results[name] = await bench_configuration(conf, args, data)
+        print(f"{name}: {results[name]['calls_per_sec']:.0f} units/s", flush=True)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default=str(ROOT / "bot.ini"),
+                        help="bot config, the [logging] settings are varied")
+    parser.add_argument("--units", type=int, default=10000,
+                        help="handler units in every configuration")
+    parser.add_argument("--concurrency", type=int, default=20,
+                        help="units at once")
+    parser.add_argument("--carousel", type=int, default=4,
+                        help="media of the post data of every unit")
+    parser.add_argument("--sample-rate", type=float, default=0.01,
+                        help="payload_sample_rate measured besides 0 and 1")
+    parser.add_argument("--no-enqueue", dest="enqueue", action="store_false",
+                        help="payload sampling configurations without enqueue")
+    parser.add_argument("--workdir", help="directory of the logs, temporary by default")
+    parser.add_argument("--output", help="result file, benchmarks/results/<name>-<time>.json by default")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    execute(args, "logging_cost", bench_logging)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Microbenchmark of link canonicalization.
+
+Generates links to `--distinct` media in all supported forms (reels,
+profile paths, mobile hosts, youtu.be, shorts, embed, share params) and
+measures media keys against the old clean_url(): time per link, and how
+many keys each produced for the same media (misses) or for different
+media (collisions).
+
+    python -m benchmarks.media_keys --urls 2000000
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import random
+import string
+import time
+
+from collections import defaultdict
+
+from benchmarks.stand import RESULTS, git_commit
+
+
+ID_CHARS = string.ascii_letters + string.digits + "_-"
+
+INSTAGRAM_FORMS = (
+    "https://www.instagram.com/p/{id}/",
+    "https://www.instagram.com/p/{id}/?igshid={share}",
+    "https://instagram.com/reel/{id}/?utm_source=ig_web_copy_link",
+    "https://www.instagram.com/reels/{id}/",
+    "https://www.instagram.com/tv/{id}",
+    "https://m.instagram.com/p/{id}/",
+    "https://www.instagram.com/some.user/p/{id}/",
+    "instagram.com/p/{id}",
+)
+YOUTUBE_FORMS = (
+    "https://www.youtube.com/watch?v={id}",
+    "https://www.youtube.com/watch?v={id}&t=42s",
+    "https://youtube.com/watch?feature=share&v={id}",
+    "https://m.youtube.com/watch?v={id}&list=PL{share}",
+    "https://youtu.be/{id}",
+    "https://youtu.be/{id}?si={share}",
+    "https://www.youtube.com/shorts/{id}",
+    "https://youtube.com/shorts/{id}?feature=share",
+    "https://www.youtube.com/embed/{id}",
+    "https://music.youtube.com/watch?v={id}",
+)
+
+
+def random_id(length: int) -> str:
+    return "".join(random.choices(ID_CHARS, k=length))
+
+
+def generate(count: int, distinct: int, seed: int) -> list:
+    """[(url, (platform, media id))] with every media linked in random forms"""
+    random.seed(seed)
+    media = [("instagram", random_id(11)) if i % 2 else ("youtube", random_id(11))
+             for i in range(distinct)]
+    urls = []
+    for _ in range(count):
+        platform_name, media_id = random.choice(media)
+        forms = INSTAGRAM_FORMS if platform_name == "instagram" else YOUTUBE_FORMS
+        url = random.choice(forms).format(id=media_id, share=random_id(8))
+        urls.append((url, (platform_name, media_id)))
+    return urls
+
+
+def key_quality(urls: list, keys: list) -> dict:
+    """Extra keys per media (cache misses) and media sharing a key (collisions)"""
+    keys_of_media = defaultdict(set)
+    media_of_key = defaultdict(set)
+    for (_, media), key in zip(urls, keys):
+        keys_of_media[media].add(key)
+        media_of_key[key].add(media)
+    return {
+        "distinct_media": len(keys_of_media),
+        "distinct_keys": len(media_of_key),
+        "keys_per_media": sum(map(len, keys_of_media.values())) / len(keys_of_media),
+        "colliding_keys": sum(1 for media in media_of_key.values() if len(media) > 1),
+    }
+
+
+def bench_media_keys(urls: list) -> tuple:
+    from tgbot.misc.media_key import canonicalize
+
+    started = time.perf_counter()
+    keys = [canonicalize(url) for url, _ in urls]
+    elapsed = time.perf_counter() - started
+    return elapsed, [str(key) for key in keys]
+
+
+def bench_clean_url(urls: list) -> tuple:
+    from tgbot.misc.utils import clean_url
+
+    async def run():
+        return [await clean_url(url) for url, _ in urls]
+
+    loop = asyncio.new_event_loop()
+    started = time.perf_counter()
+    keys = loop.run_until_complete(run())
+    elapsed = time.perf_counter() - started
+    loop.close()
+    return elapsed, keys
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--urls", type=int, default=1000000)
+    parser.add_argument("--distinct", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+
+    urls = generate(args.urls, args.distinct, args.seed)
+    results = {}
+    for name, bench in (("media_key", bench_media_keys), ("clean_url", bench_clean_url)):
+        elapsed, keys = bench(urls)
+        results[name] = dict({
+            "elapsed": elapsed,
+            "ns_per_url": elapsed / len(urls) * 1e9,
+            "urls_per_sec": len(urls) / elapsed,
+        }, **key_quality(urls, keys))
+
+    started_at = datetime.datetime.now()
+    report = {
+        "benchmark": "media_keys",
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "params": vars(args),
+        "results": results,
+    }
+    output = args.output or RESULTS / f"media_keys-{started_at:%Y%m%d-%H%M%S}.json"
+    RESULTS.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Saved to {output}")
+
+
+if __name__ == '__main__':
+    main()
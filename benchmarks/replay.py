@@ -0,0 +1,145 @@
+"""
+Replay of updates recorded by the recorder middleware ([recorder] in bot.ini).
+
+Recorded updates are fed to the dispatcher with their original timing,
+sped up `--speed` times (0 - as fast as --concurrency allows), while
+Telegram, Instagram and yt-dlp are served by local stand-ins. Besides
+latency and throughput, the report shows how link cache, single-flight,
+scheduler and rate limiter behaved under the recorded traffic. Links are
+saved to the database from the config, so use a fresh one for comparable
+runs.
+
+    python -m benchmarks.replay recordings/updates.jsonl --speed 10
+    python -m benchmarks.replay recordings/*.jsonl --speed 0 --rate-limit --governor
+"""
+import argparse
+import json
+
+from collections import Counter
+from pathlib import Path
+
+from benchmarks.stand import Stand, add_stand_arguments, execute
+
+
+def load_records(paths: list, limit: int = None) -> list:
+    """Records of all files ordered by time, broken lines are skipped"""
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "ts" in record and "update" in record:
+                    records.append(record)
+    records.sort(key=lambda record: record["ts"])
+    return records[:limit] if limit else records
+
+
+def traffic_shape(records: list) -> dict:
+    """What the recording consists of"""
+    from tgbot.keyboards.inline import UserInline
+
+    kinds = Counter()
+    links = Counter()
+    users = set()
+    for record in records:
+        update = record["update"]
+        if "message" in update:
+            message = update["message"]
+            text = message.get("text", "")
+            if text.startswith("/"):
+                kinds["command"] += 1
+            elif "." in text and " " not in text:
+                kinds["link"] += 1
+                links[text] += 1
+            else:
+                kinds["text"] += 1
+            users.add(message.get("from", {}).get("id"))
+        elif "callback_query" in update:
+            query = update["callback_query"]
+            data = query.get("data") or ""
+            if data.startswith(UserInline.cd_down_options.prefix):
+                kinds[f"youtube_{UserInline.cd_down_options.parse(data)['type']}"] += 1
+                links[data] += 1
+            else:
+                kinds["callback"] += 1
+            users.add(query["from"]["id"])
+    requests = sum(links.values())
+    span = records[-1]["ts"] - records[0]["ts"] if records else 0
+    return {
+        "updates": len(records),
+        "span_sec": span,
+        "users": len(users),
+        "kinds": dict(kinds),
+        "distinct_downloads": len(links),
+        "repeated_download_ratio": 1 - len(links) / requests if requests else 0.0,
+    }
+
+
+def video_ids(records: list) -> set:
+    """YouTube videos of links and download buttons of the recording"""
+    from tgbot.api.youtube import get_video_id
+    from tgbot.keyboards.inline import UserInline
+
+    ids = set()
+    for record in records:
+        update = record["update"]
+        if "message" in update:
+            video_id = get_video_id(update["message"].get("text", ""))
+            if video_id:
+                ids.add(video_id)
+        elif "callback_query" in update:
+            data = update["callback_query"].get("data") or ""
+            if data.startswith(UserInline.cd_down_options.prefix):
+                ids.add(UserInline.cd_down_options.parse(data)["video_id"])
+    return ids
+
+
+async def replay(args) -> dict:
+    from aiogram.types import Update
+
+    records = load_records(args.files, args.limit)
+    if not records:
+        raise SystemExit("No updates in the recording")
+    shape = traffic_shape(records)
+
+    stand = Stand(args)
+    try:
+        await stand.start()
+        for video_id in video_ids(records):
+            stand.seed_video(video_id)
+        updates = [Update.to_object(record["update"]) for record in records]
+        first = records[0]["ts"]
+        delays = [(record["ts"] - first) / args.speed for record in records] \
+            if args.speed else None
+        results = await stand.drive(updates, delays)
+        results["recording"] = shape
+        results["services"] = stand.service_stats()
+        return results
+    finally:
+        await stand.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("files", nargs="+", help="recorded JSON Lines files")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="time scale of the recording, 0 - no delays")
+    parser.add_argument("--limit", type=int, help="replay only the first updates")
+    add_stand_arguments(parser)
+    # Recorded traffic is not limited by the replayer unless asked
+    parser.set_defaults(concurrency=10000)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Benchmark runs in its own work directory
+    args.files = [str(Path(path).resolve()) for path in args.files]
+    execute(args, "replay", replay)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+End-to-end benchmark of the download handlers.
+
+Synthetic updates are fed to the dispatcher at the given concurrency, while
+Telegram, Instagram and yt-dlp are served by local stand-ins. The database
+and (optionally) Redis from the config are used as is, so point the config
+to a disposable database.
+
+    python -m benchmarks.run --scenario instagram --requests 500 --concurrency 50
+    python -m benchmarks.run --scenario youtube --distinct 20 --output yt.json
+    python -m benchmarks.run --scenario tiktok --ytdlp-delay 0.2
+"""
+import argparse
+import random
+import string
+import time
+
+from benchmarks.stand import Stand, add_stand_arguments, execute
+
+
+# First synthetic user id, far from real ids of small bots
+USER_ID_BASE = 7000000000
+
+SCENARIOS = ("instagram", "youtube", "youtube-links", "tiktok")
+INSTAGRAM_KINDS = ("image", "video", "carousel")
+
+
+class UpdateFactory:
+    """Synthetic updates of distinct users with links of one run"""
+
+    def __init__(self, args, instagram, bot_user: dict):
+        self.args = args
+        self.instagram = instagram
+        self.bot_user = bot_user
+        # Ids are unique per run, so links saved by earlier runs are not reused
+        self.tag = "".join(random.choices(string.ascii_lowercase, k=5))
+        # TikTok ids are numbers
+        self.tiktok_base = random.randrange(10 ** 18, 9 * 10 ** 18)
+        self._update_id = 0
+
+    def user(self, n: int) -> dict:
+        return {"id": USER_ID_BASE + n % self.args.users, "is_bot": False,
+                "first_name": "Bench", "username": f"bench{n % self.args.users}",
+                "language_code": "en"}
+
+    def video_id(self, n: int) -> str:
+        return f"{self.tag}{n % self.args.distinct:06d}"
+
+    def message(self, n: int, text: str) -> dict:
+        self._update_id += 1
+        user = self.user(n)
+        return {"update_id": self._update_id, "message": {
+            "message_id": self._update_id,
+            "date": int(time.time()),
+            "chat": dict(user, type="private"),
+            "from": user,
+            "text": text,
+        }}
+
+    def callback(self, n: int, data: str) -> dict:
+        self._update_id += 1
+        user = self.user(n)
+        return {"update_id": self._update_id, "callback_query": {
+            "id": str(self._update_id),
+            "from": user,
+            "chat_instance": "benchmark",
+            "data": data,
+            "message": {
+                "message_id": self._update_id,
+                "date": int(time.time()),
+                "chat": dict(user, type="private"),
+                "from": self.bot_user,
+                "caption": "Choose type and quality",
+            },
+        }}
+
+    def make(self, n: int) -> dict:
+        from tgbot.keyboards.inline import UserInline
+
+        scenario = self.args.scenario
+        if scenario == "instagram":
+            kind = INSTAGRAM_KINDS[n % len(INSTAGRAM_KINDS)]
+            post_id = f"{self.tag}{n % self.args.distinct:06d}"
+            return self.message(n, self.instagram.post_url(kind, post_id))
+        if scenario == "tiktok":
+            video_id = self.tiktok_base + n % self.args.distinct
+            return self.message(n, f"https://www.tiktok.com/@bench/video/{video_id}")
+        if scenario == "youtube-links":
+            return self.message(n, f"https://youtu.be/{self.video_id(n)}")
+        audio = n % 4 == 3
+        data = UserInline.cd_down_options.new(
+            type="audio" if audio else "video",
+            video_id=self.video_id(n),
+            format_id="140" if audio else "134",
+            width=0 if audio else 640,
+            height=0 if audio else 360,
+            duration=10)
+        return self.callback(n, data)
+
+
+async def run(args) -> dict:
+    from aiogram.types import Update
+
+    stand = Stand(args)
+    try:
+        await stand.start()
+        factory = UpdateFactory(args, stand.instagram, stand.bot['me'].to_python())
+        for n in range(args.distinct):
+            stand.seed_video(factory.video_id(n))
+        updates = [Update.to_object(factory.make(n)) for n in range(args.requests)]
+        results = await stand.drive(updates)
+        results["services"] = stand.service_stats()
+        return results
+    finally:
+        await stand.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", choices=SCENARIOS, default="instagram")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=50,
+                        help="distinct links, repeated ones hit singleflight and link cache")
+    parser.add_argument("--users", type=int, default=100, help="distinct users")
+    add_stand_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    execute(args, args.scenario, run)
+
+
+if __name__ == '__main__':
+    main()
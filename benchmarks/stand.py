@@ -0,0 +1,353 @@
+"""
+Bot with its dispatcher wired to the local stand-ins, and helpers shared by
+benchmarks: driving updates through the dispatcher, measuring and saving
+the report
+"""
+import asyncio
+import dataclasses
+import datetime
+import json
+import os
+import platform
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS = ROOT / "benchmarks" / "results"
+FAKE_YTDLP = ROOT / "benchmarks" / "fake_ytdlp.py"
+LAG_INTERVAL = 0.05
+# Errors printed to stderr, the rest are only counted
+MAX_PRINTED_ERRORS = 10
+
+
+def percentile(values: list, percent: float) -> float or None:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+async def measure_calls(func, items: list, concurrency: int) -> dict:
+    """
+    Await func(item) for every item, at most concurrency at once.
+    Returns throughput and latency percentiles, failed calls are counted
+    """
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(item):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await func(item)
+            except Exception as e:
+                errors += 1
+                if errors <= MAX_PRINTED_ERRORS:
+                    print(f"Call {item!r} failed: {e!r}", file=sys.stderr)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[call(item) for item in items])
+    elapsed = time.perf_counter() - started
+    return {
+        "calls": len(items),
+        "errors": errors,
+        "elapsed": elapsed,
+        "calls_per_sec": len(items) / elapsed if elapsed else None,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": max(latencies, default=None),
+    }
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def git_commit() -> str or None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def video_metadata(video_id: str, thumb_url: str, media_size: int) -> dict:
+    """yt-dlp metadata of a fake video in jmesformula shape"""
+    return {
+        "id": video_id,
+        "title": f"Benchmark video {video_id}",
+        "duration": 10,
+        "thumbnail": thumb_url,
+        "channel_url": "https://www.youtube.com/c/benchmark",
+        "channel": "Benchmark channel",
+        "video_formats": [
+            {"width": 640 * k, "height": 360 * k, "format_id": str(133 + k),
+             "filesize": media_size * k, "fps": 30, "quality": k,
+             "url": "", "vcodec": "avc1.4d401e", "acodec": "none",
+             "ext": "mp4", "http_chunk_size": None}
+            for k in (1, 2, 3)],
+        "audio_formats": [
+            {"height": None, "format_id": "140", "filesize": media_size,
+             "url": "", "acodec": "mp4a.40.2", "ext": "m4a",
+             "http_chunk_size": None}],
+    }
+
+
+class LoopMonitor:
+    """Measures event loop lag and peak RSS in the background"""
+
+    def __init__(self, interval: float = LAG_INTERVAL):
+        self.interval = interval
+        self.lags = []
+        self.peak_rss = rss_bytes()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - started - self.interval))
+            self.peak_rss = max(self.peak_rss, rss_bytes())
+
+    def results(self) -> dict:
+        return {
+            "loop_lag_p50": percentile(self.lags, 50),
+            "loop_lag_p99": percentile(self.lags, 99),
+            "loop_lag_max": max(self.lags, default=None),
+            "peak_rss_bytes": self.peak_rss,
+        }
+
+
+def add_stand_arguments(parser):
+    parser.add_argument("--config", default=str(ROOT / "bot.ini"),
+                        help="bot config with the database settings")
+    parser.add_argument("--concurrency", type=int, default=20,
+                        help="updates processed at once")
+    parser.add_argument("--media-size", type=int, default=512 * 1024,
+                        help="bytes of every downloaded file")
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="Bot API response delay, seconds")
+    parser.add_argument("--upstream-latency", type=float, default=0.0,
+                        help="Instagram response delay, seconds")
+    parser.add_argument("--ytdlp-delay", type=float, default=0.5,
+                        help="duration of a fake yt-dlp run, seconds")
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="keep the rate limiter from the config enabled")
+    parser.add_argument("--governor", action="store_true",
+                        help="keep the Bot API governor from the config enabled")
+    parser.add_argument("--redis", action="store_true",
+                        help="keep Redis from the config for link cache and rate limiter")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--workdir", help="directory for media, temporary by default")
+    parser.add_argument("--output", help="result file, benchmarks/results/<name>-<time>.json by default")
+
+
+def configure(config, args, bot_api: str, instagram_api: str):
+    """Point the config to the stand-ins and disable what is not measured"""
+    config.tg_bot.bot_api_server = bot_api
+    config.tg_bot.use_redis = config.tg_bot.use_redis and args.redis
+    config.instagram.api_base = instagram_api
+    config.youtube.ytdlp_path = f"{shlex.quote(sys.executable)} {shlex.quote(str(FAKE_YTDLP))}"
+    config.webhook.enabled = False
+    config.distributed.enabled = False
+    config.metrics.enabled = False
+    config.recorder.enabled = False
+    config.rate_limit.enabled = args.rate_limit
+    config.api_governor.enabled = args.governor
+    config.logging = dataclasses.replace(
+        config.logging, console_level=args.log_level, file_level="",
+        error_level="", debug_level="", enqueue=False)
+    return config
+
+
+class Stand:
+    """Bot, dispatcher and the stand-ins of Bot API, Instagram and yt-dlp"""
+
+    def __init__(self, args):
+        from benchmarks.fake_bot_api import FakeBotApi
+        from benchmarks.fake_instagram import FakeInstagram
+
+        self.args = args
+        self.bot_api = FakeBotApi(latency=args.api_latency)
+        self.instagram = FakeInstagram(media_size=args.media_size,
+                                       latency=args.upstream_latency)
+        self.bot = None
+        self.dp = None
+
+    async def start(self):
+        # Imported here, so media paths of the bot are created in the work directory
+        from aiogram import Bot, Dispatcher
+        from aiogram.contrib.fsm_storage.memory import MemoryStorage
+
+        from bot import register_all_middlewares, register_all_filters, register_all_handlers
+        from tgbot.config import load_config
+        from tgbot.services.context import create_bot, setup_context
+        from tgbot.services.logs import setup_logging
+
+        config = configure(load_config(self.args.config), self.args,
+                           await self.bot_api.start(), await self.instagram.start())
+        setup_logging(config, "benchmark")
+        os.environ["FAKE_YTDLP_SIZE"] = str(self.args.media_size)
+        os.environ["FAKE_YTDLP_DELAY"] = str(self.args.ytdlp_delay)
+
+        self.bot = create_bot(config)
+        self.dp = Dispatcher(self.bot, storage=MemoryStorage())
+        Bot.set_current(self.bot)
+        Dispatcher.set_current(self.dp)
+        await setup_context(self.bot, config)
+        register_all_middlewares(self.dp)
+        register_all_filters(self.dp)
+        register_all_handlers(self.dp)
+
+    async def stop(self):
+        from tgbot.services.context import close_context
+
+        if self.dp:
+            await self.dp.storage.close()
+            await close_context(self.bot)
+        await self.bot_api.stop()
+        await self.instagram.stop()
+
+    def seed_video(self, video_id: str):
+        from tgbot.api.youtube import seed_metadata
+
+        seed_metadata(video_metadata(
+            video_id, self.instagram.thumb_url(video_id), self.args.media_size))
+
+    async def drive(self, updates: list, delays: list = None) -> dict:
+        """
+        Process updates with at most args.concurrency at once. With delays
+        every update is started not earlier than its delay from the start
+        """
+        latencies = []
+        errors = 0
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        loop = asyncio.get_event_loop()
+
+        async def process(update, delay: float):
+            nonlocal errors
+            if delay:
+                await asyncio.sleep(delay - (loop.time() - started_at))
+            async with semaphore:
+                update_started = time.perf_counter()
+                try:
+                    await self.dp.process_update(update)
+                except Exception as e:
+                    errors += 1
+                    if errors <= MAX_PRINTED_ERRORS:
+                        print(f"Update {update.update_id} failed: {e!r}", file=sys.stderr)
+                latencies.append(time.perf_counter() - update_started)
+
+        self.bot_api.reset()
+        monitor = LoopMonitor()
+        rss_before = rss_bytes()
+        monitor.start()
+        started_at = loop.time()
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*[process(update, delays[i] if delays else 0)
+                                   for i, update in enumerate(updates)])
+            elapsed = time.perf_counter() - started
+        finally:
+            await monitor.stop()
+
+        api_calls = sum(self.bot_api.calls.values())
+        return dict({
+            "requests": len(updates),
+            "errors": errors,
+            "elapsed": elapsed,
+            "requests_per_sec": len(updates) / elapsed if elapsed else None,
+            "latency_p50": percentile(latencies, 50),
+            "latency_p95": percentile(latencies, 95),
+            "latency_p99": percentile(latencies, 99),
+            "latency_max": max(latencies, default=None),
+            "rss_before_bytes": rss_before,
+            "api_calls": api_calls,
+            "api_calls_per_request": api_calls / len(updates) if updates else None,
+            "api_calls_by_method": dict(self.bot_api.calls),
+            "uploaded_bytes": self.bot_api.uploaded_bytes,
+            "upstream_requests": self.instagram.requests,
+            "upstream_bytes": self.instagram.served_bytes,
+        }, **monitor.results())
+
+    def service_stats(self) -> dict:
+        """stats() of the caches, single-flight and limiters in bot context"""
+        from tgbot.services.metrics import LINK_REUSE
+
+        stats = {}
+        for name in ("link_cache", "negative_cache", "user_cache", "singleflight",
+                     "scheduler", "media_cache", "rate_limiter", "api_governor"):
+            service = self.bot.get(name)
+            if service is not None:
+                stats[name] = service.stats()
+        stats["link_reuse"] = {key[0]: value for key, value in LINK_REUSE._values.items()}
+        return stats
+
+
+def execute(args, name: str, func) -> dict:
+    """
+    Run coroutine function func(args) in the work directory, save and
+    print the report
+    """
+    if getattr(args, "config", None):
+        args.config = str(Path(args.config).resolve())
+    started_at = datetime.datetime.now()
+    output = Path(args.output).resolve() if args.output else \
+        RESULTS / f"{name}-{started_at:%Y%m%d-%H%M%S}.json"
+
+    sys.path.insert(0, str(ROOT))
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bot-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    try:
+        results = asyncio.new_event_loop().run_until_complete(func(args))
+    finally:
+        os.chdir(ROOT)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "benchmark": name,
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {k: v for k, v in vars(args).items()
+                   if k not in ("config", "output", "workdir")},
+        "results": results,
+    }
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(json.dumps(results, indent=2))
+    print(f"Saved to {output}")
+    return report
@@ -0,0 +1,192 @@
+"""
+Benchmark of webhook mode against long polling.
+
+The same synthetic updates (scenarios of benchmarks.run) are delivered to
+the real handlers twice:
+
+- polling: queued in the Bot API stand-in and fetched by
+  Dispatcher.start_polling() through getUpdates;
+- webhook: posted to the aiohttp app of tgbot/services/webhook.py by
+  `--concurrency` connections, as Telegram does with max_connections.
+  Answers 503 (more than `--max-pending` updates in process) are posted
+  again after `--retry-delay`, as Telegram redelivers them.
+
+The report has updates per second and the latency from delivery to the
+end of processing of both modes, and the webhook answer latency and the
+number of 503 answers.
+
+    python -m benchmarks.webhook --requests 1000 --concurrency 40 --max-pending 100
+"""
+import argparse
+import asyncio
+import dataclasses
+import time
+
+from types import SimpleNamespace
+
+from benchmarks.run import SCENARIOS, UpdateFactory
+from benchmarks.stand import (Stand, LoopMonitor, add_stand_arguments, execute,
+                              measure_calls, percentile)
+
+
+class Tracker:
+    """Latency from delivery of every update to the end of its processing"""
+
+    def __init__(self, dp, total: int):
+        self.total = total
+        self.delivered = {}
+        self.latencies = []
+        self.errors = 0
+        self.done = asyncio.Event()
+        self._dp = dp
+        self._process_update = dp.process_update
+        # Webhook calls dp.process_update, polling the handler registered
+        # in updates_handler when the dispatcher was created
+        self._swap_handler(self._process_update, self.process_update)
+        dp.process_update = self.process_update
+
+    def _swap_handler(self, old, new):
+        self._dp.updates_handler.unregister(next(
+            obj.handler for obj in self._dp.updates_handler.handlers if obj.handler == old))
+        self._dp.updates_handler.register(new)
+
+    def deliver(self, update_id: int):
+        self.delivered.setdefault(update_id, time.perf_counter())
+
+    async def process_update(self, update):
+        try:
+            return await self._process_update(update)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.latencies.append(time.perf_counter() - self.delivered[update.update_id])
+            if len(self.latencies) == self.total:
+                self.done.set()
+
+    def results(self, elapsed: float) -> dict:
+        del self._dp.process_update
+        self._swap_handler(self.process_update, self._process_update)
+        return {
+            "updates": len(self.latencies),
+            "errors": self.errors,
+            "elapsed": elapsed,
+            "updates_per_sec": len(self.latencies) / elapsed if elapsed else None,
+            "latency_p50": percentile(self.latencies, 50),
+            "latency_p95": percentile(self.latencies, 95),
+            "latency_p99": percentile(self.latencies, 99),
+            "latency_max": max(self.latencies, default=None),
+        }
+
+
+def make_updates(stand: Stand, args) -> list:
+    factory = UpdateFactory(args, stand.instagram, stand.bot['me'].to_python())
+    for n in range(args.distinct):
+        stand.seed_video(factory.video_id(n))
+    return [factory.make(n) for n in range(args.requests)]
+
+
+async def bench_polling(stand: Stand, updates: list, args) -> dict:
+    tracker = Tracker(stand.dp, len(updates))
+    monitor = LoopMonitor()
+    monitor.start()
+    polling = asyncio.ensure_future(stand.dp.start_polling(timeout=1, relax=0))
+    started = time.perf_counter()
+    for update in updates:
+        tracker.deliver(update["update_id"])
+    stand.bot_api.push_updates(updates)
+    try:
+        await asyncio.wait_for(tracker.done.wait(), args.wait_timeout)
+        elapsed = time.perf_counter() - started
+    finally:
+        stand.dp.stop_polling()
+        await stand.dp.wait_closed()
+        await asyncio.gather(polling, return_exceptions=True)
+        await monitor.stop()
+    return dict(tracker.results(elapsed), **monitor.results())
+
+
+async def bench_webhook(stand: Stand, updates: list, args) -> dict:
+    from aiohttp import ClientSession, TCPConnector, web
+
+    from tgbot.services.webhook import create_webhook_app
+
+    config = stand.bot['config']
+    webhook = dataclasses.replace(config.webhook, secret_token="",
+                                  max_pending_updates=args.max_pending)
+    app = create_webhook_app(stand.dp, SimpleNamespace(webhook=webhook))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}{webhook.path}"
+
+    tracker = Tracker(stand.dp, len(updates))
+    rejected = 0
+    session = ClientSession(connector=TCPConnector(limit=args.concurrency))
+
+    async def post(update: dict):
+        nonlocal rejected
+        tracker.deliver(update["update_id"])
+        while True:
+            async with session.post(url, json=update) as resp:
+                if resp.status != 503:
+                    resp.raise_for_status()
+                    return
+            rejected += 1
+            await asyncio.sleep(args.retry_delay)
+
+    monitor = LoopMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    try:
+        answers = await measure_calls(post, updates, args.concurrency)
+        await asyncio.wait_for(tracker.done.wait(), args.wait_timeout)
+        elapsed = time.perf_counter() - started
+    finally:
+        await monitor.stop()
+        await session.close()
+        await runner.cleanup()
+    return dict(tracker.results(elapsed), **monitor.results(),
+                rejected_503=rejected,
+                answer_latency_p50=answers["latency_p50"],
+                answer_latency_p99=answers["latency_p99"])
+
+
+async def bench_modes(args) -> dict:
+    stand = Stand(args)
+    try:
+        await stand.start()
+        # Distinct links for every mode, so the second is not served by caches
+        results = {"polling": await bench_polling(stand, make_updates(stand, args), args)}
+        results["webhook"] = await bench_webhook(stand, make_updates(stand, args), args)
+        results["services"] = stand.service_stats()
+        return results
+    finally:
+        await stand.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", choices=SCENARIOS, default="instagram")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--distinct", type=int, default=100,
+                        help="distinct links, repeated ones hit singleflight and link cache")
+    parser.add_argument("--users", type=int, default=100, help="distinct users")
+    parser.add_argument("--max-pending", type=int, default=1000,
+                        help="[webhook] max_pending_updates")
+    parser.add_argument("--retry-delay", type=float, default=0.1,
+                        help="seconds before an update answered with 503 is posted again")
+    parser.add_argument("--wait-timeout", type=float, default=300,
+                        help="seconds to wait for all updates of a mode to be processed")
+    add_stand_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    execute(args, "webhook", bench_modes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark of event loop lag during YouTube metadata extraction.
+
+get_main_data() of tgbot/api/youtube.py extracts `--videos` distinct
+videos `--concurrency` at once with yt_dlp.YoutubeDL replaced by a stub,
+whose extract_info() holds the GIL for `--cpu-time` seconds (parsing of
+the pages) and waits `--io-time` seconds (requests), and returns
+`--formats` formats. Extraction is measured:
+
+- inline: extract_main_data() called on the event loop, as before the
+  executor;
+- threads: the thread pool of setup_extractor() with `--workers`;
+- processes: its process pool (extract_in_process = true).
+
+The report has extractions per second, their latency and the event loop
+lag while they run.
+
+    python -m benchmarks.youtube_extract --videos 200 --workers 4
+    python -m benchmarks.youtube_extract --cpu-time 0.05 --io-time 0 --modes threads processes
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.stand import LoopMonitor, execute, measure_calls
+
+
+MODES = ("inline", "threads", "processes")
+
+
+class FakeYoutubeDL:
+    """yt_dlp.YoutubeDL with extract_info() of a synthetic video"""
+    cpu_time = 0.01
+    io_time = 0.2
+    formats = 40
+
+    def __init__(self, params: dict = None):
+        self.params = params or {}
+
+    def extract_info(self, url: str, download: bool = True) -> dict:
+        video_id = url.rsplit("=", 1)[-1]
+        started = time.perf_counter()
+        while time.perf_counter() - started < self.cpu_time:
+            pass
+        time.sleep(self.io_time)
+        formats = []
+        for n in range(self.formats):
+            height = 144 * (n % 8 + 1)
+            formats.append({
+                "format_id": str(100 + n), "ext": "mp4" if n % 2 else "webm",
+                "width": height * 16 // 9, "height": height, "fps": 30,
+                "filesize": 1024 * 1024 * (n + 1), "quality": n,
+                "url": f"https://rr1.googlevideo.com/videoplayback?id={video_id}&itag={n}",
+                "vcodec": "avc1.4d401e" if n % 2 else "vp9", "acodec": "none",
+                "downloader_options": {"http_chunk_size": 10485760},
+            })
+        formats.append({"format_id": "140", "ext": "m4a", "vcodec": "none",
+                        "acodec": "mp4a.40.2", "filesize": 1024 * 1024, "url": ""})
+        return {"id": video_id, "title": f"Benchmark video {video_id}", "duration": 10,
+                "thumbnail": "", "channel_url": "", "channel": "", "formats": formats}
+
+
+async def bench_mode(mode: str, args, run: int) -> dict:
+    from tgbot.api import youtube
+
+    youtube.setup_extractor(workers=args.workers, use_processes=mode == "processes")
+    if mode == "inline":
+        async def extract(url: str):
+            # Other tasks run between extractions, as between updates
+            await asyncio.sleep(0)
+            youtube.extract_main_data(url)
+    else:
+        extract = youtube.get_main_data
+    # Distinct ids in every mode, so none is answered by the metadata cache
+    urls = [f"https://www.youtube.com/watch?v=bench{run}_{n:05d}" for n in range(args.videos)]
+
+    monitor = LoopMonitor()
+    monitor.start()
+    try:
+        result = await measure_calls(extract, urls, args.concurrency)
+    finally:
+        await monitor.stop()
+        youtube.shutdown_extractor()
+    return dict(result, **monitor.results())
+
+
+async def bench_extract(args) -> dict:
+    import yt_dlp
+
+    FakeYoutubeDL.cpu_time = args.cpu_time
+    FakeYoutubeDL.io_time = args.io_time
+    FakeYoutubeDL.formats = args.formats
+    # Worker processes are forked after this, so they get the stub too
+    yt_dlp.YoutubeDL = FakeYoutubeDL
+
+    results = {}
+    for run, mode in enumerate(args.modes):
+        results[mode] = await bench_mode(mode, args, run)
+        print(f"{mode}: {results[mode]['calls_per_sec']:.1f} extractions/s, "
+              f"loop lag p99 {results[mode]['loop_lag_p99']:.3f} s", flush=True)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--videos", type=int, default=100,
+                        help="extractions in every mode")
+    parser.add_argument("--concurrency", type=int, default=20,
+                        help="extractions requested at once")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="[youtube] extract_workers")
+    parser.add_argument("--cpu-time", type=float, default=0.01,
+                        help="seconds every extraction holds the GIL")
+    parser.add_argument("--io-time", type=float, default=0.2,
+                        help="seconds every extraction waits for the network")
+    parser.add_argument("--formats", type=int, default=40,
+                        help="formats of every video")
+    parser.add_argument("--workdir", help="directory of the run, temporary by default")
+    parser.add_argument("--output", help="result file, benchmarks/results/<name>-<time>.json by default")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    execute(args, "youtube_extract", bench_extract)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,9 @@
 import asyncio
-import os
+import multiprocessing
 
 from loguru import logger
 
 from aiogram import Bot, Dispatcher
-from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.contrib.fsm_storage.redis import RedisStorage2
 from aiogram.types import BotCommand
@@ -15,53 +14,21 @@ from tgbot.filters.role import AdminFilter
 from tgbot.handlers.admin import register_admin
 from tgbot.handlers.user import register_user
 from tgbot.middlewares.db import DbMiddleware
+from tgbot.middlewares.recorder import RecorderMiddleware
 from tgbot.middlewares.throtling import ThrottlingMiddleware
-from tgbot.services.database import create_db_session
-
-
-os.makedirs(os.path.join(os.getcwd(), "logs"), exist_ok=True)
-
-logger.add(
-    sink="logs/bot.log",
-    format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {name}:{file}:{line} {message}",
-    rotation="10 days",
-    retention="90 days",
-    compression="zip",
-    backtrace=True,
-    diagnose=True,
-    enqueue=True,
-    catch=True,
-    level="INFO",
-)
-
-logger.add(
-    sink="logs/error.log",
-    format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {name}:{file}:{line} {message}",
-    rotation="30 days",
-    retention="366 days",
-    compression="zip",
-    backtrace=True,
-    diagnose=True,
-    enqueue=True,
-    catch=True,
-    level="ERROR",
-)
-
-logger.add(
-    sink="logs/debug.log",
-    format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {name}:{file}:{line} {message}",
-    rotation="30 days",
-    retention="366 days",
-    compression="zip",
-    backtrace=True,
-    diagnose=True,
-    enqueue=True,
-    catch=True,
-    level="DEBUG",
-)
+from tgbot.misc.broadcast import resume_broadcasts, stop_broadcasts
+from tgbot.services.context import create_bot, setup_context, close_context
+from tgbot.services.logs import setup_logging
+from tgbot.services.metrics import start_metrics_server
+from tgbot.services.webhook import run_webhook
 
 
 def register_all_middlewares(dp):
+    recorder = dp.bot['config'].recorder
+    if recorder.enabled:
+        # First, so throttled updates are recorded too
+        dp.setup_middleware(RecorderMiddleware(
+            recorder.path, recorder.salt, recorder.keep_text))
     dp.setup_middleware(DbMiddleware())
     dp.setup_middleware(ThrottlingMiddleware())
 
@@ -82,9 +49,10 @@ async def set_bot_commands(bot: Bot):
     await bot.set_my_commands(commands, scope=BotCommandScopeDefault())
 
 
-async def main():
-    logger.success("Starting bot")
+async def main(worker: int = 0):
     config = load_config("bot.ini")
+    setup_logging(config, "bot")
+    logger.success(f"Starting bot, worker {worker}")
 
     if config.tg_bot.use_redis:
         storage = RedisStorage2(host=config.tg_bot.redis_host,
@@ -95,35 +63,53 @@ async def main():
     else:
         storage = MemoryStorage()
 
-    server = TELEGRAM_PRODUCTION
-    if config.tg_bot.bot_api_server:
-        server = TelegramAPIServer.from_base(
-            base=config.tg_bot.bot_api_server,
-        )
-
-    bot = Bot(token=config.tg_bot.token, parse_mode="HTML", server=server)
+    bot = create_bot(config)
     dp = Dispatcher(bot, storage=storage)
-
-    bot['config'] = config
-    bot['db'] = await create_db_session(config)
+    await setup_context(bot, config)
 
     register_all_middlewares(dp)
     register_all_filters(dp)
     register_all_handlers(dp)
 
-    await set_bot_commands(bot)
+    if config.metrics.enabled:
+        # Every process serves its own metrics
+        bot['metrics'] = await start_metrics_server(
+            bot, config.metrics.host, config.metrics.port + worker)
+
+    if worker == 0:
+        await set_bot_commands(bot)
+        await resume_broadcasts(bot)
 
     # start
     try:
-        await dp.start_polling()
+        if config.webhook.enabled:
+            await run_webhook(dp, config, is_main_worker=worker == 0)
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling()
     finally:
         await dp.storage.close()
         await dp.storage.wait_closed()
-        await bot.session.close()
+        await stop_broadcasts(bot)
+        await close_context(bot)
 
 
-if __name__ == '__main__':
+def run(worker: int = 0):
     try:
-        asyncio.new_event_loop().run_until_complete(main())
+        asyncio.new_event_loop().run_until_complete(main(worker))
     except (KeyboardInterrupt, SystemExit):
         logger.error("Bot stopped!")
+
+
+if __name__ == '__main__':
+    webhook = load_config("bot.ini").webhook
+    workers = webhook.workers if webhook.enabled else 1
+    # Every worker is a separate process with its own event loop,
+    # webhook server sockets share the port with SO_REUSEPORT
+    processes = [multiprocessing.Process(target=run, args=(worker,))
+                 for worker in range(1, workers)]
+    for process in processes:
+        process.start()
+    run()
+    for process in processes:
+        process.join()
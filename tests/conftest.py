@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Media directories are created in the working directory on import
+os.chdir(tempfile.mkdtemp(prefix="bot-tests-"))
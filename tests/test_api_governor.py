@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from aiogram.utils.exceptions import RetryAfter
+
+from tgbot.services.api_governor import ApiGovernor, Priority, current_priority
+
+
+def flood_request(failures: int):
+    """Request raising RetryAfter(0) failures times, then returning "ok" """
+    calls = 0
+
+    async def request():
+        nonlocal calls
+        calls += 1
+        if calls <= failures:
+            raise RetryAfter(0)
+        return "ok"
+
+    return request, lambda: calls
+
+
+@pytest.mark.parametrize("priority", [Priority.BULK, Priority.STATUS])
+def test_retry_after_is_raised_for_bulk_and_status(priority):
+    async def scenario():
+        governor = ApiGovernor(global_rate=1000)
+        request, calls = flood_request(failures=1)
+        current_priority.set(priority)
+        with pytest.raises(RetryAfter):
+            await governor.call(request, "copyMessage", {"chat_id": 1})
+        return governor, calls()
+
+    governor, calls = asyncio.run(scenario())
+    assert calls == 1
+    assert governor.retried == 0
+
+
+def test_retry_after_is_retried_for_replies():
+    async def scenario():
+        governor = ApiGovernor(global_rate=1000)
+        request, calls = flood_request(failures=2)
+        result = await governor.call(request, "sendMessage", {"chat_id": 1})
+        return governor, result, calls()
+
+    governor, result, calls = asyncio.run(scenario())
+    assert result == "ok"
+    assert calls == 3
+    assert governor.retried == 2
+
+
+def test_retry_after_pauses_the_whole_bot():
+    async def scenario():
+        governor = ApiGovernor(global_rate=1000)
+        loop = asyncio.get_event_loop()
+
+        async def request():
+            raise RetryAfter(5)
+
+        current_priority.set(Priority.BULK)
+        with pytest.raises(RetryAfter):
+            await governor.call(request, "copyMessage", {"chat_id": 1})
+        return governor._global_next - loop.time()
+
+    assert asyncio.run(scenario()) > 4
@@ -0,0 +1,173 @@
+import asyncio
+
+from types import SimpleNamespace
+
+import pytest
+
+from aiogram.bot.api import TelegramAPIServer
+
+from benchmarks.fake_bot_api import FakeBotApi
+from tgbot.misc.broadcast import Broadcaster
+from tgbot.models.broadcast import Broadcast, BroadcastStatus
+from tgbot.models.user import User
+from tgbot.services.api_governor import ApiGovernor, GovernedBot
+
+
+USERS = 100
+ADMIN_CHAT_ID = 1
+
+
+def telegram_id(user_id: int) -> int:
+    return 1000 + user_id
+
+
+class FakeUsers:
+    """Users and broadcast progress kept in memory instead of the database"""
+
+    def __init__(self, monkeypatch, count: int = USERS):
+        self.users = [SimpleNamespace(id=n, telegram_id=telegram_id(n))
+                      for n in range(1, count + 1)]
+        self.blocked = set()
+        self.checkpoints = []
+        monkeypatch.setattr(User, "iter_users", self.iter_users)
+        monkeypatch.setattr(User, "set_blocked", self.set_blocked)
+        monkeypatch.setattr(Broadcast, "save_progress", self.save_progress)
+
+    async def iter_users(self, db_session, batch_size: int = 1000,
+                         after_id: int = 0, active_only: bool = False):
+        for user in self.users:
+            if user.id > after_id and not (active_only and user.telegram_id in self.blocked):
+                yield user
+
+    async def set_blocked(self, db_session, telegram_ids: list, blocked: bool = True):
+        self.blocked.update(telegram_ids)
+
+    async def save_progress(self, db_session, broadcast_id: int, last_user_id: int,
+                            delivered: int, failed: int, blocked: int,
+                            status: str = BroadcastStatus.RUNNING):
+        self.checkpoints.append((last_user_id, delivered, failed, blocked, status))
+
+
+class RecordingBroadcaster(Broadcaster):
+    """Broadcaster remembering its rate before and after every flood control"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.slowdowns = []
+
+    def _slow_down(self, retry_after: int):
+        rate = self.rate
+        super()._slow_down(retry_after)
+        self.slowdowns.append((rate, self.rate))
+
+
+def broadcast_row(last_user_id: int = 0) -> SimpleNamespace:
+    return SimpleNamespace(id=1, last_user_id=last_user_id, delivered=0, failed=0,
+                           blocked=0, from_chat_id=ADMIN_CHAT_ID, message_id=1)
+
+
+async def run_broadcast(api: FakeBotApi, broadcast, governor: ApiGovernor = None,
+                        prepare=None, **kwargs) -> RecordingBroadcaster:
+    base = await api.start()
+    bot = GovernedBot(token="123456:TEST", server=TelegramAPIServer.from_base(base))
+    bot['api_governor'] = governor
+    if prepare:
+        prepare(api, bot)
+    broadcaster = RecordingBroadcaster(bot, None, broadcast, **kwargs)
+    try:
+        await broadcaster.run()
+    finally:
+        await api.stop()
+        await (await bot.get_session()).close()
+    return broadcaster
+
+
+def test_all_users_receive_the_message(monkeypatch):
+    users = FakeUsers(monkeypatch)
+    api = FakeBotApi()
+    broadcaster = asyncio.run(run_broadcast(api, broadcast_row(), rate=1000, max_rate=1000))
+    assert broadcaster.stats.delivered == USERS
+    assert api.calls["copyMessage"] == USERS
+    assert all(api.chats[telegram_id(n)] == 1 for n in range(1, USERS + 1))
+    assert users.checkpoints[-1] == (USERS, USERS, 0, 0, BroadcastStatus.FINISHED)
+
+
+def test_flood_control_halves_the_rate_and_it_recovers(monkeypatch):
+    FakeUsers(monkeypatch)
+    api = FakeBotApi()
+
+    def prepare(api, bot):
+        api.fail(telegram_id(10), 429, "Too Many Requests: retry after 1", retry_after=1)
+
+    # RetryAfter of broadcasts reaches the broadcaster through the governor
+    governor = ApiGovernor(global_rate=10000, chat_interval=0)
+    broadcaster = asyncio.run(run_broadcast(
+        api, broadcast_row(), governor, prepare, rate=200, max_rate=400, concurrency=5))
+    assert len(broadcaster.slowdowns) == 1
+    before, after = broadcaster.slowdowns[0]
+    assert after == pytest.approx(before / 2)
+    assert broadcaster.rate > after
+    assert broadcaster.stats.delivered == USERS
+    # The message was sent again to the chat after the pause
+    assert api.chats[telegram_id(10)] == 1
+    assert governor.retried == 0
+
+
+def test_blocked_users_are_marked(monkeypatch):
+    users = FakeUsers(monkeypatch)
+    api = FakeBotApi()
+    blocked = {telegram_id(n) for n in (3, 50, 99)}
+
+    def prepare(api, bot):
+        for chat_id in blocked:
+            api.fail(chat_id, 403, "Forbidden: bot was blocked by the user")
+
+    broadcaster = asyncio.run(run_broadcast(
+        api, broadcast_row(), prepare=prepare, rate=1000, max_rate=1000,
+        checkpoint_every=10))
+    assert users.blocked == blocked
+    assert broadcaster.stats.blocked == len(blocked)
+    assert broadcaster.stats.delivered == USERS - len(blocked)
+
+
+def test_resume_skips_delivered_users(monkeypatch):
+    users = FakeUsers(monkeypatch)
+    api = FakeBotApi()
+    broadcaster = asyncio.run(run_broadcast(
+        api, broadcast_row(last_user_id=60), rate=1000, max_rate=1000))
+    assert broadcaster.stats.delivered == USERS - 60
+    assert not any(api.chats[telegram_id(n)] for n in range(1, 61))
+    assert all(api.chats[telegram_id(n)] == 1 for n in range(61, USERS + 1))
+    assert users.checkpoints[-1][0] == USERS
+
+
+def test_checkpoints_never_skip_messages_in_flight(monkeypatch):
+    users = FakeUsers(monkeypatch)
+    api = FakeBotApi(latency=0.01)
+    asyncio.run(run_broadcast(api, broadcast_row(), rate=1000, max_rate=1000,
+                              concurrency=10, checkpoint_every=7))
+    last_user_ids = [checkpoint[0] for checkpoint in users.checkpoints]
+    assert last_user_ids == sorted(last_user_ids)
+    # Every checkpoint is behind the deliveries it counts
+    for last_user_id, delivered, *_ in users.checkpoints:
+        assert last_user_id <= delivered
+
+
+def test_unexpected_errors_are_counted_as_failed(monkeypatch):
+    FakeUsers(monkeypatch)
+    api = FakeBotApi()
+
+    def prepare(api, bot):
+        copy_message = bot.copy_message
+
+        async def flaky_copy_message(chat_id, *args, **kwargs):
+            if chat_id == telegram_id(5):
+                raise asyncio.TimeoutError()
+            return await copy_message(chat_id, *args, **kwargs)
+
+        bot.copy_message = flaky_copy_message
+
+    broadcaster = asyncio.run(run_broadcast(
+        api, broadcast_row(), prepare=prepare, rate=1000, max_rate=1000))
+    assert broadcaster.stats.failed == 1
+    assert broadcaster.stats.delivered == USERS - 1
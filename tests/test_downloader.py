@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+from types import SimpleNamespace
+
+from aiogram import Bot
+from aiogram.bot.api import TelegramAPIServer
+from aiogram.types import Message
+
+from benchmarks.fake_bot_api import FakeBotApi
+from tgbot.api.extractor import CODES, Extractors
+from tgbot.api.instagram import Instagram
+from tgbot.config import Instagram as InstagramConfig
+from tgbot.handlers.user import user_downloader
+from tgbot.misc.singleflight import SingleFlight
+from tgbot.models.file import File
+from tgbot.models.link import Link
+from tgbot.services.link_cache import LinkCache
+from tgbot.services.media_cache import MediaCache
+from tgbot.services.negative_cache import NegativeCache
+from tgbot.services.scheduler import JobScheduler
+
+
+N = 20
+URL = "https://www.instagram.com/p/Cabc123/?igshid=share"
+IMAGE = b"\xff\xd8" + b"\0" * 1024
+
+
+def message(n: int, text: str) -> dict:
+    user = {"id": 100 + n, "is_bot": False, "first_name": f"User{n}"}
+    return {"message_id": n + 1, "date": int(time.time()),
+            "chat": dict(user, type="private"), "from": user, "text": text}
+
+
+async def downloader_scenario(tmp_path, monkeypatch, urls: list) -> tuple:
+    """Handle messages with urls concurrently, returns (upstream calls, fake Bot API)"""
+    image_path = tmp_path / "image.jpg"
+    image_path.write_bytes(IMAGE)
+    upstream_calls = 0
+
+    async def download_post(self, url: str, new_cookie=False):
+        nonlocal upstream_calls
+        upstream_calls += 1
+        await asyncio.sleep(0.05)
+        return CODES.DOWNLOADED.value, {"path": str(image_path), "file_type": "image"}
+
+    async def add_file(db_session, file):
+        file.id = 1
+        return file
+
+    async def add_link(db_session, link):
+        return link
+
+    async def get_link_file(db_session, url):
+        return None
+
+    monkeypatch.setattr(Instagram, "download_post", download_post)
+    monkeypatch.setattr(File, "add_file", add_file)
+    monkeypatch.setattr(Link, "add_link", add_link)
+    monkeypatch.setattr(Link, "get_link_file", get_link_file)
+
+    api = FakeBotApi()
+    bot = Bot(token="123456:TEST", server=TelegramAPIServer.from_base(await api.start()))
+    Bot.set_current(bot)
+    bot['config'] = SimpleNamespace(instagram=InstagramConfig(username="", password=""))
+    bot['me'] = await bot.get_me()
+    bot['db'] = None
+    bot['http'] = None
+    bot['job_queue'] = None
+    bot['singleflight'] = SingleFlight()
+    bot['link_cache'] = LinkCache()
+    bot['negative_cache'] = NegativeCache()
+    bot['media_cache'] = MediaCache(str(tmp_path), max_bytes=1024 ** 3)
+    bot['scheduler'] = JobScheduler(io_workers=2, cpu_workers=1)
+    await bot['scheduler'].start()
+    bot['extractors'] = Extractors(bot)
+    try:
+        api.reset()
+        await asyncio.gather(*[
+            user_downloader(Message.to_object(message(n, url)), SimpleNamespace(id=n))
+            for n, url in enumerate(urls)])
+    finally:
+        await bot['scheduler'].stop()
+        await bot['link_cache'].stop()
+        await api.stop()
+        await (await bot.get_session()).close()
+    return upstream_calls, api
+
+
+def test_concurrent_identical_links_download_once(tmp_path, monkeypatch):
+    upstream_calls, api = asyncio.run(
+        downloader_scenario(tmp_path, monkeypatch, [URL] * N))
+    assert upstream_calls == 1
+    # Every user gets the photo, but the file is uploaded only once
+    assert api.calls["sendPhoto"] == N
+    assert api.uploaded_bytes == len(IMAGE)
+
+
+def test_links_of_the_same_post_download_once(tmp_path, monkeypatch):
+    forms = ["https://www.instagram.com/p/Cabc123/",
+             "https://instagram.com/reel/Cabc123/?utm_source=ig_web_copy_link",
+             "https://m.instagram.com/p/Cabc123"]
+    upstream_calls, api = asyncio.run(
+        downloader_scenario(tmp_path, monkeypatch, forms * (N // len(forms))))
+    assert upstream_calls == 1
+    assert api.uploaded_bytes == len(IMAGE)
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+
+from tgbot.api.extractor import CODES
+from tgbot.api.instagram import Instagram
+
+
+async def get_post(response: web.Response) -> int or dict:
+    """Result of get_post() when Instagram answers with the response"""
+    async def post(request):
+        return response
+
+    app = web.Application()
+    app.router.add_get("/p/{post_id}/", post)
+    async with TestServer(app) as server, ClientSession() as session:
+        instagram = Instagram("", "", session, api_base=str(server.make_url("")).rstrip("/"))
+        return await instagram.get_post("Cabc123")
+
+
+@pytest.mark.parametrize("response, code", [
+    (lambda: web.Response(status=404), CODES.NOT_FOUND),
+    (lambda: web.Response(status=429, text="Please wait a few minutes"), CODES.COULD_NOT_DOWNLOAD),
+    (lambda: web.Response(status=502, text="<html>Bad gateway</html>"), CODES.COULD_NOT_DOWNLOAD),
+    (lambda: web.Response(text="<html>Login • Instagram</html>", content_type="text/html"),
+     CODES.COULD_NOT_LOGIN),
+    (lambda: web.json_response({"items": []}), CODES.COULD_NOT_LOGIN),
+])
+def test_failed_post_requests_return_codes(response, code):
+    assert asyncio.run(get_post(response())) == code.value
+
+
+def test_post_image_is_found():
+    data = {"items": [{"image_versions2": {"candidates": [{"url": "https://cdn/a.jpg"}]}}]}
+    post = asyncio.run(get_post(web.json_response(data)))
+    assert post == {"file_type": "image", "media": [{"image": "https://cdn/a.jpg"}]}
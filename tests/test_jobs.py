@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+from types import SimpleNamespace
+
+from aiogram import Bot
+from aiogram.bot.api import TelegramAPIServer
+
+import tgbot.handlers.jobs as jobs
+
+from benchmarks.fake_bot_api import FakeBotApi
+from tgbot.api.extractor import CODES, Extractors
+from tgbot.config import Instagram as InstagramConfig
+from tgbot.misc.singleflight import SingleFlight
+from tgbot.models.link import Link
+from tgbot.services.job_queue import QueuedJob
+from tgbot.services.link_cache import LinkCache
+from tgbot.services.negative_cache import NegativeCache
+from worker import process_job
+
+
+URL = "https://www.instagram.com/p/Cabc123/"
+CHAT_ID = 100
+
+
+class FakeQueue:
+    """Job queue recording what the worker did with the job"""
+    max_attempts = 3
+    visibility_timeout = 600
+
+    def __init__(self):
+        self.acked = []
+        self.nacked = []
+
+    async def ack(self, job: QueuedJob):
+        self.acked.append(job.id)
+
+    async def nack(self, job: QueuedJob):
+        self.nacked.append(job.id)
+
+    async def extend(self, job: QueuedJob):
+        pass
+
+
+def media_job(attempts: int) -> QueuedJob:
+    user = {"id": CHAT_ID, "is_bot": False, "first_name": "User"}
+    message = {"message_id": 1, "date": int(time.time()),
+               "chat": dict(user, type="private"), "from": user, "text": URL}
+    return QueuedJob("job1", {"type": "media", "message": message, "url": URL,
+                              "status_message_id": 2}, attempts)
+
+
+async def process_media_job(monkeypatch, code: int, attempts: int) -> tuple:
+    """Process the job whose download fails with code, returns (queue, API)"""
+    async def media_download_and_send(*args, **kwargs):
+        return code
+
+    async def get_link_file(db_session, url):
+        return None
+
+    async def get_user(db_session, user):
+        return SimpleNamespace(id=1)
+
+    monkeypatch.setattr(jobs, "media_download_and_send", media_download_and_send)
+    monkeypatch.setattr(Link, "get_link_file", get_link_file)
+
+    api = FakeBotApi()
+    bot = Bot(token="123456:TEST", server=TelegramAPIServer.from_base(await api.start()))
+    Bot.set_current(bot)
+    bot['config'] = SimpleNamespace(instagram=InstagramConfig(username="", password=""))
+    bot['db'] = None
+    bot['http'] = None
+    bot['user_cache'] = SimpleNamespace(get_user=get_user)
+    bot['link_cache'] = LinkCache()
+    bot['negative_cache'] = NegativeCache()
+    bot['singleflight'] = SingleFlight()
+    bot['extractors'] = Extractors(bot)
+    queue = FakeQueue()
+    try:
+        await process_job(bot, queue, media_job(attempts))
+    finally:
+        await bot['link_cache'].stop()
+        await api.stop()
+        await (await bot.get_session()).close()
+    return queue, api
+
+
+def test_transient_failure_is_retried(monkeypatch):
+    queue, api = asyncio.run(process_media_job(
+        monkeypatch, CODES.COULD_NOT_DOWNLOAD.value, attempts=1))
+    assert queue.nacked == ["job1"]
+    assert queue.acked == []
+    # The user is not told yet
+    assert sum(api.calls.values()) == 0
+
+
+def test_transient_failure_of_the_last_attempt_is_reported(monkeypatch):
+    queue, api = asyncio.run(process_media_job(
+        monkeypatch, CODES.COULD_NOT_DOWNLOAD.value, attempts=3))
+    assert queue.acked == ["job1"]
+    assert queue.nacked == []
+    assert api.calls["editMessageText"] == 1
+
+
+def test_missing_media_is_not_retried(monkeypatch):
+    queue, api = asyncio.run(process_media_job(
+        monkeypatch, CODES.NOT_FOUND.value, attempts=1))
+    assert queue.acked == ["job1"]
+    assert queue.nacked == []
+    assert api.calls["editMessageText"] == 1
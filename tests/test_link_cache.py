@@ -0,0 +1,127 @@
+import asyncio
+
+from types import SimpleNamespace
+
+from aioredis.exceptions import ConnectionError as RedisConnectionError
+
+from tgbot.models.file import File
+from tgbot.models.link import Link
+from tgbot.services.link_cache import CachedFile, LinkCache
+
+
+class FakePubSub:
+    def __init__(self, redis: 'FakeRedis'):
+        self.redis = redis
+
+    async def subscribe(self, channel: str):
+        self.redis.subscribes += 1
+        if self.redis.refused:
+            self.redis.refused -= 1
+            raise ConnectionError("Connection refused")
+
+    async def listen(self):
+        while True:
+            message = await self.redis.messages.get()
+            if isinstance(message, Exception):
+                raise message
+            yield {"type": "message", "data": message.encode()}
+
+    async def reset(self):
+        pass
+
+
+class FakeRedis:
+    """Pub/sub of Redis whose connection can be broken"""
+
+    def __init__(self, refused: int = 0):
+        self.refused = refused
+        self.subscribes = 0
+        self.messages = asyncio.Queue()
+
+    def pubsub(self) -> FakePubSub:
+        return FakePubSub(self)
+
+
+async def wait_for(condition):
+    while not condition():
+        await asyncio.sleep(0.001)
+
+
+def test_file_change_drops_only_its_links():
+    async def scenario():
+        cache = LinkCache()
+        try:
+            await cache.put("instagram:a", CachedFile("image", "f1", "a.jpg"))
+            await cache.put("instagram:b", CachedFile("image", "f1", "a.jpg"))
+            await cache.put("instagram:c", CachedFile("video", "f2", "c.mp4"))
+            await File.notify_change("f1")
+            return sorted(cache._local)
+        finally:
+            await cache.stop()
+
+    assert asyncio.run(scenario()) == ["instagram:c"]
+
+
+def test_listener_reconnects_and_clears_local_entries():
+    async def scenario():
+        redis = FakeRedis(refused=1)
+        cache = LinkCache(redis=redis)
+        cache.min_reconnect_delay = 0.01
+        cache._put_local("instagram:a", CachedFile("image", "f1", "a.jpg"))
+        cache._put_local("instagram:b", CachedFile("image", "f2", "b.jpg"))
+        await cache.start()
+        try:
+            # Refused first, entries cached before are not trusted
+            await wait_for(lambda: redis.subscribes == 2)
+            assert len(cache._local) == 0
+
+            cache._put_local("instagram:a", CachedFile("image", "f1", "a.jpg"))
+            cache._put_local("instagram:b", CachedFile("image", "f2", "b.jpg"))
+            await redis.messages.put("f1")
+            await wait_for(lambda: "instagram:a" not in cache._local)
+            assert "instagram:b" in cache._local
+
+            await redis.messages.put(ConnectionError("Connection lost"))
+            await wait_for(lambda: redis.subscribes == 3)
+            await asyncio.sleep(0)
+            return len(cache._local)
+        finally:
+            await cache.stop()
+
+    assert asyncio.run(scenario()) == 0
+
+
+class BrokenRedis:
+    """Redis which is down"""
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            raise RedisConnectionError("Connection refused")
+        return command
+
+
+def test_redis_errors_fall_back_to_memory_and_database(monkeypatch):
+    queries = []
+
+    async def get_link_file(db_session, url):
+        queries.append(url)
+        return SimpleNamespace(type="image", telegram_file_id="f1", path="a.jpg")
+
+    monkeypatch.setattr(Link, "get_link_file", get_link_file)
+
+    async def scenario():
+        cache = LinkCache(redis=BrokenRedis())
+        try:
+            first = await cache.get(None, "instagram:a")
+            second = await cache.get(None, "instagram:a")
+            await cache.invalidate_file("f1")
+            return cache, first, second
+        finally:
+            await cache.stop()
+
+    cache, first, second = asyncio.run(scenario())
+    assert first.telegram_file_id == second.telegram_file_id == "f1"
+    # The second lookup is answered by the local cache
+    assert queries == ["instagram:a"]
+    assert "instagram:a" not in cache._local
+    assert cache.stats()["redis_errors"] == 3
@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+from tgbot.services.media_cache import MediaCache
+
+
+SIZE = 100
+
+
+def media_cache(tmp_path, names: list, max_bytes: int) -> MediaCache:
+    """Cache of files of SIZE bytes, all old enough to be evicted"""
+    cache = MediaCache(str(tmp_path), max_bytes=max_bytes, low_watermark=1.0)
+    for n, name in enumerate(names):
+        path = tmp_path / name
+        path.write_bytes(b"\0" * SIZE)
+        cache.add(str(path)).last_access = time.time() - 3600 + n
+    # Scores follow last_access, so the heap is rebuilt after changing it
+    cache._heap.clear()
+    for entry in cache._entries.values():
+        cache._push(entry)
+    return cache
+
+
+def test_uploaded_and_unpopular_files_are_evicted_first(tmp_path):
+    async def scenario():
+        cache = media_cache(tmp_path, ["a", "b", "c", "d", "e"], max_bytes=10 * SIZE)
+        cache.mark_uploaded(str(tmp_path / "d"))
+        cache.touch(str(tmp_path / "a"))
+        cache.max_bytes = 3 * SIZE
+        await cache.evict()
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["a", "c", "e"]
+    assert cache.total_bytes == 3 * SIZE
+    assert cache.evicted == 2
+
+
+def test_young_files_are_kept(tmp_path):
+    async def scenario():
+        cache = media_cache(tmp_path, ["a", "b"], max_bytes=10 * SIZE)
+        cache.add(str(tmp_path / "a"))
+        cache.max_bytes = SIZE
+        await cache.evict()
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["a"]
+    # The young file is evicted later, when it is old enough
+    assert len(cache._heap) >= len(cache) == 1
+
+
+class FakeLock:
+    def __init__(self, free: bool):
+        self.free = free
+        self.held = False
+
+    async def acquire(self) -> bool:
+        self.held = self.held or self.free
+        return self.held
+
+    async def release(self):
+        self.held = False
+
+
+def test_only_the_lock_owner_evicts(tmp_path):
+    async def scenario(lock):
+        cache = media_cache(tmp_path, ["a", "b"], max_bytes=10 * SIZE)
+        cache.lock = lock
+        cache.max_bytes = SIZE
+        return await cache.evict()
+
+    assert asyncio.run(scenario(FakeLock(free=False))) == 0
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["a", "b"]
+
+    lock = FakeLock(free=True)
+    lock.held = True
+    assert asyncio.run(scenario(lock)) == 1
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["b"]
+
+
+def test_load_marks_uploaded_and_refresh_counts_files_of_others(tmp_path):
+    async def uploaded():
+        yield str(tmp_path / "a")
+
+    async def scenario():
+        for name in ("a", "b"):
+            (tmp_path / name).write_bytes(b"\0" * SIZE)
+        cache = MediaCache(str(tmp_path), max_bytes=10 * SIZE, lock=FakeLock(free=True))
+        await cache.load(uploaded())
+        assert cache.lock.held
+        assert [entry.uploaded for _, entry in sorted(cache._entries.items())] == [True, False]
+
+        # Saved and deleted by other processes
+        (tmp_path / "c").write_bytes(b"\0" * 2 * SIZE)
+        (tmp_path / "b").unlink()
+        await cache.refresh()
+        await cache.stop()
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert sorted(cache._entries) == [str(tmp_path / "a"), str(tmp_path / "c")]
+    assert cache.total_bytes == 3 * SIZE
+    assert not cache.lock.held
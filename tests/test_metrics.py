@@ -0,0 +1,54 @@
+import asyncio
+import socket
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from tgbot.services.metrics import start_metrics_server
+from tgbot.services.scheduler import JobKind, JobScheduler
+
+
+async def ready(scheduler: JobScheduler) -> tuple:
+    """Status and body of /ready of a bot with the scheduler"""
+    bot = {"scheduler": scheduler}
+    runner = await start_metrics_server(bot, "127.0.0.1", 0)
+    try:
+        async with TestClient(TestServer(runner.app)) as client:
+            response = await client.get("/ready")
+            return response.status, await response.json()
+    finally:
+        await runner.cleanup()
+
+
+def test_ready_checks_every_queue_against_its_own_limit():
+    async def scenario():
+        # No workers, so submitted jobs stay queued
+        scheduler = JobScheduler(io_workers=0, cpu_workers=0, max_queue=2)
+        await scheduler.start()
+        try:
+            never = asyncio.Event().wait
+            scheduler.submit(JobKind.IO, never)
+            idle = await ready(scheduler)
+            scheduler.submit(JobKind.CPU, never)
+            scheduler.submit(JobKind.CPU, never)
+            full = await ready(scheduler)
+        finally:
+            await scheduler.stop()
+        return idle, full
+
+    (idle_status, idle), (full_status, full) = asyncio.run(scenario())
+    assert idle_status == 200
+    assert idle["queue"]["scheduler"] == {"io": 1, "cpu": 0}
+    # Three jobs are below the combined limit, but the CPU queue is full
+    assert full_status == 503
+    assert full["full"] == ["cpu"]
+
+
+def test_taken_port_is_not_fatal():
+    async def scenario():
+        with socket.socket() as taken:
+            taken.bind(("127.0.0.1", 0))
+            taken.listen()
+            port = taken.getsockname()[1]
+            return await start_metrics_server({}, "127.0.0.1", port)
+
+    assert asyncio.run(scenario()) is None
@@ -0,0 +1,54 @@
+import asyncio
+
+from aioredis.exceptions import ConnectionError as RedisConnectionError
+
+from tgbot.api.extractor import CODES
+from tgbot.handlers.user import youtube_failure
+from tgbot.misc.media_key import MediaKey, YOUTUBE
+from tgbot.services.negative_cache import NegativeCache
+
+
+VIDEO_ID = "dQw4w9WgXcQ"
+KEY = MediaKey(YOUTUBE, VIDEO_ID)
+
+
+def test_failed_format_does_not_hide_other_formats():
+    async def scenario():
+        cache = NegativeCache(ttls={CODES.NOT_FOUND.value: 3600})
+        await cache.put(KEY.variant("video", "137"), CODES.ERROR.value)
+        return (await cache.get(str(KEY)),
+                await youtube_failure(cache, VIDEO_ID, "video", "137"),
+                await youtube_failure(cache, VIDEO_ID, "audio", "140"))
+
+    assert asyncio.run(scenario()) == (None, CODES.ERROR.value, None)
+
+
+def test_missing_video_fails_every_format():
+    async def scenario():
+        cache = NegativeCache(ttls={CODES.NOT_FOUND.value: 3600})
+        await cache.put(str(KEY), CODES.NOT_FOUND.value)
+        return await youtube_failure(cache, VIDEO_ID, "audio", "140")
+
+    assert asyncio.run(scenario()) == CODES.NOT_FOUND.value
+
+
+class BrokenRedis:
+    """Redis which is down"""
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            raise RedisConnectionError("Connection refused")
+        return command
+
+
+def test_redis_errors_fall_back_to_memory():
+    async def scenario():
+        cache = NegativeCache(redis=BrokenRedis(), ttls={CODES.NOT_FOUND.value: 3600})
+        missing = await cache.get(str(KEY))
+        await cache.put(str(KEY), CODES.NOT_FOUND.value)
+        return cache, missing, await cache.get(str(KEY))
+
+    cache, missing, stored = asyncio.run(scenario())
+    assert missing is None
+    assert stored == CODES.NOT_FOUND.value
+    assert cache.stats()["redis_errors"] == 2
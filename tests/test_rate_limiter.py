@@ -0,0 +1,143 @@
+import asyncio
+
+from types import SimpleNamespace
+
+import pytest
+
+from aiogram.dispatcher.handler import CancelHandler, current_handler
+from aioredis.exceptions import ConnectionError as RedisConnectionError
+
+import tgbot.services.rate_limiter as rate_limiter
+
+from tgbot.handlers.user import user_downloader, user_start, yt_callback_download
+from tgbot.middlewares.throtling import ThrottlingMiddleware
+from tgbot.services.rate_limiter import Bucket, RateLimiter
+
+
+NOW = 1_000_000.0
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=NOW)
+    monkeypatch.setattr(rate_limiter.time, "time", lambda: clock.now)
+    return clock
+
+
+def limiter(user=Bucket(10, 1), chat=Bucket(100, 10), global_=Bucket(1000, 100),
+            redis=None) -> RateLimiter:
+    return RateLimiter(user=user, chat=chat, global_=global_, redis=redis)
+
+
+def test_bucket_refill_is_capped():
+    bucket = Bucket(capacity=10, rate=2)
+    assert bucket.refill(0, ts=NOW, now=NOW + 3) == 6
+    assert bucket.refill(8, ts=NOW, now=NOW + 3) == 10
+    # Clocks of other instances may be behind
+    assert bucket.refill(4, ts=NOW, now=NOW - 1) == 4
+
+
+def test_denied_action_takes_no_tokens(clock):
+    async def scenario():
+        limits = limiter()
+        results = [await limits.check(1, 1, cost=5) for _ in range(3)]
+        state = await limits.inspect(1, 1)
+        clock.now += 5
+        results.append(await limits.check(1, 1, cost=5))
+        return results, state, limits.stats()
+
+    results, state, stats = asyncio.run(scenario())
+    assert results[:2] == [None, None]
+    assert results[2].scope == "user"
+    assert results[2].retry_after == pytest.approx(5)
+    assert results[3] is None
+    assert state["user"]["tokens"] == 0
+    assert state["chat"]["tokens"] == 90
+    assert stats["allowed"] == 3
+    assert stats["limited"] == {"user": 1, "chat": 0, "global": 0}
+
+
+def test_global_bucket_is_shared_by_users(clock):
+    async def scenario():
+        limits = limiter(global_=Bucket(10, 2))
+        return [await limits.check(user_id, user_id, cost=5) for user_id in range(3)]
+
+    results = asyncio.run(scenario())
+    assert results[:2] == [None, None]
+    assert results[2].scope == "global"
+    assert results[2].retry_after == pytest.approx(2.5)
+
+
+def test_cost_of_handlers():
+    def cost(handler, callback_data: dict = None) -> float:
+        async def scenario():
+            current_handler.set(handler)
+            return ThrottlingMiddleware().get_cost(None, {"callback_data": callback_data})
+
+        return asyncio.run(scenario())
+
+    assert cost(user_start) == 1
+    assert cost(user_downloader) == 5
+    assert cost(yt_callback_download, {"type": "video", "height": "1080"}) == 15
+    assert cost(yt_callback_download, {"type": "video", "height": "144"}) == 5
+    assert cost(yt_callback_download, {"type": "audio", "height": "0"}) == 5
+
+
+class BrokenRedis:
+    """Redis which is down"""
+
+    def register_script(self, script: str):
+        async def call(*args, **kwargs):
+            raise RedisConnectionError("Connection refused")
+
+        return call
+
+
+def test_redis_errors_fall_back_to_memory(clock):
+    async def scenario():
+        limits = limiter(redis=BrokenRedis())
+        return [await limits.check(1, 1, cost=5) for _ in range(3)], limits.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert results[:2] == [None, None]
+    assert results[2].scope == "user"
+    assert stats["local_buckets"] == 3
+
+
+class FakeMessage:
+    def __init__(self, limits: RateLimiter):
+        self.bot = {"rate_limiter": limits}
+        self.from_user = SimpleNamespace(id=1)
+        self.chat = SimpleNamespace(id=1)
+        self.message = SimpleNamespace(chat=self.chat)
+        self.replies = []
+
+    async def reply(self, text: str):
+        self.replies.append(text)
+
+    async def answer(self, text: str, show_alert: bool = False):
+        self.replies.append(text)
+
+
+def test_middleware_rejects_with_wait_time(clock):
+    async def scenario():
+        current_handler.set(user_downloader)
+        middleware = ThrottlingMiddleware()
+        message = FakeMessage(limiter())
+        cancelled = 0
+        for _ in range(4):
+            try:
+                await middleware.on_process_message(message, {})
+            except CancelHandler:
+                cancelled += 1
+        cb = FakeMessage(limiter(user=Bucket(100, 10), global_=Bucket(5, 1)))
+        await middleware.on_process_callback_query(cb, {})
+        with pytest.raises(CancelHandler):
+            await middleware.on_process_callback_query(cb, {})
+        return cancelled, message.replies, cb.replies
+
+    cancelled, replies, cb_replies = asyncio.run(scenario())
+    assert cancelled == 2
+    # The user is told once per notify interval
+    assert replies == ["Please, do not spam! Try again in 5 sec."]
+    assert cb_replies == ["Bot is busy right now. Please try again in 5 sec."]
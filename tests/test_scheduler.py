@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from tgbot.services.scheduler import JobKind, JobScheduler, QueueFull
+
+
+def test_full_queue_rejects_jobs():
+    async def scenario():
+        scheduler = JobScheduler(io_workers=1, cpu_workers=1, max_queue=2)
+        await scheduler.start()
+        release = asyncio.Event()
+        # Workers have not taken anything yet, both jobs are in the queue
+        jobs = [scheduler.submit(JobKind.IO, release.wait) for _ in range(2)]
+        assert scheduler.is_full(JobKind.IO)
+        with pytest.raises(QueueFull):
+            scheduler.submit(JobKind.IO, release.wait)
+        # The other kind has its own queue
+        cpu_job = scheduler.submit(JobKind.CPU, release.wait)
+        release.set()
+        await asyncio.gather(*jobs, cpu_job)
+        stats = scheduler.stats()
+        await scheduler.stop()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats["io"]["rejected"] == 1
+    assert stats["io"]["completed"] == 2
+    assert stats["cpu"]["completed"] == 1
+
+
+def test_cpu_jobs_do_not_take_io_workers():
+    async def scenario():
+        scheduler = JobScheduler(io_workers=1, cpu_workers=2, max_queue=10)
+        await scheduler.start()
+        release = asyncio.Event()
+        cpu_jobs = [scheduler.submit(JobKind.CPU, release.wait) for _ in range(3)]
+
+        async def fetch():
+            return "fetched"
+
+        result = await asyncio.wait_for(scheduler.run(JobKind.IO, fetch), 1)
+        running = scheduler.stats()["cpu"]["running"]
+        depth = scheduler.depth(JobKind.CPU)
+        release.set()
+        await asyncio.gather(*cpu_jobs)
+        await scheduler.stop()
+        return result, running, depth
+
+    assert asyncio.run(scenario()) == ("fetched", 2, 3)
+
+
+def test_position_and_eta():
+    async def scenario():
+        scheduler = JobScheduler(io_workers=2, cpu_workers=1, max_queue=10)
+        await scheduler.start()
+        release = asyncio.Event()
+        jobs = [scheduler.submit(JobKind.IO, release.wait) for _ in range(5)]
+        scheduler._stats[JobKind.IO].duration_avg = 10
+        result = [(job.position, scheduler.eta(job)) for job in jobs]
+        release.set()
+        await asyncio.gather(*jobs)
+        await scheduler.stop()
+        return result
+
+    # Two jobs start at once, every next one waits for a job to finish
+    assert asyncio.run(scenario()) == [(0, 10), (0, 10), (1, 20), (2, 20), (3, 30)]
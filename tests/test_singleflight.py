@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from tgbot.misc.singleflight import SingleFlight, AlreadyInFlight
+
+
+N = 50
+
+
+def test_concurrent_identical_calls_fetch_once():
+    calls = 0
+
+    async def fetch(value):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return value
+
+    async def scenario():
+        singleflight = SingleFlight()
+        results = await asyncio.gather(*[
+            singleflight.do("key", fetch, "result", member=n) for n in range(N)])
+        return singleflight, results
+
+    singleflight, results = asyncio.run(scenario())
+    assert calls == 1
+    assert all(result == "result" for result, _ in results)
+    assert sum(shared for _, shared in results) == N - 1
+    assert singleflight.stats() == {"in_flight": 0, "leaders": 1,
+                                    "followers": N - 1, "reelections": 0}
+
+
+def test_leader_error_is_shared():
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream")
+
+    async def scenario():
+        singleflight = SingleFlight()
+        return await asyncio.gather(
+            *[singleflight.do("key", fetch) for _ in range(N)],
+            return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert calls == 1
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_repeated_member_raises():
+    async def scenario():
+        singleflight = SingleFlight()
+        started = asyncio.Event()
+
+        async def fetch():
+            started.set()
+            await asyncio.sleep(0.05)
+            return "result"
+
+        leader = asyncio.ensure_future(singleflight.do("key", fetch, member=1))
+        await started.wait()
+        assert singleflight.is_waiting("key", 1)
+        with pytest.raises(AlreadyInFlight):
+            await singleflight.do("key", fetch, member=1)
+        # Another member of the same key joins the call
+        assert await singleflight.do("key", fetch, member=2) == ("result", True)
+        assert await leader == ("result", False)
+        assert not singleflight.is_waiting("key", 1)
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def scenario():
+        singleflight = SingleFlight()
+        leader = asyncio.ensure_future(singleflight.do("key", fetch, member=0))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(singleflight.do("key", fetch, member=n))
+                     for n in range(1, N)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        results = await asyncio.gather(*followers)
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return singleflight, results
+
+    singleflight, results = asyncio.run(scenario())
+    # The cancelled download is started again once by a new leader
+    assert calls == 2
+    assert [result for result, _ in results] == ["result"] * (N - 1)
+    assert sum(not shared for _, shared in results) == 1
+    assert singleflight.stats()["in_flight"] == 0
+    assert singleflight.reelections == N - 1
+
+
+def test_cancelled_follower_does_not_cancel_leader():
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def scenario():
+        singleflight = SingleFlight()
+        leader = asyncio.ensure_future(singleflight.do("key", fetch, member=0))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(singleflight.do("key", fetch, member=1))
+        await asyncio.sleep(0.01)
+        follower.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        assert await leader == ("result", False)
+        assert not singleflight.is_waiting("key", 1)
+
+    asyncio.run(scenario())
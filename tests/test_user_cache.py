@@ -0,0 +1,90 @@
+import asyncio
+
+from types import SimpleNamespace
+
+import pytest
+
+from aiogram import types
+from cachetools import TTLCache
+
+from tgbot.models.user import User
+from tgbot.services.user_cache import UserCache
+
+
+TELEGRAM_USER = types.User(id=100, is_bot=False, first_name="Ann", username="ann")
+
+
+class FakeUsers:
+    """User table of one row, counting queries"""
+
+    def __init__(self, monkeypatch, row=None):
+        self.row = row
+        self.reads = 0
+        self.writes = 0
+        monkeypatch.setattr(User, "get_user", self.get_user)
+        monkeypatch.setattr(User, "upsert_user", self.upsert_user)
+
+    async def get_user(self, db_session, telegram_id: int):
+        self.reads += 1
+        return self.row
+
+    async def upsert_user(self, db_session, user: User):
+        self.writes += 1
+        self.row = SimpleNamespace(
+            id=1, telegram_id=user.telegram_id, firstname=user.firstname,
+            lastname=user.lastname, username=user.username,
+            lang_code=user.lang_code, is_blocked=False)
+        return self.row
+
+
+@pytest.fixture
+def clock():
+    return SimpleNamespace(now=0.0)
+
+
+@pytest.fixture
+def cache(clock):
+    cache = UserCache(ttl=60)
+    cache._cache = TTLCache(maxsize=10, ttl=60, timer=lambda: clock.now)
+    return cache
+
+
+def test_new_user_is_inserted_once(monkeypatch, cache):
+    users = FakeUsers(monkeypatch)
+
+    async def scenario():
+        return [await cache.get_user(None, TELEGRAM_USER) for _ in range(3)]
+
+    result = asyncio.run(scenario())
+    assert [user.firstname for user in result] == ["Ann"] * 3
+    assert (users.reads, users.writes) == (1, 1)
+    assert cache.stats()["hits"] == 2
+
+
+def test_expired_user_is_read_not_written(monkeypatch, cache, clock):
+    users = FakeUsers(monkeypatch)
+
+    async def scenario():
+        await cache.get_user(None, TELEGRAM_USER)
+        clock.now += 61
+        return await cache.get_user(None, TELEGRAM_USER)
+
+    assert asyncio.run(scenario()).id == 1
+    assert (users.reads, users.writes) == (2, 1)
+    assert cache.stats()["misses"] == 2
+
+
+def test_changed_or_blocked_user_is_written(monkeypatch, cache, clock):
+    users = FakeUsers(monkeypatch)
+
+    async def scenario():
+        await cache.get_user(None, TELEGRAM_USER)
+        renamed = types.User(id=100, is_bot=False, first_name="Anna", username="ann")
+        user = await cache.get_user(None, renamed)
+        users.row.is_blocked = True
+        clock.now += 61
+        await cache.get_user(None, renamed)
+        return user
+
+    assert asyncio.run(scenario()).firstname == "Anna"
+    assert (users.reads, users.writes) == (3, 3)
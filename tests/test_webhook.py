@@ -0,0 +1,40 @@
+import asyncio
+
+from types import SimpleNamespace
+
+from aiogram import Bot, Dispatcher
+from aiohttp.test_utils import TestClient, TestServer
+
+from tgbot.config import Webhook
+from tgbot.services.webhook import SECRET_HEADER, create_webhook_app
+
+
+UPDATE = {"update_id": 1}
+
+
+async def post_updates(count: int, max_pending_updates: int) -> list:
+    """Post updates while the first ones are processed, returns statuses"""
+    webhook = Webhook(secret_token="secret", max_pending_updates=max_pending_updates)
+    dp = Dispatcher(Bot(token="123456:TEST"))
+    release = asyncio.Event()
+
+    async def process_update(update):
+        await release.wait()
+
+    dp.process_update = process_update
+    app = create_webhook_app(dp, SimpleNamespace(webhook=webhook))
+    async with TestClient(TestServer(app)) as client:
+        statuses = []
+        for n in range(count):
+            response = await client.post(webhook.path, json=dict(UPDATE, update_id=n),
+                                         headers={SECRET_HEADER: "secret"})
+            statuses.append(response.status)
+        release.set()
+        await asyncio.gather(*app['tasks'])
+    await (await dp.bot.get_session()).close()
+    return statuses
+
+
+def test_updates_above_the_limit_are_refused():
+    statuses = asyncio.run(post_updates(5, max_pending_updates=3))
+    assert statuses == [200, 200, 200, 503, 503]
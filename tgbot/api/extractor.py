@@ -0,0 +1,108 @@
+import importlib
+
+from enum import Enum
+from typing import AsyncIterator
+
+from aiogram import Bot
+
+from tgbot.misc.media_key import MediaKey, canonicalize, split_host, HOSTS
+from tgbot.services.scheduler import JobKind
+
+
+# Modules whose extractors are registered with @register on import
+PLATFORM_MODULES = (
+    "tgbot.api.instagram",
+    "tgbot.api.youtube",
+    "tgbot.api.tiktok",
+)
+
+
+class CODES(Enum):
+    DOWNLOADED = 1
+    NOT_FOUND = 0
+    COULD_NOT_LOGIN = -10
+    COULD_NOT_DOWNLOAD = -20
+    ERROR = -100
+
+
+class DownloadError(Exception):
+    """Media could not be downloaded, code is one of CODES values"""
+
+    def __init__(self, message: str = "", code: int = CODES.COULD_NOT_DOWNLOAD.value):
+        super().__init__(message)
+        self.code = code
+
+
+class Extractor:
+    """
+    Media of one platform. Links are mapped to the platform by the host
+    table of tgbot.misc.media_key, so an extractor gets only keys of its
+    own media.
+
+    Direct extractors download the link at once, the others (YouTube)
+    resolve metadata and let the user choose a format first
+    """
+    platform: str = None
+    direct: bool = True
+    # Scheduler queue of downloads
+    job_kind: JobKind = JobKind.IO
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+
+    async def resolve(self, key: MediaKey, url: str) -> dict:
+        """Metadata of the media"""
+        raise NotImplementedError
+
+    async def download(self, key: MediaKey, url: str, on_progress=None,
+                       **options) -> dict:
+        """
+        Save the media to the media directory. Returns
+        {"path": file or directory, "file_type": "image", "video",
+        "audio" or "carousel", "failed": indexes of missed carousel items}.
+        Raises DownloadError
+        """
+        raise NotImplementedError
+
+    def stream(self, key: MediaKey, url: str, **options) -> AsyncIterator[bytes]:
+        """Content of the media by chunks, without saving it"""
+        raise NotImplementedError
+
+
+EXTRACTORS = {}
+
+
+def register(cls):
+    """Class decorator adding the extractor of cls.platform"""
+    EXTRACTORS[cls.platform] = cls
+    return cls
+
+
+class Extractors:
+    """Extractors of all registered platforms bound to the bot"""
+
+    def __init__(self, bot: Bot, modules: tuple = PLATFORM_MODULES):
+        for module in modules:
+            importlib.import_module(module)
+        self._extractors = {platform: cls(bot) for platform, cls in EXTRACTORS.items()}
+
+    def get(self, platform: str) -> Extractor or None:
+        return self._extractors.get(platform)
+
+    def for_url(self, url: str) -> tuple:
+        """(extractor, media key) of the link, or (None, None)"""
+        key = canonicalize(url)
+        if key is None:
+            return None, None
+        extractor = self._extractors.get(key.platform)
+        return (extractor, key) if extractor else (None, None)
+
+    def is_supported_host(self, url: str) -> bool:
+        """Link is from a supported platform, even if it is not a media link"""
+        host, _ = split_host(url)
+        platform = HOSTS.get(host)
+        return platform is not None and platform[0] in self._extractors
+
+    @property
+    def platforms(self) -> list:
+        return list(self._extractors)
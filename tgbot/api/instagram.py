@@ -1,42 +1,58 @@
 import os
-import re
+import uuid
 import asyncio
 import datetime
-from textwrap import indent
 import aiohttp
 import jmespath
 import json
 
-from enum import Enum
-
 from http.cookies import SimpleCookie
+from typing import AsyncIterator
 
+from aiofiles import open as aioopen
 from loguru import logger
 
+from tgbot.api.extractor import CODES, DownloadError, Extractor, register
+from tgbot.misc.media_key import MediaKey, INSTAGRAM, canonicalize
 from tgbot.misc.utils import UNIVERSAL_UA
+from tgbot.services.logs import sample_payload
+from tgbot.services.metrics import DOWNLOAD_BYTES, DOWNLOAD_DURATION, timed
+from tgbot.services.scheduler import JobKind
 
 INSTA_HEADERS = {
     "User-Agent": UNIVERSAL_UA,
 }
-
-
-class CODES(Enum):
-    DOWNLOADED = 1
-    NOT_FOUND = 0
-    COULD_NOT_LOGIN = -10
-    COULD_NOT_DOWNLOAD = -20
-    ERROR = -100
+CHUNK_SIZE = 64 * 1024
+INSTAGRAM_URL = "https://www.instagram.com"
 
 
 class Instagram():
     """Instagram API wrapper"""
 
-    def __init__(self, username: str, password: str):
+    # Limits media downloads of all instances, created on first use
+    _global_semaphore: asyncio.Semaphore = None
+
+    def __init__(self, username: str, password: str,
+                 session: aiohttp.ClientSession,
+                 carousel_concurrency: int = 4,
+                 download_concurrency: int = 16,
+                 api_base: str = ""):
         self.username = username
         self.password = password
+        self.session = session
+        self.carousel_concurrency = carousel_concurrency
+        self.download_concurrency = download_concurrency
+        # Posts are requested from api_base instead of instagram.com, if set
+        self.api_base = api_base.rstrip("/")
         self.directory = os.path.join(os.getcwd(), "media", "instagram")
         self.login_attempts = 0
 
+    def global_semaphore(self) -> asyncio.Semaphore:
+        if Instagram._global_semaphore is None:
+            Instagram._global_semaphore = asyncio.Semaphore(
+                self.download_concurrency)
+        return Instagram._global_semaphore
+
     async def login(self):
         """Login to Instagram, cache and return session cookies"""
 
@@ -44,7 +60,12 @@ class Instagram():
         enc_password = f"#PWD_INSTAGRAM_BROWSER:0:{time}:{self.password}"
 
         try:
-            async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar()) as session:
+            # Own cookie jar, but connections are reused from the shared pool
+            async with aiohttp.ClientSession(
+                connector=self.session.connector,
+                connector_owner=False,
+                cookie_jar=aiohttp.CookieJar()
+            ) as session:
 
                 # # Log out
                 # async with session.post('https://www.instagram.com/accounts/logout/ajax/', headers=INSTA_HEADERS) as resp:
@@ -73,7 +94,7 @@ class Instagram():
                     },
                 ) as resp:
                     resp_json = json.loads(await resp.text())
-                    logger.debug(f"Login response: {resp_json}")
+                    logger.opt(lazy=True).debug("Login response: {}", lambda: resp_json)
                     if resp_json["authenticated"] == True:
                         logger.success("Logged in successfully")
                         return session.cookie_jar
@@ -109,168 +130,208 @@ class Instagram():
         else:
             return None
 
+    async def save_media(self, media_url: str, save_path: str) -> bool:
+        """
+        Stream media to a temporary file by chunks and atomically move it
+        to save_path. Returns True if file was saved
+        """
+        tmp_path = f"{save_path}.{uuid.uuid4().hex}.part"
+        try:
+            async with self.session.get(media_url, headers=INSTA_HEADERS) as media:
+                if media.status != 200:
+                    logger.error(f"Media status: {media.status}")
+                    return False
+                size = 0
+                async with aioopen(tmp_path, "wb") as f:
+                    async for chunk in media.content.iter_chunked(CHUNK_SIZE):
+                        await f.write(chunk)
+                        size += len(chunk)
+                # Content-Length is the size of encoded body, so it can be
+                # compared only if the body was not compressed
+                expected = media.content_length
+                if expected is not None and "Content-Encoding" not in media.headers \
+                        and size != expected:
+                    logger.error(
+                        f"Incomplete media {media_url}: {size} of {expected} bytes")
+                    return False
+            os.replace(tmp_path, save_path)
+            DOWNLOAD_BYTES.inc(size, platform="instagram")
+            logger.success(f"Saved media to {save_path}")
+            return True
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    async def save_carousel_item(self, semaphore: asyncio.Semaphore,
+                                 media: dict, save_path: str, index: int) -> tuple:
+        """
+        Save carousel item as "<index>.jpg" or "<index>.mp4" under per-post
+        and global download limits. Returns tuple (index, saved)
+        """
+        if media.get('video'):
+            media_url = media["video"]
+            save_path = os.path.join(save_path, f"{index}.mp4")
+        else:
+            media_url = media["image"]
+            save_path = os.path.join(save_path, f"{index}.jpg")
+        async with semaphore, self.global_semaphore():
+            try:
+                return index, await self.save_media(media_url, save_path)
+            except Exception as e:
+                logger.error(f"Error while downloading carousel item {index}: {e}")
+                return index, False
+
+    async def get_post(self, post_id: str) -> int or dict:
+        """
+        Media urls of the post: {"file_type": "image", "video" or "carousel",
+        "media": [{"image": url} or {"video": url}]} or error code
+        """
+        url = f"{self.api_base or INSTAGRAM_URL}/p/{post_id}/"
+        async with self.session.get(url, headers=INSTA_HEADERS, params={"__a": "1"}) as resp:
+            logger.info(f"Post status: {resp.status}")
+            if resp.status == 404:
+                return CODES.NOT_FOUND.value
+            if resp.status in (401, 403):
+                return CODES.COULD_NOT_LOGIN.value
+            if resp.status != 200:
+                # 429 and server errors
+                logger.warning(f"Post {post_id} was not fetched, status: {resp.status}")
+                return CODES.COULD_NOT_DOWNLOAD.value
+            try:
+                resp_json = await resp.json(content_type=None)
+            except (ValueError, aiohttp.ContentTypeError):
+                # HTML login or challenge page instead of the post data
+                logger.warning(f"Post {post_id} data is not JSON, login is required")
+                return CODES.COULD_NOT_LOGIN.value
+            if sample_payload():
+                logger.opt(lazy=True).debug(
+                    "Post data:\n{}", lambda: json.dumps(resp_json, indent=4))
+
+        carousel_media = jmespath.search(
+            "items[0].carousel_media", resp_json)
+        if not carousel_media:
+            carousel_media = jmespath.search(
+                "graphql.shortcode_media.edge_sidecar_to_children",
+                resp_json
+            )
+        image_url = jmespath.search(
+            "items[0].image_versions2.candidates[0].url", resp_json
+        )
+        if not image_url:
+            image_url = jmespath.search(
+                "graphql.shortcode_media.display_url", resp_json
+            )
+        video_url = jmespath.search(
+            "items[0].video_versions[0].url", resp_json
+        )
+        if not video_url:
+            video_url = jmespath.search(
+                "graphql.shortcode_media.video_url", resp_json
+            )
+
+        if carousel_media:
+            if type(carousel_media) != list:
+                formula = \
+                    "edges[0:10].{image: node.display_url, video: node.video_url}"
+                carousel_media = jmespath.search(
+                    formula,
+                    carousel_media
+                )
+                # If has video pop image or pop video if video is None
+                for item in carousel_media:
+                    if item["video"]:
+                        del item["image"]
+                    if not item["video"]:
+                        del item["video"]
+
+            else:
+                formula = \
+                    "items[0].carousel_media[0:10]."\
+                    "{image: image_versions2.candidates[0].url, "\
+                    "video: video_versions[0].url}"
+                carousel_media = \
+                    jmespath.search(formula, resp_json)
+            return {"file_type": "carousel",
+                    "media": [media for media in carousel_media if type(media) == dict]}
+        if image_url and video_url:
+            return {"file_type": "video", "media": [{"video": video_url}]}
+        if image_url:
+            return {"file_type": "image", "media": [{"image": image_url}]}
+        # No media in the response, e.g. login page instead of the post
+        return CODES.COULD_NOT_LOGIN.value
+
+    @timed(DOWNLOAD_DURATION, platform="instagram", type="post")
     async def download_post(self, url: str, new_cookie=False) -> int or tuple:
         """Download post (image or video)"""
 
-        post_id = re.search(
-            r"instagram.com/[-a-zA-Z0-9]+/([^/]*)",
-            url
-        ).group(1)
+        # Reels, tv and profile links of the post are the same /p/ page
+        post_id = canonicalize(url).media_id
         # cookies = await self.try_login(new_cookie=new_cookie)
 
         # if cookies:
         if True:
             try:
                 # async with aiohttp.ClientSession(cookie_jar=cookies) as session:
-                async with aiohttp.ClientSession() as session:
-                    # Get post data
-                    async with session.get(url, headers=INSTA_HEADERS, params={"__a": "1"}) as resp:
-                        logger.info(f"Post status: {resp.status}")
-                        if resp.status == 404:
-                            return CODES.NOT_FOUND.value
-                        logger.debug(f"Post data: {await resp.text()}")
-                        resp_json = json.loads(await resp.text())
-                        logger.debug(
-                            f"Post data:\n{json.dumps(resp_json, indent=4)}")
-                        carousel_media = jmespath.search(
-                            "items[0].carousel_media", resp_json)
-                        if not carousel_media:
-                            carousel_media = jmespath.search(
-                                "graphql.shortcode_media.edge_sidecar_to_children",
-                                resp_json
-                            )
-                        image_url = jmespath.search(
-                            "items[0].image_versions2.candidates[0].url", resp_json
-                        )
-                        if not image_url:
-                            image_url = jmespath.search(
-                                "graphql.shortcode_media.display_url", resp_json
-                            )
-                        video_url = jmespath.search(
-                            "items[0].video_versions[0].url", resp_json
-                        )
-                        if not video_url:
-                            video_url = jmespath.search(
-                                "graphql.shortcode_media.video_url", resp_json
-                            )
-
-                        if carousel_media:
-                            if type(carousel_media) != list:
-                                formula = \
-                                    "edges[0:10].{image: node.display_url, video: node.video_url}"
-                                carousel_media = jmespath.search(
-                                    formula,
-                                    carousel_media
-                                )
-                                # If has video pop image or pop video if video is None
-                                for item in carousel_media:
-                                    if item["video"]:
-                                        del item["image"]
-                                    if not item["video"]:
-                                        del item["video"]
-
-                            else:
-                                formula = \
-                                    "items[0].carousel_media[0:10]."\
-                                    "{image: image_versions2.candidates[0].url, "\
-                                    "video: video_versions[0].url}"
-                                carousel_media = \
-                                    jmespath.search(formula, resp_json)
-
-                            carousel_save_path = ""
-                            for index, media in enumerate(carousel_media):
-                                if type(media) == dict:
-                                    if not 'video' in media:  # image
-                                        save_path = os.path.join(
-                                            self.directory, "carousels", post_id)
-                                        carousel_save_path = save_path
-                                        os.makedirs(
-                                            save_path, exist_ok=True, mode=0o755)
-                                        save_path = os.path.join(
-                                            save_path, f"{index}.jpg")
-
-                                        image_url = media["image"]
-                                        async with session.get(image_url, headers=INSTA_HEADERS) as image:
-                                            if resp.status == 200:
-                                                image_data = await image.read()
-                                                with open(save_path, "wb") as f:
-                                                    f.write(image_data)
-                                                logger.success(
-                                                    f"Saved image to {save_path}")
-                                            else:
-                                                logger.error(
-                                                    f"Error while downloading carousel image: {resp.status}")
-                                                return CODES.COULD_NOT_DOWNLOAD.value
-
-                                    if 'video' in media:  # video
-                                        save_path = os.path.join(
-                                            self.directory, "carousels", post_id)
-                                        os.makedirs(
-                                            save_path, exist_ok=True, mode=0o755)
-                                        save_path = os.path.join(
-                                            save_path, f"{index}.mp4")
-
-                                        video_url = media["video"]
-                                        async with session.get(video_url, headers=INSTA_HEADERS) as video:
-                                            if resp.status == 200:
-                                                video_data = await video.read()
-                                                with open(save_path, "wb") as f:
-                                                    f.write(video_data)
-                                                logger.success(
-                                                    f"Saved video to {save_path}")
-                                            else:
-                                                logger.error(
-                                                    f"Error while downloading carousel video: {resp.status}")
-                                                return CODES.COULD_NOT_DOWNLOAD.value
-                            return CODES.DOWNLOADED.value, \
-                                {"path": carousel_save_path,
-                                 "file_type": "carousel"}
-
-                        if image_url and video_url:  # video
-                            logger.info(f"Downloading video: {video_url}")
-
-                            save_path = os.path.join(self.directory, "videos")
-                            os.makedirs(save_path, exist_ok=True, mode=0o755)
-                            save_path = os.path.join(
-                                save_path, f"{post_id}.mp4")
-
-                            async with session.get(video_url, headers=INSTA_HEADERS) as video:
-                                if resp.status == 200:
-                                    video_data = await video.read()
-                                    with open(save_path, "wb") as f:
-                                        f.write(video_data)
-                                    logger.success(
-                                        f"Saved video to {save_path}")
-                                    return CODES.DOWNLOADED.value, \
-                                        {"path": save_path,
-                                         "file_type": "video"}
-                                else:
-                                    logger.error(
-                                        f"Error while downloading image: {resp.status}")
-                                    return CODES.COULD_NOT_DOWNLOAD.value
-
-                        if image_url and not video_url:  # image
-                            logger.info(f"Downloading image: {image_url}")
-
-                            save_path = os.path.join(self.directory, "images")
-                            os.makedirs(save_path, exist_ok=True, mode=0o755)
-                            save_path = os.path.join(
-                                save_path, f"{post_id}.jpg")
-
-                            async with session.get(image_url, headers=INSTA_HEADERS) as image:
-                                if resp.status == 200:
-                                    image_data = await image.read()
-                                    with open(save_path, "wb") as f:
-                                        f.write(image_data)
-                                    logger.success(
-                                        f"Saved image to {save_path}")
-                                    return CODES.DOWNLOADED.value, \
-                                        {"path": save_path,
-                                         "file_type": "image"}
-                                else:
-                                    logger.error(
-                                        f"Error while downloading image: {resp.status}")
-                                    return CODES.COULD_NOT_DOWNLOAD.value
+                post = await self.get_post(post_id)
+                if type(post) == int:
+                    return post
+
+                if post["file_type"] == "carousel":
+                    carousel_save_path = os.path.join(
+                        self.directory, "carousels", post_id)
+                    os.makedirs(carousel_save_path, exist_ok=True, mode=0o755)
+                    semaphore = asyncio.Semaphore(self.carousel_concurrency)
+                    results = await asyncio.gather(*[
+                        self.save_carousel_item(
+                            semaphore, media, carousel_save_path, index)
+                        for index, media in enumerate(post["media"])
+                    ])
+                    failed = [index for index, saved in results if not saved]
+                    if len(failed) == len(results):
+                        logger.error(
+                            f"Error while downloading carousel {post_id}")
+                        return CODES.COULD_NOT_DOWNLOAD.value
+                    if failed:
+                        logger.warning(
+                            f"Carousel {post_id} items {failed} were not downloaded")
+                    return CODES.DOWNLOADED.value, \
+                        {"path": carousel_save_path,
+                         "file_type": "carousel",
+                         "failed": failed}
+
+                if post["file_type"] == "video":
+                    video_url = post["media"][0]["video"]
+                    logger.info(f"Downloading video: {video_url}")
+
+                    save_path = os.path.join(self.directory, "videos")
+                    os.makedirs(save_path, exist_ok=True, mode=0o755)
+                    save_path = os.path.join(save_path, f"{post_id}.mp4")
+
+                    async with self.global_semaphore():
+                        saved = await self.save_media(video_url, save_path)
+                    if not saved:
+                        logger.error("Error while downloading video")
+                        return CODES.COULD_NOT_DOWNLOAD.value
+                    return CODES.DOWNLOADED.value, \
+                        {"path": save_path,
+                         "file_type": "video"}
+
+                if post["file_type"] == "image":
+                    image_url = post["media"][0]["image"]
+                    logger.info(f"Downloading image: {image_url}")
+
+                    save_path = os.path.join(self.directory, "images")
+                    os.makedirs(save_path, exist_ok=True, mode=0o755)
+                    save_path = os.path.join(save_path, f"{post_id}.jpg")
+
+                    async with self.global_semaphore():
+                        saved = await self.save_media(image_url, save_path)
+                    if not saved:
+                        logger.error("Error while downloading image")
+                        return CODES.COULD_NOT_DOWNLOAD.value
+                    return CODES.DOWNLOADED.value, \
+                        {"path": save_path,
+                         "file_type": "image"}
 
             except Exception as e:
                 logger.error(f"Error while downloading post: {e}")
@@ -291,3 +352,43 @@ class Instagram():
     async def download_story(self, url):
         """Downloads the story by given url"""
         pass
+
+
+@register
+class InstagramExtractor(Extractor):
+    """Posts, reels and carousels saved by Instagram"""
+    platform = INSTAGRAM
+    direct = True
+    job_kind = JobKind.IO
+
+    def _client(self) -> Instagram:
+        config = self.bot['config'].instagram
+        return Instagram(config.username, config.password, self.bot['http'],
+                         carousel_concurrency=config.carousel_concurrency,
+                         download_concurrency=config.download_concurrency,
+                         api_base=config.api_base)
+
+    async def resolve(self, key: MediaKey, url: str) -> dict:
+        post = await self._client().get_post(key.media_id)
+        if type(post) == int:
+            raise DownloadError(f"Post {key} was not resolved", code=post)
+        return post
+
+    async def download(self, key: MediaKey, url: str, on_progress=None,
+                       **options) -> dict:
+        result = await self._client().download_post(url)
+        if type(result) != tuple or result[0] != CODES.DOWNLOADED.value:
+            raise DownloadError(f"Post {key} was not downloaded", code=result)
+        return result[1]
+
+    async def stream(self, key: MediaKey, url: str, index: int = 0,
+                     **options) -> AsyncIterator[bytes]:
+        """Content of the post, or of its carousel item"""
+        post = await self.resolve(key, url)
+        media = post["media"][index]
+        media_url = media.get("video") or media["image"]
+        async with self.bot['http'].get(media_url, headers=INSTA_HEADERS) as resp:
+            if resp.status != 200:
+                raise DownloadError(f"Media status: {resp.status}")
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                yield chunk
@@ -0,0 +1,57 @@
+import os
+
+from typing import AsyncIterator
+
+from loguru import logger
+
+from tgbot.api.extractor import Extractor, register
+from tgbot.api.youtube import (
+    YoutubeDownloadError, run_ytdlp, ytdlp_command, ytdlp_json, ytdlp_stream)
+from tgbot.misc.media_key import MediaKey, TIKTOK
+from tgbot.services.metrics import DOWNLOAD_BYTES, DOWNLOAD_DURATION, timed
+from tgbot.services.scheduler import JobKind
+
+
+tiktoksavepath = os.path.join(os.getcwd(), "media", "tiktok")
+# Single file with audio, so there is nothing to merge or recode
+TIKTOK_FORMAT = "best[ext=mp4]/best"
+
+
+@timed(DOWNLOAD_DURATION, platform="tiktok", type="video")
+async def tiktok_video_download(id: str, url: str, on_progress=None) -> str:
+    os.makedirs(tiktoksavepath, exist_ok=True)
+    filepath = os.path.join(tiktoksavepath, f"{id}.mp4")
+    if os.path.exists(filepath):
+        return filepath
+    await run_ytdlp(ytdlp_command(
+        "-c",
+        "-f", TIKTOK_FORMAT,
+        "-o", filepath,
+        url), on_progress)
+    if not os.path.exists(filepath):
+        raise YoutubeDownloadError(f"{filepath} was not created")
+    DOWNLOAD_BYTES.inc(os.path.getsize(filepath), platform="tiktok")
+    logger.debug(f"Downloaded TikTok video: {filepath}")
+    return filepath
+
+
+@register
+class TikTokExtractor(Extractor):
+    """
+    TikTok videos by yt-dlp. Short links (vm.tiktok.com) are keyed by
+    their code, yt-dlp follows the redirect itself
+    """
+    platform = TIKTOK
+    direct = True
+    job_kind = JobKind.CPU
+
+    async def resolve(self, key: MediaKey, url: str) -> dict:
+        return await ytdlp_json(url)
+
+    async def download(self, key: MediaKey, url: str, on_progress=None,
+                       **options) -> dict:
+        path = await tiktok_video_download(key.media_id, url, on_progress)
+        return {"path": path, "file_type": "video"}
+
+    def stream(self, key: MediaKey, url: str, **options) -> AsyncIterator[bytes]:
+        return ytdlp_stream(["-f", TIKTOK_FORMAT, url])
@@ -1,14 +1,27 @@
 import os
+import json
+import shlex
 import asyncio
+import collections
+import threading
 import aiohttp
 import jmespath
 import yt_dlp
 
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import AsyncIterator
+
 from aiofiles import open as aioopen
+from cachetools import TTLCache
 
 from loguru import logger
 
+from tgbot.api.extractor import CODES, DownloadError, Extractor, register
+from tgbot.misc.media_key import MediaKey, YOUTUBE, canonicalize
 from tgbot.misc.utils import clean_url
+from tgbot.misc.singleflight import SingleFlight
+from tgbot.services.metrics import DOWNLOAD_BYTES, DOWNLOAD_DURATION, timed
+from tgbot.services.scheduler import JobKind
 
 
 ytregex = r"^((?:https?:)?\/\/)?((?:www|m)\.)?((?:youtube\.com|youtu.be))(\/(?:[\w\-]+\?v=|embed\/|v\/)?)([\w\-]+)(\S+)?$"
@@ -30,30 +43,107 @@ os.makedirs(ytvideospath, exist_ok=True)
 os.makedirs(ytauidospath, exist_ok=True)
 
 
+
+def _data_size(data: dict) -> int:
+    """Approximate size of cached data in bytes"""
+    return len(repr(data))
+
+
+# Extraction runs in executor, because yt_dlp is synchronous.
+# Both are replaced by setup_extractor() on startup
+_executor: Executor = None
+_metadata_cache = TTLCache(
+    maxsize=32 * 1024 * 1024, ttl=3600, getsizeof=_data_size)
+_metadata_inflight = SingleFlight()
+# YoutubeDL instance per executor thread (or process)
+_local = threading.local()
+# yt-dlp command, may include interpreter, e.g. "python3 benchmarks/fake_ytdlp.py"
+_ytdlp_command = ["yt-dlp"]
+
+
+def setup_extractor(workers: int = 4, use_processes: bool = False,
+                    cache_ttl: int = 3600, cache_mb: int = 32,
+                    ytdlp_path: str = "yt-dlp") -> None:
+    """
+    Configure metadata extraction pool, metadata cache and yt-dlp executable
+    """
+    global _executor, _metadata_cache, _ytdlp_command
+    _ytdlp_command = shlex.split(ytdlp_path)
+    if _executor:
+        _executor.shutdown(wait=False)
+    if use_processes:
+        _executor = ProcessPoolExecutor(max_workers=workers)
+    else:
+        _executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="yt_extract")
+    _metadata_cache = TTLCache(
+        maxsize=cache_mb * 1024 * 1024, ttl=cache_ttl, getsizeof=_data_size)
+
+
+def shutdown_extractor() -> None:
+    if _executor:
+        _executor.shutdown(wait=False)
+
+
+def ytdlp_command(*args) -> list:
+    """Command line of the configured yt-dlp executable"""
+    return [*_ytdlp_command, *args]
+
+
+def get_video_id(video_url: str) -> str or None:
+    """Get video id from any youtube url"""
+    key = canonicalize(video_url)
+    return key.media_id if key and key.platform == YOUTUBE else None
+
+
+def extract_main_data(video_url: str) -> dict:
+    """
+    Extract and filter video info, blocking. Runs inside of executor
+    """
+    ydl = getattr(_local, "ydl", None)
+    if ydl is None:
+        ydl = _local.ydl = yt_dlp.YoutubeDL({"quiet": True})
+    r = ydl.extract_info(video_url, download=False)
+    return jmespath.search(jmesformula, r)
+
+
+def seed_metadata(data: dict) -> None:
+    """Put extracted metadata to the cache, e.g. recorded data in benchmarks"""
+    _metadata_cache[data['id']] = data
+
+
 async def get_main_data(video_url: str) -> dict:
     """
-    Get main data from youtube url
+    Get main data from youtube url, cached by video id
     """
-    ydl = yt_dlp.YoutubeDL()
-    with ydl:
-        r = ydl.extract_info(video_url, download=False)
-        data = jmespath.search(jmesformula, r)
+    video_id = get_video_id(video_url) or video_url
+    data = _metadata_cache.get(video_id)
+    if data is not None:
+        logger.debug(f"Metadata cache hit: {video_id}")
         return data
 
+    loop = asyncio.get_event_loop()
+    data, _ = await _metadata_inflight.do(
+        video_id, loop.run_in_executor, _executor, extract_main_data, video_url)
+    _metadata_cache[video_id] = data
+    if data['id'] != video_id:
+        _metadata_cache[data['id']] = data
+    return data
+
 
-async def save_thumbnail(filename: str, thumb_url: str) -> str:
+async def save_thumbnail(filename: str, thumb_url: str,
+                         session: aiohttp.ClientSession) -> str:
     """
-    Save thumbnail from youtube url
+    Save thumbnail from youtube url using shared http session
     """
     # TODO : SAVE THUMBNAIL IN ITS OWN EXTENSION BUT THEN CONVERT IT TO JPG VIA pillow
     # extension = str(await clean_url(thumb_url)).split(".")[-1]
     # filepath = os.path.join(ytthumbspath, f"{filename}.{extension}")
     filepath = os.path.join(ytthumbspath, f"{filename}.jpg")
-    async with aiohttp.ClientSession() as session:
-        async with session.get(thumb_url) as img:
-            if img.status == 200:
-                async with aioopen(filepath, "wb") as f:
-                    await f.write(await img.read())
+    async with session.get(thumb_url) as img:
+        if img.status == 200:
+            async with aioopen(filepath, "wb") as f:
+                await f.write(await img.read())
     return filepath
 
 
@@ -65,56 +155,262 @@ async def get_thumbnail(video_id: str):
     return filepath
 
 
-async def youtube_video_download(id: str, format_id: str, height: str, url: str):
+# yt-dlp errors of media which will not appear on retry
+MISSING_MEDIA_ERRORS = (
+    "Private video",
+    "Video unavailable",
+    "This video is not available",
+    "has been removed",
+    "account associated with this video has been terminated",
+    "HTTP Error 404",
+)
+
+
+class YoutubeDownloadError(DownloadError):
+    """Raised when yt-dlp exited with error or did not create the file"""
+
+    def __init__(self, message: str = ""):
+        missing = any(error in message for error in MISSING_MEDIA_ERRORS)
+        super().__init__(message, CODES.NOT_FOUND.value if missing
+                         else CODES.COULD_NOT_DOWNLOAD.value)
+
+
+class ProgressEvent:
+    """Parsed line of yt-dlp output"""
+    __slots__ = ("stage", "downloaded_bytes", "total_bytes", "speed", "eta")
+
+    def __init__(self, stage: str, downloaded_bytes: int = None,
+                 total_bytes: int = None, speed: float = None, eta: int = None):
+        self.stage = stage
+        self.downloaded_bytes = downloaded_bytes
+        self.total_bytes = total_bytes
+        self.speed = speed
+        self.eta = eta
+
+    @property
+    def percent(self) -> float or None:
+        if self.downloaded_bytes is None or not self.total_bytes:
+            return None
+        return self.downloaded_bytes * 100 / self.total_bytes
+
+    def __repr__(self):
+        return f"<ProgressEvent(stage={self.stage}, downloaded={self.downloaded_bytes}, " \
+            f"total={self.total_bytes}, speed={self.speed}, eta={self.eta})>"
+
+
+# yt-dlp prints progress with this template on its own line (--newline)
+PROGRESS_PREFIX = "[progress]"
+PROGRESS_TEMPLATE = \
+    f"download:{PROGRESS_PREFIX} %(progress.downloaded_bytes)s "\
+    "%(progress.total_bytes)s %(progress.total_bytes_estimate)s "\
+    "%(progress.speed)s %(progress.eta)s"
+# Post processing stages by the line prefix
+STAGES = {
+    "[Merger]": "merging",
+    "[VideoConvertor]": "converting",
+    "[ExtractAudio]": "extracting audio",
+    "[FixupM3u8]": "fixing",
+}
+
+
+def _number(value: str) -> float or None:
+    try:
+        return float(value)
+    except ValueError:  # "NA"
+        return None
+
+
+def parse_progress_line(line: str) -> ProgressEvent or None:
+    """Parse yt-dlp output line to the progress event"""
+    if line.startswith(PROGRESS_PREFIX):
+        values = line[len(PROGRESS_PREFIX):].split()
+        if len(values) != 5:
+            return None
+        downloaded, total, estimate, speed, eta = map(_number, values)
+        return ProgressEvent(
+            "downloading",
+            downloaded_bytes=int(downloaded) if downloaded is not None else None,
+            total_bytes=int(total or estimate) if (total or estimate) else None,
+            speed=speed,
+            eta=int(eta) if eta is not None else None,
+        )
+    for prefix, stage in STAGES.items():
+        if line.startswith(prefix):
+            return ProgressEvent(stage)
+    return None
+
+
+async def run_ytdlp(command: list, on_progress=None) -> None:
+    """
+    Run yt-dlp and stream its output line by line to on_progress callback.
+    Raises YoutubeDownloadError if yt-dlp exited with error
+    """
+    executable = len(_ytdlp_command)
+    command = [*command[:executable], "--newline",
+               "--progress-template", PROGRESS_TEMPLATE, *command[executable:]]
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE)
+
+    # stderr is read in parallel, so the pipe buffer never fills up
+    errors = collections.deque(maxlen=20)
+
+    async def read_stderr():
+        async for line in process.stderr:
+            errors.append(line.decode(errors="replace").strip())
+
+    stderr_task = asyncio.ensure_future(read_stderr())
+    try:
+        async for line in process.stdout:
+            line = line.decode(errors="replace").strip()
+            event = parse_progress_line(line)
+            if event is None:
+                logger.debug(f"YTDL Response: {line}")
+                continue
+            if on_progress:
+                try:
+                    await on_progress(event)
+                except Exception as e:
+                    logger.warning(f"Progress callback failed: {e}")
+        await stderr_task
+        returncode = await process.wait()
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+        stderr_task.cancel()
+        raise
+
+    if returncode != 0:
+        error = "\n".join(errors)
+        logger.error(f"yt-dlp exited with {returncode}: {error}")
+        raise YoutubeDownloadError(error)
+
+
+async def ytdlp_json(url: str) -> dict:
+    """Info of the media printed by yt-dlp, without downloading it"""
+    process = await asyncio.create_subprocess_exec(
+        *ytdlp_command("-j", "--no-playlist", url),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE)
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        error = stderr.decode(errors="replace").strip()
+        logger.error(f"yt-dlp exited with {process.returncode}: {error}")
+        raise YoutubeDownloadError(error)
+    return json.loads(stdout)
+
+
+async def ytdlp_stream(args: list, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    """
+    Content of the media written by yt-dlp to stdout, by chunks.
+    Raises YoutubeDownloadError if yt-dlp exited with error
+    """
+    process = await asyncio.create_subprocess_exec(
+        *ytdlp_command("-q", "--no-playlist", "-o", "-", *args),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE)
+    errors = collections.deque(maxlen=20)
+
+    async def read_stderr():
+        async for line in process.stderr:
+            errors.append(line.decode(errors="replace").strip())
+
+    stderr_task = asyncio.ensure_future(read_stderr())
+    try:
+        while True:
+            chunk = await process.stdout.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        await stderr_task
+        returncode = await process.wait()
+    finally:
+        # Consumer stopped reading or was cancelled
+        if process.returncode is None:
+            process.kill()
+            stderr_task.cancel()
+    if returncode != 0:
+        error = "\n".join(errors)
+        logger.error(f"yt-dlp exited with {returncode}: {error}")
+        raise YoutubeDownloadError(error)
+
+
+@timed(DOWNLOAD_DURATION, platform="youtube", type="video")
+async def youtube_video_download(id: str, format_id: str, height: str, url: str,
+                                 on_progress=None) -> str:
     filepath = os.path.join(ytvideospath, f"{id}_{format_id}_{height}.mp4")
     if os.path.exists(filepath):
         return filepath
     video_command = [
-        "yt-dlp",
+        *_ytdlp_command,
         "-c",
         "--keep-video",
         "--recode-video", 'mp4',
         "-f", f"{format_id}+bestaudio",
         "-o", filepath,
         "--hls-prefer-ffmpeg", url]
-    process = await asyncio.create_subprocess_exec(
-        *video_command,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE)
-    stdout, stderr = await process.communicate()
-    e_response = stderr.decode().strip()
-    t_response = stdout.decode().strip()
-    logger.debug(f"YTDL Response: {e_response}")
-    logger.debug(f"YTDL Response 2: {t_response}")
-    filename = t_response.split("; Destination: ")[-1]
-    logger.debug(f"Downloaded video: {filename}")
-    return filename
+    await run_ytdlp(video_command, on_progress)
+    if not os.path.exists(filepath):
+        raise YoutubeDownloadError(f"{filepath} was not created")
+    DOWNLOAD_BYTES.inc(os.path.getsize(filepath), platform="youtube")
+    logger.debug(f"Downloaded video: {filepath}")
+    return filepath
 
 
-async def youtube_audio_download(id: str, format_id: str, url: str):
+@timed(DOWNLOAD_DURATION, platform="youtube", type="audio")
+async def youtube_audio_download(id: str, format_id: str, url: str,
+                                 on_progress=None) -> str:
     filepath = os.path.join(ytauidospath, f"{id}_{format_id}.mp3")
     if os.path.exists(filepath):
         return filepath
     audio_command = [
-        "yt-dlp",
+        *_ytdlp_command,
         "-c",
         "--extract-audio",
         "--prefer-ffmpeg",
         "--audio-format", "mp3",
-        "-o", filepath,
+        # extension is replaced by mp3 after extraction
+        "-o", os.path.join(ytauidospath, f"{id}_{format_id}.%(ext)s"),
         url]
-    process = await asyncio.create_subprocess_exec(
-        *audio_command,
-        # stdout must a pipe to be accessible as process.stdout
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
-    stdout, stderr = await process.communicate()
-    e_response = stderr.decode().strip()
-    t_response = stdout.decode().strip()
-    logger.debug(f"YTDL Response: {e_response}")
-    logger.debug(f"YTDL Response 2: {t_response}")
-    filename = \
-        t_response.split("[ExtractAudio] Destination: ")[-1].split('\n')[0]
-    logger.debug(f"Downloaded audio: {filename}")
-    return filename
+    await run_ytdlp(audio_command, on_progress)
+    if not os.path.exists(filepath):
+        raise YoutubeDownloadError(f"{filepath} was not created")
+    DOWNLOAD_BYTES.inc(os.path.getsize(filepath), platform="youtube")
+    logger.debug(f"Downloaded audio: {filepath}")
+    return filepath
+
+
+@register
+class YoutubeExtractor(Extractor):
+    """
+    Videos and audios in the format chosen by the user from the menu
+    built by resolve()
+    """
+    platform = YOUTUBE
+    direct = False
+    job_kind = JobKind.CPU
+
+    async def resolve(self, key: MediaKey, url: str) -> dict:
+        try:
+            return await get_main_data(f"https://youtu.be/{key.media_id}")
+        except yt_dlp.utils.DownloadError as e:
+            raise YoutubeDownloadError(str(e))
+
+    async def download(self, key: MediaKey, url: str, on_progress=None,
+                       type: str = "video", format_id: str = "",
+                       height: str = "", **options) -> dict:
+        url = f"https://youtu.be/{key.media_id}"
+        if type == "video":
+            path = await youtube_video_download(
+                key.media_id, format_id, height, url, on_progress)
+        elif type == "audio":
+            path = await youtube_audio_download(
+                key.media_id, format_id, url, on_progress)
+        else:
+            raise ValueError(f"Unknown file type: {type}")
+        return {"path": path, "file_type": type}
+
+    def stream(self, key: MediaKey, url: str, format_id: str = "best",
+               **options) -> AsyncIterator[bytes]:
+        return ytdlp_stream(["-f", format_id, f"https://youtu.be/{key.media_id}"])
@@ -9,6 +9,9 @@ class DbConfig:
     password: str
     user: str
     database: str
+    pool_size: int = 10
+    max_overflow: int = 20
+    statement_cache_size: int = 500
 
 
 @dataclass
@@ -28,13 +31,157 @@ class TgBot:
 class Instagram:
     username: str
     password: str
+    carousel_concurrency: int = 4
+    download_concurrency: int = 16
+    api_base: str = ""
+
+
+@dataclass
+class Webhook:
+    enabled: bool = False
+    url: str = ""
+    path: str = "/webhook"
+    secret_token: str = ""
+    listen_host: str = "0.0.0.0"
+    listen_port: int = 8080
+    max_connections: int = 40
+    workers: int = 1
+    max_pending_updates: int = 1000
+
+
+@dataclass
+class Youtube:
+    extract_workers: int = 4
+    extract_in_process: bool = False
+    metadata_cache_ttl: int = 3600
+    metadata_cache_mb: int = 32
+    ytdlp_path: str = "yt-dlp"
+
+
+@dataclass
+class Scheduler:
+    io_workers: int = 8
+    cpu_workers: int = 2
+    max_queue: int = 100
+
+
+@dataclass
+class Media:
+    max_size_mb: int = 10240
+    hit_weight: int = 3600
+    min_age: int = 300
+    rescan_interval: int = 600
+
+
+@dataclass
+class Cache:
+    user_cache_size: int = 10000
+    user_cache_ttl: int = 3600
+    link_cache_size: int = 50000
+    link_cache_ttl: int = 600
+    link_redis_ttl: int = 86400
+    negative_cache_size: int = 50000
+    not_found_ttl: int = 86400
+    error_ttl: int = 60
+
+
+@dataclass
+class Http:
+    limit: int = 100
+    limit_per_host: int = 20
+    dns_cache_ttl: int = 300
+    keepalive_timeout: int = 30
+    connect_timeout: int = 10
+    read_timeout: int = 60
+    total_timeout: int = 0
+
+
+@dataclass
+class Broadcast:
+    rate: float = 25
+    min_rate: float = 1
+    max_rate: float = 30
+    concurrency: int = 10
+    checkpoint_every: int = 500
+
+
+@dataclass
+class RateLimit:
+    enabled: bool = True
+    user_capacity: float = 30
+    user_rate: float = 0.5
+    chat_capacity: float = 60
+    chat_rate: float = 1
+    global_capacity: float = 600
+    global_rate: float = 30
+
+
+@dataclass
+class ApiGovernor:
+    enabled: bool = True
+    global_rate: float = 30
+    chat_interval: float = 1
+    group_interval: float = 3
+    chat_burst: int = 3
+    max_retries: int = 3
+
+
+@dataclass
+class Logging:
+    console_level: str = "INFO"
+    file_level: str = "INFO"
+    error_level: str = "ERROR"
+    debug_level: str = ""
+    backtrace: bool = True
+    diagnose: bool = False
+    enqueue: bool = True
+    payload_sample_rate: float = 0.01
+
+
+@dataclass
+class Metrics:
+    enabled: bool = False
+    host: str = "127.0.0.1"
+    port: int = 9720
+    worker_port: int = 9820
+
+
+@dataclass
+class Recorder:
+    enabled: bool = False
+    path: str = "recordings/updates.jsonl"
+    salt: str = ""
+    keep_text: bool = False
+
+
+@dataclass
+class Distributed:
+    enabled: bool = False
+    visibility_timeout: int = 600
+    max_attempts: int = 3
+    retry_delay: int = 10
+    worker_concurrency: int = 4
+    worker_processes: int = 1
 
 
 @dataclass
 class Config:
     tg_bot: TgBot
     db: DbConfig
+    webhook: Webhook
     instagram: Instagram
+    youtube: Youtube
+    scheduler: Scheduler
+    media: Media
+    cache: Cache
+    http: Http
+    distributed: Distributed
+    broadcast: Broadcast
+    rate_limit: RateLimit
+    api_governor: ApiGovernor
+    logging: Logging
+    metrics: Metrics
+    recorder: Recorder
 
 
 def cast_bool(value: str) -> bool:
@@ -52,6 +199,21 @@ def load_config(path: str):
     config.read(path)
 
     tg_bot = config["tg_bot"]
+    db = config["db"]
+    webhook = config["webhook"] if config.has_section("webhook") else {}
+    instagram = config["instagram"]
+    youtube = config["youtube"] if config.has_section("youtube") else {}
+    scheduler = config["scheduler"] if config.has_section("scheduler") else {}
+    media = config["media"] if config.has_section("media") else {}
+    cache = config["cache"] if config.has_section("cache") else {}
+    http = config["http"] if config.has_section("http") else {}
+    distributed = config["distributed"] if config.has_section("distributed") else {}
+    broadcast = config["broadcast"] if config.has_section("broadcast") else {}
+    rate_limit = config["rate_limit"] if config.has_section("rate_limit") else {}
+    api_governor = config["api_governor"] if config.has_section("api_governor") else {}
+    logging = config["logging"] if config.has_section("logging") else {}
+    metrics = config["metrics"] if config.has_section("metrics") else {}
+    recorder = config["recorder"] if config.has_section("recorder") else {}
 
     return Config(
         tg_bot=TgBot(
@@ -65,6 +227,125 @@ def load_config(path: str):
             redis_password=tg_bot.get("redis_password"),
             redis_prefix=tg_bot.get("redis_prefix")
         ),
-        db=DbConfig(**config["db"]),
-        instagram=Instagram(**config["instagram"]),
+        db=DbConfig(
+            host=db["host"],
+            port=db["port"],
+            password=db["password"],
+            user=db["user"],
+            database=db["database"],
+            pool_size=int(db.get("pool_size", 10)),
+            max_overflow=int(db.get("max_overflow", 20)),
+            statement_cache_size=int(db.get("statement_cache_size", 500))
+        ),
+        webhook=Webhook(
+            enabled=cast_bool(webhook.get("enabled")),
+            url=webhook.get("url", ""),
+            path=webhook.get("path", "/webhook"),
+            secret_token=webhook.get("secret_token", ""),
+            listen_host=webhook.get("listen_host", "0.0.0.0"),
+            listen_port=int(webhook.get("listen_port", 8080)),
+            max_connections=int(webhook.get("max_connections", 40)),
+            workers=int(webhook.get("workers", 1)),
+            max_pending_updates=int(webhook.get("max_pending_updates", 1000))
+        ),
+        instagram=Instagram(
+            username=instagram["username"],
+            password=instagram["password"],
+            carousel_concurrency=int(
+                instagram.get("carousel_concurrency", 4)),
+            download_concurrency=int(
+                instagram.get("download_concurrency", 16)),
+            api_base=instagram.get("api_base", "")
+        ),
+        youtube=Youtube(
+            extract_workers=int(youtube.get("extract_workers", 4)),
+            extract_in_process=cast_bool(youtube.get("extract_in_process")),
+            metadata_cache_ttl=int(youtube.get("metadata_cache_ttl", 3600)),
+            metadata_cache_mb=int(youtube.get("metadata_cache_mb", 32)),
+            ytdlp_path=youtube.get("ytdlp_path", "yt-dlp")
+        ),
+        scheduler=Scheduler(
+            io_workers=int(scheduler.get("io_workers", 8)),
+            cpu_workers=int(scheduler.get("cpu_workers", 2)),
+            max_queue=int(scheduler.get("max_queue", 100))
+        ),
+        media=Media(
+            max_size_mb=int(media.get("max_size_mb", 10240)),
+            hit_weight=int(media.get("hit_weight", 3600)),
+            min_age=int(media.get("min_age", 300)),
+            rescan_interval=int(media.get("rescan_interval", 600))
+        ),
+        cache=Cache(
+            user_cache_size=int(cache.get("user_cache_size", 10000)),
+            user_cache_ttl=int(cache.get("user_cache_ttl", 3600)),
+            link_cache_size=int(cache.get("link_cache_size", 50000)),
+            link_cache_ttl=int(cache.get("link_cache_ttl", 600)),
+            link_redis_ttl=int(cache.get("link_redis_ttl", 86400)),
+            negative_cache_size=int(cache.get("negative_cache_size", 50000)),
+            not_found_ttl=int(cache.get("not_found_ttl", 86400)),
+            error_ttl=int(cache.get("error_ttl", 60))
+        ),
+        http=Http(
+            limit=int(http.get("limit", 100)),
+            limit_per_host=int(http.get("limit_per_host", 20)),
+            dns_cache_ttl=int(http.get("dns_cache_ttl", 300)),
+            keepalive_timeout=int(http.get("keepalive_timeout", 30)),
+            connect_timeout=int(http.get("connect_timeout", 10)),
+            read_timeout=int(http.get("read_timeout", 60)),
+            total_timeout=int(http.get("total_timeout", 0))
+        ),
+        distributed=Distributed(
+            enabled=cast_bool(distributed.get("enabled")),
+            visibility_timeout=int(distributed.get("visibility_timeout", 600)),
+            max_attempts=int(distributed.get("max_attempts", 3)),
+            retry_delay=int(distributed.get("retry_delay", 10)),
+            worker_concurrency=int(distributed.get("worker_concurrency", 4)),
+            worker_processes=int(distributed.get("worker_processes", 1))
+        ),
+        broadcast=Broadcast(
+            rate=float(broadcast.get("rate", 25)),
+            min_rate=float(broadcast.get("min_rate", 1)),
+            max_rate=float(broadcast.get("max_rate", 30)),
+            concurrency=int(broadcast.get("concurrency", 10)),
+            checkpoint_every=int(broadcast.get("checkpoint_every", 500))
+        ),
+        rate_limit=RateLimit(
+            enabled=cast_bool(rate_limit.get("enabled", "true")),
+            user_capacity=float(rate_limit.get("user_capacity", 30)),
+            user_rate=float(rate_limit.get("user_rate", 0.5)),
+            chat_capacity=float(rate_limit.get("chat_capacity", 60)),
+            chat_rate=float(rate_limit.get("chat_rate", 1)),
+            global_capacity=float(rate_limit.get("global_capacity", 600)),
+            global_rate=float(rate_limit.get("global_rate", 30))
+        ),
+        api_governor=ApiGovernor(
+            enabled=cast_bool(api_governor.get("enabled", "true")),
+            global_rate=float(api_governor.get("global_rate", 30)),
+            chat_interval=float(api_governor.get("chat_interval", 1)),
+            group_interval=float(api_governor.get("group_interval", 3)),
+            chat_burst=int(api_governor.get("chat_burst", 3)),
+            max_retries=int(api_governor.get("max_retries", 3))
+        ),
+        logging=Logging(
+            console_level=logging.get("console_level", "INFO"),
+            file_level=logging.get("file_level", "INFO"),
+            error_level=logging.get("error_level", "ERROR"),
+            debug_level=logging.get("debug_level", ""),
+            backtrace=cast_bool(logging.get("backtrace", "true")),
+            diagnose=cast_bool(logging.get("diagnose")),
+            enqueue=cast_bool(logging.get("enqueue", "true")),
+            payload_sample_rate=float(logging.get("payload_sample_rate", 0.01))
+        ),
+        metrics=Metrics(
+            enabled=cast_bool(metrics.get("enabled", "false")),
+            host=metrics.get("host", "127.0.0.1"),
+            port=int(metrics.get("port", 9720)),
+            worker_port=int(metrics.get("worker_port", 9820))
+        ),
+        recorder=Recorder(
+            enabled=cast_bool(recorder.get("enabled")),
+            path=recorder.get("path", "recordings/updates.jsonl"),
+            salt=recorder.get("salt", ""),
+            keep_text=cast_bool(recorder.get("keep_text"))
+        ),
     )
@@ -2,11 +2,46 @@ from aiogram import Dispatcher
 from aiogram.dispatcher import FSMContext
 from aiogram.types import Message
 
+from loguru import logger
+
+from tgbot.misc.broadcast import start_broadcast
+from tgbot.models.broadcast import Broadcast
+from tgbot.services.rate_limiter import RateLimiter
+
 
 async def admin_start(m: Message, state: FSMContext):
     await m.reply("Hello, admin!")
 
 
+async def admin_broadcast(m: Message):
+    if not m.reply_to_message:
+        await m.reply("Reply with /broadcast to the message you want to send.")
+        return
+    broadcast = await Broadcast.add_broadcast(
+        m.bot.get('db'),
+        Broadcast(m.chat.id, m.reply_to_message.message_id, m.chat.id))
+    logger.info(f"Admin {m.from_user.id} started broadcast {broadcast.id}")
+    start_broadcast(m.bot, broadcast)
+    await m.reply(f"Broadcast {broadcast.id} started.")
+
+
+async def admin_limits(m: Message):
+    """/limits [user_id] - rate limiter buckets of the user and stats"""
+    limiter: RateLimiter = m.bot.get('rate_limiter')
+    if not limiter:
+        await m.reply("Rate limiter is disabled.")
+        return
+    args = m.get_args()
+    user_id = int(args) if args and args.isdigit() else m.from_user.id
+    state = await limiter.inspect(user_id=user_id, chat_id=user_id)
+    lines = [f"{scope}: {s['tokens']}/{s['capacity']} tokens, +{s['rate']}/sec"
+             for scope, s in state.items()]
+    stats = limiter.stats()
+    lines.append(f"\nbackend: {stats['backend']}, allowed: {stats['allowed']}, "
+                 f"limited: {stats['limited']}")
+    await m.reply(f"Limits of {user_id}:\n" + "\n".join(lines))
+
+
 def register_admin(dp: Dispatcher):
     dp.register_message_handler(
         admin_start,
@@ -14,3 +49,15 @@ def register_admin(dp: Dispatcher):
         state="*",
         is_admin=True
     )
+    dp.register_message_handler(
+        admin_broadcast,
+        commands=["broadcast"],
+        state="*",
+        is_admin=True
+    )
+    dp.register_message_handler(
+        admin_limits,
+        commands=["limits"],
+        state="*",
+        is_admin=True
+    )
@@ -0,0 +1,142 @@
+from aiogram import Bot
+from aiogram.types import CallbackQuery, Message
+
+from loguru import logger
+
+from tgbot.api.extractor import CODES, DownloadError
+from tgbot.handlers.user import (
+    media_download_and_send, youtube_download_and_send,
+    send_from_id, send_youtube_from_id, reply_download_error, youtube_failure,
+    forget_file, STALE_FILE_ID_ERRORS)
+from tgbot.misc.progress import StatusMessage
+from tgbot.misc.singleflight import SingleFlight, AlreadyInFlight
+from tgbot.misc.utils import youtube_link_url
+from tgbot.services.job_queue import QueuedJob
+from tgbot.services.link_cache import LinkCache
+
+
+FAILED_TEXT = "Something went wrong. Please try again later."
+
+
+async def media_job(bot: Bot, job: QueuedJob):
+    m = Message.to_object(job.payload['message'])
+    url = job.payload['url']
+    status = StatusMessage.reply_to(
+        m, message_id=job.payload.get('status_message_id'))
+    db = bot['db']
+    db_user = await bot['user_cache'].get_user(db, m.from_user)
+
+    extractor, key = bot['extractors'].for_url(url)
+    if not extractor:
+        raise ValueError(f"No extractor for {url}")
+
+    # Another worker could finish the same post while this job was queued
+    link_cache: LinkCache = bot['link_cache']
+    file = await link_cache.get(db, str(key))
+    if file:
+        bot['media_cache'].touch(file.path)
+        try:
+            await send_from_id(m, file.type, file.telegram_file_id)
+            await status.delete()
+            return
+        except STALE_FILE_ID_ERRORS:
+            await forget_file(db, file)
+    # Retries of the job are not stopped by its own failure
+    if job.attempts <= 1:
+        code = await bot['negative_cache'].get(str(key))
+        if code is not None:
+            await reply_download_error(m, url, code, status)
+            return
+
+    singleflight: SingleFlight = bot['singleflight']
+    result, shared = await singleflight.do(
+        key, media_download_and_send, m, url, extractor, key, db, db_user, status,
+        member=m.from_user.id)
+    if type(result) != tuple:
+        # Transient errors are retried by the queue, the user is told
+        # after the last attempt
+        if result != CODES.NOT_FOUND.value:
+            raise DownloadError(f"{url} was not downloaded", code=result)
+        await reply_download_error(m, url, result, status)
+    elif shared:
+        await send_from_id(m, *result)
+        await status.delete()
+
+
+async def youtube_job(bot: Bot, job: QueuedJob):
+    cb = CallbackQuery.to_object(job.payload['callback_query'])
+    callback_data = job.payload['callback_data']
+    type = callback_data['type']
+    video_id = callback_data['video_id']
+    format_id = callback_data['format_id']
+    status = StatusMessage.answer_to(
+        cb.message, message_id=job.payload.get('status_message_id'))
+    db = bot['db']
+    db_user = await bot['user_cache'].get_user(db, cb.from_user)
+
+    key = youtube_link_url(video_id, type, format_id)
+    link_cache: LinkCache = bot['link_cache']
+    file = await link_cache.get(db, key)
+    if file:
+        bot['media_cache'].touch(file.path)
+        try:
+            await send_youtube_from_id(cb, callback_data, file.telegram_file_id)
+            await status.delete()
+            return
+        except STALE_FILE_ID_ERRORS:
+            await forget_file(db, file)
+    url = f"https://youtu.be/{video_id}"
+    if job.attempts <= 1:
+        code = await youtube_failure(bot['negative_cache'], video_id, type, format_id)
+        if code is not None:
+            await reply_download_error(cb, url, code, status)
+            return
+
+    singleflight: SingleFlight = bot['singleflight']
+    try:
+        file_id, shared = await singleflight.do(
+            key, youtube_download_and_send, cb, callback_data, db, db_user, status,
+            member=cb.from_user.id)
+    except DownloadError as e:
+        # Missing video is not retried, other errors are
+        if e.code != CODES.NOT_FOUND.value:
+            raise
+        await reply_download_error(cb, url, e.code, status)
+        return
+    if shared:
+        await send_youtube_from_id(cb, callback_data, file_id)
+        await status.delete()
+
+
+JOBS = {
+    "media": media_job,
+    # Queued by older versions
+    "instagram": media_job,
+    "youtube": youtube_job,
+}
+
+
+async def execute_job(bot: Bot, job: QueuedJob):
+    """Run queued download job, exceptions are left to the worker to retry"""
+    handler = JOBS.get(job.payload.get('type'))
+    if handler is None:
+        raise ValueError(f"Unknown job type: {job.payload.get('type')}")
+    try:
+        await handler(bot, job)
+    except AlreadyInFlight:
+        # The same user already waits for this download in this worker
+        logger.info(f"{job} is already in flight")
+
+
+async def notify_failed(bot: Bot, job: QueuedJob, error: Exception):
+    """Tell user that the job failed after the last attempt"""
+    if 'message' in job.payload:
+        chat_id = job.payload['message']['chat']['id']
+    else:
+        chat_id = job.payload['callback_query']['message']['chat']['id']
+    text = FAILED_TEXT
+    if isinstance(error, DownloadError):
+        text = "Could not download. Please try again later."
+    status = StatusMessage(bot, chat_id,
+                           message_id=job.payload.get('status_message_id'))
+    await status.update(text)
@@ -6,29 +6,49 @@ from aiofiles import open as aioopen
 from aiogram import Dispatcher
 from aiogram.types import (CallbackQuery, Message, MediaGroup,
                            InputFile, InputMediaVideo, InputMediaPhoto, InputMediaAudio)
+from aiogram.utils.exceptions import WrongFileIdentifier, WrongRemoteFileIdSpecified
 
 from loguru import logger
 
-from tgbot.config import Config
-from tgbot.api.instagram import Instagram, CODES
-from tgbot.api.youtube import (
-    youtube_video_download, youtube_audio_download,
-    get_main_data, save_thumbnail, get_thumbnail)
-from tgbot.models.user import User
+from tgbot.api.extractor import CODES, DownloadError, Extractor, Extractors
+from tgbot.api.youtube import save_thumbnail, get_thumbnail
 from tgbot.models.link import Link
 from tgbot.models.file import File
 from tgbot.keyboards.inline import UserInline
-from tgbot.misc.utils import (
-    SPP_SM_BASE_URLS, is_url,
-    is_allowed_social_media, clean_url,
-    show_format_sizes
-)
+from tgbot.services.user_cache import CachedUser
+from tgbot.services.scheduler import JobScheduler, JobKind, QueueFull
+from tgbot.services.media_cache import MediaCache
+from tgbot.services.link_cache import LinkCache, CachedFile
+from tgbot.services.negative_cache import NegativeCache
+from tgbot.services.job_queue import RedisJobQueue
+from tgbot.misc.utils import is_url, show_format_sizes, youtube_link_url
+from tgbot.misc.media_key import MediaKey, YOUTUBE
+from tgbot.misc.singleflight import SingleFlight, AlreadyInFlight
+from tgbot.misc.progress import StatusMessage
+from tgbot.middlewares.throtling import rate_limit
+from tgbot.services.metrics import (
+    HANDLER_LATENCY, UPLOAD_DURATION, DOWNLOADS, LINK_REUSE, timed)
+
+
+BUSY_TEXT = "Bot is busy right now. Please try again in a few minutes."
+
+# Rate limiter tokens taken by the handlers, see ThrottlingMiddleware
+DOWNLOAD_COST = 5
+
+
+def youtube_download_cost(cb: CallbackQuery, data: dict) -> int:
+    """Cost grows with the video height, 1080p costs 15 tokens"""
+    callback_data = data.get('callback_data') or {}
+    if callback_data.get('type') != 'video':
+        return DOWNLOAD_COST
+    return max(DOWNLOAD_COST, int(callback_data.get('height') or 0) // 72)
 
 
 class Sender(object):
     async def gen_caption(self, bot) -> str:
-        bot = await bot.get_me()
-        return f"Downloaded via @{bot.username}"
+        # Bot identity is requested once on startup, see setup_context
+        me = bot.get('me') or await bot.me
+        return f"Downloaded via @{me.username}"
 
     async def get_album_file_ids(self, album_message: list) -> str:
         file_ids = []
@@ -36,9 +56,10 @@ class Sender(object):
             if msg.photo:
                 file_ids.append(f"{msg.photo[0].file_id}|image")
             elif msg.video:
-                file_ids.append(f"{msg.video.file_id}||video")
+                file_ids.append(f"{msg.video.file_id}|video")
         return ",".join(file_ids)
 
+    @timed(UPLOAD_DURATION, type="image")
     async def send_image_from_path(self, obj: Message, path: str, chat_id: int) -> str:
         caption = await self.gen_caption(obj.bot)
         async with aioopen(path, 'rb') as f:
@@ -46,36 +67,33 @@ class Sender(object):
             # Return file's telegram id
             return msg.photo[0].file_id
 
+    @timed(UPLOAD_DURATION, type="video")
     async def send_video_from_path(self, obj: Message, path: str, chat_id: int) -> str:
         caption = await self.gen_caption(obj.bot)
         async with aioopen(path, 'rb') as f:
             msg = await obj.bot.send_video(chat_id, f, caption=caption)
             return msg.video.file_id
 
+    @timed(UPLOAD_DURATION, type="carousel")
     async def send_album_from_path(self, obj: Message, path: str, chat_id: int) -> str:
         caption = await self.gen_caption(obj.bot)
         media = MediaGroup()
-        # Get all files in path (directory)
-        for index, f in enumerate(os.listdir(path)):
+        # Get all files in path (directory) in post order, files are named by index
+        files = sorted(
+            os.listdir(path),
+            key=lambda f: int(f.split(".")[0]) if f.split(".")[0].isdigit() else -1
+        )
+        for f in files:
             file_path = os.path.join(path, f)
             if os.path.isfile(file_path):
                 file_type = f.split(".")[-1]
                 logger.debug(f"File: {file_path}")
-                async with aioopen(file_path, 'rb') as f:
-                    if file_type in ["jpg", "jpeg", "png", "gif", "webp"]:
-                        if index == 0:
-                            media.attach_photo(
-                                InputFile(f), caption)
-                        else:
-                            media.attach_photo(
-                                InputFile(f))
-                    elif file_type in ["mp4", "mov", "avi", "mkv"]:
-                        if index == 0:
-                            media.attach_video(
-                                InputFile(f), caption)
-                        else:
-                            media.attach_video(
-                                InputFile(f))
+                # Caption is shown only if it is attached to the first item
+                item_caption = caption if not media.media else None
+                if file_type in ["jpg", "jpeg", "png", "gif", "webp"]:
+                    media.attach_photo(InputFile(file_path), item_caption)
+                elif file_type in ["mp4", "mov", "avi", "mkv"]:
+                    media.attach_video(InputFile(file_path), item_caption)
         # Send as album
         msg = await obj.bot.send_media_group(chat_id, media)
         return await self.get_album_file_ids(msg)
@@ -95,17 +113,19 @@ class Sender(object):
         media = MediaGroup()
         file_ids = file_ids.split(",")
         for index, file_id in enumerate(file_ids):
+            # old records were saved as "<file_id>||video"
             file = file_id.split("|")
-            if file[1] == "image":
+            file_id, file_type = file[0], file[-1]
+            if file_type == "image":
                 if index == 0:
-                    media.attach_photo(file[0], caption)
+                    media.attach_photo(file_id, caption)
                 else:
-                    media.attach_photo(file[0])
-            elif file[1] == "video":
+                    media.attach_photo(file_id)
+            elif file_type == "video":
                 if index == 0:
-                    media.attach_video(file[0], caption)
+                    media.attach_video(file_id, caption)
                 else:
-                    media.attach_video(file[0])
+                    media.attach_video(file_id)
         await obj.bot.send_media_group(chat_id, media)
 
 
@@ -116,12 +136,137 @@ async def user_start(m: Message):
         "Send me a link to the image or video and I will download it for you!\n"
         "Supported social media:\n"
         "    ○ Instagram\n"
-        "    ○ Youtube\n")
+        "    ○ Youtube\n"
+        "    ○ TikTok\n")
+
+
+async def run_job(status: StatusMessage, kind: JobKind, func, *args, **kwargs):
+    """
+    Run download job through the scheduler and show its queue position
+    in the status message. Raises QueueFull if the bot is overloaded
+    """
+    scheduler: JobScheduler = status.bot.get('scheduler')
+    job = scheduler.submit(kind, func, *args, **kwargs)
+    if job.position:
+        await status.update(f"⏳ You're #{job.position} in queue, "
+                            f"it will take about {scheduler.eta(job)} sec.")
+    return await job
+
+
+async def media_download_and_send(m: Message, url: str, extractor: Extractor,
+                                  key: MediaKey, db, db_user: CachedUser,
+                                  status: StatusMessage) -> int or tuple:
+    """
+    Download media of a direct extractor (Instagram post, TikTok video),
+    send it to the chat and save it to the database.
+    Returns tuple (file_type, telegram_file_id) or error code
+    """
+    try:
+        result = await run_job(status, extractor.job_kind, extractor.download,
+                               key, url, status, name=f"{key.platform}_download")
+    except DownloadError as e:
+        DOWNLOADS.inc(platform=key.platform,
+                      result="not_found" if e.code == CODES.NOT_FOUND.value else "error")
+        await m.bot.get('negative_cache').put(str(key), e.code)
+        return e.code
+    DOWNLOADS.inc(platform=key.platform, result="ok")
+
+    logger.success(f"User {m.from_user.id} downloaded {url}")
+    media_cache: MediaCache = m.bot.get('media_cache')
+    media_cache.add(result['path'])
+    try:
+        await status.update("📤 Sending...")
+        if result['file_type'] == 'image':
+            r = await Sender().send_image_from_path(m, result['path'], m.chat.id)
+        elif result['file_type'] == 'video':
+            r = await Sender().send_video_from_path(m, result['path'], m.chat.id)
+        elif result['file_type'] == 'carousel':
+            r = await Sender().send_album_from_path(m, result['path'], m.chat.id)
+        else:
+            raise ValueError(f"Unknown file type: {result['file_type']}")
+        if result.get('failed'):
+            # Do not save incomplete album, so next request will try again
+            await status.update(f"{len(result['failed'])} item(s) of this post "
+                                "could not be downloaded.")
+        else:
+            await status.delete()
+            file = File(result['file_type'], result['path'], r)
+            file = await File.add_file(db, file)
+            link = Link(str(key), key.platform.upper(), file.id, db_user.id)
+            await Link.add_link(db, link)
+            await m.bot.get('link_cache').put(
+                str(key), CachedFile(result['file_type'], r, result['path']))
+            media_cache.mark_uploaded(result['path'])
+        logger.success(f"User {m.from_user.id} successfully sended {url}")
+        return result['file_type'], r
+    except Exception as e:
+        logger.warning(
+            f"User {m.from_user.id} could not upload {result['path']}.")
+        raise e
+
+
+async def send_from_id(m: Message, file_type: str, telegram_file_id: str):
+    """Send already uploaded file by its telegram file id"""
+    if file_type == 'image':
+        await Sender().send_image_from_id(m, telegram_file_id, m.chat.id)
+    elif file_type == 'video':
+        await Sender().send_video_from_id(m, telegram_file_id, m.chat.id)
+    elif file_type == 'carousel':
+        await Sender().send_album_from_ids(m, telegram_file_id, m.chat.id)
+    else:
+        raise ValueError(f"Unknown file type: {file_type}")
+
+
+# Telegram does not know the saved file id anymore
+STALE_FILE_ID_ERRORS = (WrongFileIdentifier, WrongRemoteFileIdSpecified)
+
+
+async def forget_file(db, file: CachedFile):
+    """
+    Delete the file whose id was rejected by Telegram, so its links are
+    downloaded again. File.change_hooks drop them from the link cache
+    """
+    logger.warning(f"Telegram rejected {file}, it will be downloaded again")
+    await File(file.type, file.path, file.telegram_file_id).delete_file(db)
+
+
+async def reply_download_error(obj: Message or CallbackQuery, url: str, code: int,
+                               status: StatusMessage):
+    """Tell user why the media could not be downloaded"""
+    if code == CODES.NOT_FOUND.value:
+        logger.warning(f"User {obj.from_user.id} could not download {url}.\n"
+                       f"Not found: {code}")
+        await status.update("Could not find this post or video. Maybe it was deleted, "
+                            "you typed the wrong url or it is private.")
+    else:
+        logger.error(f"User {obj.from_user.id} could not download {url}.\n"
+                     f"Error code: {code}")
+        await status.update("Could not download. Please try again later.")
+
+
+async def enqueue_download(obj: Message or CallbackQuery, status: StatusMessage,
+                           payload: dict) -> bool:
+    """
+    In distributed mode put download job to the queue shared with
+    workers (see worker.py) instead of downloading in this process.
+    The worker continues to edit the status message.
+    Returns False if distributed mode is disabled
+    """
+    job_queue: RedisJobQueue = obj.bot.get('job_queue')
+    if not job_queue:
+        return False
+    await status.update("⏳ Your download is queued...")
+    payload['status_message_id'] = status.message_id
+    job_id = await job_queue.enqueue(payload)
+    logger.info(f"User {obj.from_user.id} queued {payload['type']} job {job_id}")
+    return True
 
 
-async def user_downloader(m: Message, db_user: User):
-    config: Config = m.bot.get('config')
+@rate_limit(DOWNLOAD_COST)
+@timed(HANDLER_LATENCY, handler="user_downloader")
+async def user_downloader(m: Message, db_user: CachedUser):
     db = m.bot.get('db')
+    singleflight: SingleFlight = m.bot.get('singleflight')
     url = m.text
     logger.info(f"User {m.from_user.id} is trying to download {url}")
 
@@ -129,125 +274,126 @@ async def user_downloader(m: Message, db_user: User):
         await m.reply("Invalid url!")
         return
 
-    social_media = await is_allowed_social_media(url)
-    if not social_media:
-        await m.reply("This url is not in supported social media!")
+    extractors: Extractors = m.bot.get('extractors')
+    extractor, key = extractors.for_url(url)
+    if not extractor:
+        if extractors.is_supported_host(url):
+            await m.reply("Send a link to a post, reel or video, please!")
+        else:
+            await m.reply("This url is not in supported social media!")
         return
 
-    text = "Preparing..."
-    is_already_downloaded = await Link.get_link(db, await clean_url(url))
-    if is_already_downloaded:
+    link_cache: LinkCache = m.bot.get('link_cache')
+    file = await link_cache.get(db, str(key))
+    if file:
         logger.info(
             f"User {m.from_user.id} is trying to download an already downloaded link")
-        await m.reply(text)
-        link = is_already_downloaded
-        file = await link.get_file(db)
+        m.bot.get('media_cache').touch(file.path)
+        LINK_REUSE.inc(platform=key.platform)
         try:
-            await m.reply("Sending...")
-            url = await clean_url(url)
-            if file.type == 'image':
-                await Sender().send_image_from_id(m, file.telegram_file_id, m.chat.id)
-            elif file.type == 'video':
-                await Sender().send_video_from_id(m, file.telegram_file_id, m.chat.id)
-            elif file.type == 'carousel':
-                await Sender().send_album_from_ids(m, file.telegram_file_id, m.chat.id)
-            else:
-                raise
+            await send_from_id(m, file.type, file.telegram_file_id)
             return
+        except STALE_FILE_ID_ERRORS:
+            await forget_file(db, file)
         except Exception as e:
             logger.warning(
                 f"User {m.from_user.id} could not upload {file}.")
             await m.reply("Something went wrong. Please try again later.")
             raise e
 
-    text += "\nYou're first who asked for this :)"
-    await m.reply(text)
-
-    if SPP_SM_BASE_URLS.INSTAGRAM.value == social_media:
-        logger.info(f"User {m.from_user.id} url from Instagram")
-        insta = Instagram(config.instagram.username, config.instagram.password)
-        result = await insta.download_post(url)
-        if type(result) in [int, None]:
-            if result in [CODES.COULD_NOT_LOGIN.value,
-                          CODES.COULD_NOT_DOWNLOAD,
-                          CODES.ERROR.value]:
-                logger.error(f"User {m.from_user.id} could not download {url}.\n"
-                             f"Error code: {result}")
-                await m.reply("Could not download. Please try again later.")
-                return
-
-            if result == CODES.NOT_FOUND.value:
-                logger.warning(f"User {m.from_user.id} could not download {url}.\n"
-                               f"Not found: {result}")
-                await m.reply("Could not find post. Maybe it was deleted, "
-                              "you typed the wrong url or this is private profile.")
-                return
-
-        if type(result) == tuple:
-            logger.success(f"User {m.from_user.id} downloaded {url}")
-            if result[0] == CODES.DOWNLOADED.value:
-                try:
-                    result = result[1]
-                    await m.reply("Downloaded! Sending...")
-                    url = await clean_url(url)
-                    if result['file_type'] == 'image':
-                        r = await Sender().send_image_from_path(m, result['path'], m.chat.id)
-                        file = File("image", result['path'], r)
-                        file = await File.add_file(db, file)
-                        link = Link(
-                            url, SPP_SM_BASE_URLS.INSTAGRAM.name, file.id, db_user.id)
-                        await Link.add_link(db, link)
-                    elif result['file_type'] == 'video':
-                        r = await Sender().send_video_from_path(m, result['path'], m.chat.id)
-                        file = File("video", result['path'], r)
-                        file = await File.add_file(db, file)
-                        link = Link(
-                            url, SPP_SM_BASE_URLS.INSTAGRAM.name, file.id, db_user.id)
-                        await Link.add_link(db, link)
-                    elif result['file_type'] == 'carousel':
-                        r = await Sender().send_album_from_path(m, result['path'], m.chat.id)
-                        file = File("carousel", result['path'], r)
-                        file = await File.add_file(db, file)
-                        link = Link(
-                            url, SPP_SM_BASE_URLS.INSTAGRAM.name, file.id, db_user.id)
-                        await Link.add_link(db, link)
-                    else:
-                        raise
-                    logger.success(
-                        f"User {m.from_user.id} successfully sended {url}")
-                    return
-                except Exception as e:
-                    logger.warning(
-                        f"User {m.from_user.id} could not upload {result['path']}.")
-                    await m.reply("Something went wrong. Please try again later.")
-                    raise e
-
-    elif social_media in (SPP_SM_BASE_URLS.YOUTUBE.value,
-                          SPP_SM_BASE_URLS.YOUTUBE_SHORT.value):
-        main_data = await get_main_data(url)
-        thumb = InputFile(await save_thumbnail(main_data['id'], main_data['thumbnail']))
-        sizes = await show_format_sizes(main_data['video_formats'])
-        text = \
-            f"📹 <b>{main_data['title']}</b> <a href=\"{url}\">→</a>\n"\
-            f"📺 #{main_data['channel'].replace(' ', '_')} "\
-            f"<a href=\"{main_data['channel_url']}\">→</a>\n\n"\
-            f"{sizes}"\
-            "\n\n<b>Choose type and quality ↓</b>\n"
-        markup = await UserInline.generate_download_options(
-            video_id=main_data['id'],
-            duration=main_data['duration'],
-            video_formats=main_data['video_formats'],
-            audio_formats=main_data['audio_formats']
-        )
-        await m.answer_photo(thumb, text, reply_markup=markup)
+    # Missing media and recent failures are not requested upstream again
+    negative_cache: NegativeCache = m.bot.get('negative_cache')
+    code = await negative_cache.get(str(key))
+    if code is not None:
+        await reply_download_error(m, url, code, StatusMessage.reply_to(m))
+        return
 
+    if not extractor.direct:
+        try:
+            await send_format_options(m, extractor, key, url)
+        except DownloadError as e:
+            await negative_cache.put(str(key), e.code)
+            await reply_download_error(m, url, e.code, StatusMessage.reply_to(m))
+        return
 
-async def yt_callback_download(cb: CallbackQuery, callback_data: dict):
-    logger.info(f"User {cb.from_user.id} selected download option")
-    await cb.answer()
-    # old_text = cb.message.text if cb.message.text else ""
-    # await cb.message.edit_text(old_text + "\n\n⬇️ Downloading...")
-    await cb.message.edit_reply_markup(reply_markup='')
+    logger.info(f"User {m.from_user.id} url from {key.platform}")
+    status = StatusMessage.reply_to(m)
+    if await enqueue_download(m, status, {"type": "media",
+                                          "message": m.to_python(),
+                                          "url": url}):
+        return
+    if singleflight.is_waiting(key, m.from_user.id):
+        logger.info(f"User {m.from_user.id} already waits for {url}")
+        return
+    if singleflight.in_flight(key):
+        await status.update("⏳ Preparing...\n"
+                            "Someone is already downloading this, please wait :)")
+    else:
+        await status.update("⏳ Preparing...\nYou're first who asked for this :)")
+
+    try:
+        result, shared = await singleflight.do(
+            key, media_download_and_send, m, url, extractor, key, db, db_user, status,
+            member=m.from_user.id)
+    except AlreadyInFlight:
+        logger.info(f"User {m.from_user.id} already waits for {url}")
+        return
+    except QueueFull:
+        await status.update(BUSY_TEXT)
+        return
+    except Exception as e:
+        await status.update("Something went wrong. Please try again later.")
+        raise e
+
+    if type(result) != tuple:
+        await reply_download_error(m, url, result, status)
+        return
+
+    if shared:
+        try:
+            await status.update("📤 Sending...")
+            await send_from_id(m, *result)
+            await status.delete()
+            logger.success(
+                f"User {m.from_user.id} received shared download of {url}")
+        except Exception as e:
+            logger.warning(
+                f"User {m.from_user.id} could not upload {result}.")
+            await status.update("Something went wrong. Please try again later.")
+            raise e
+
+
+async def send_format_options(m: Message, extractor: Extractor, key: MediaKey,
+                              url: str):
+    """Menu of formats for extractors which are not direct (YouTube)"""
+    main_data = await extractor.resolve(key, url)
+    thumb_path = await save_thumbnail(
+        main_data['id'], main_data['thumbnail'], m.bot.get('http'))
+    m.bot.get('media_cache').add(thumb_path)
+    thumb = InputFile(thumb_path)
+    sizes = await show_format_sizes(main_data['video_formats'])
+    text = \
+        f"📹 <b>{main_data['title']}</b> <a href=\"{url}\">→</a>\n"\
+        f"📺 #{main_data['channel'].replace(' ', '_')} "\
+        f"<a href=\"{main_data['channel_url']}\">→</a>\n\n"\
+        f"{sizes}"\
+        "\n\n<b>Choose type and quality ↓</b>\n"
+    markup = await UserInline.generate_download_options(
+        video_id=main_data['id'],
+        duration=main_data['duration'],
+        video_formats=main_data['video_formats'],
+        audio_formats=main_data['audio_formats']
+    )
+    await m.answer_photo(thumb, text, reply_markup=markup)
+
+
+async def youtube_download_and_send(cb: CallbackQuery, callback_data: dict,
+                                    db, db_user: CachedUser,
+                                    status: StatusMessage) -> str:
+    """
+    Download selected YouTube format, send it to the chat and save it
+    to the database. Returns telegram file id of the sent video or audio
+    """
     type = callback_data['type']
     video_id = callback_data['video_id']
     format_id = callback_data['format_id']
@@ -255,39 +401,179 @@ async def yt_callback_download(cb: CallbackQuery, callback_data: dict):
     height = callback_data['height']
     duration = callback_data['duration']
     url = f"https://youtu.be/{video_id}"
+    key = MediaKey(YOUTUBE, video_id)
+    extractor: Extractor = cb.bot.get('extractors').get(YOUTUBE)
     thumb = await get_thumbnail(video_id)
-    logger.debug(f"User {cb.from_user.id} selected {callback_data}")
+    media_cache: MediaCache = cb.bot.get('media_cache')
 
-    if type == 'video':
-        logger.info(f"User {cb.from_user.id} selected video download")
-        result = await youtube_video_download(video_id, format_id, height, url)
-        logger.success(
-            f"User {cb.from_user.id} downloaded {url}, now sending...")
+    await status.update("⏳ Preparing...")
+    try:
+        if type == 'video':
+            logger.info(f"User {cb.from_user.id} selected video download")
+            result = await run_job(status, extractor.job_kind, extractor.download,
+                                   key, url, status, type=type,
+                                   format_id=format_id, height=height,
+                                   name="youtube_video_download")
+            result = result['path']
+            logger.success(
+                f"User {cb.from_user.id} downloaded {url}, now sending...")
+            media_cache.add(result)
+            DOWNLOADS.inc(platform="youtube", result="ok")
+            await status.update("📤 Sending...")
+            with UPLOAD_DURATION.time(type="video"):
+                msg = await cb.message.answer_video(
+                    InputFile(result),
+                    duration=duration,
+                    thumb=thumb,
+                    caption="@MediaSavingBot",
+                    width=width,
+                    height=height,
+                    supports_streaming=True
+                )
+            file_id = msg.video.file_id
+
+        elif type == 'audio':
+            logger.info(f"User {cb.from_user.id} selected audio download")
+            result = await run_job(status, extractor.job_kind, extractor.download,
+                                   key, url, status, type=type,
+                                   format_id=format_id,
+                                   name="youtube_audio_download")
+            result = result['path']
+            logger.success(
+                f"User {cb.from_user.id} downloaded {url}, now sending...")
+            media_cache.add(result)
+            DOWNLOADS.inc(platform="youtube", result="ok")
+            await status.update("📤 Sending...")
+            with UPLOAD_DURATION.time(type="audio"):
+                msg = await cb.message.answer_audio(
+                    InputFile(result),
+                    duration=duration,
+                    thumb=thumb,
+                    caption="@MediaSavingBot",
+                    performer="@MediaSavingBot",
+                    title="@MediaSavingBot"
+                )
+            file_id = msg.audio.file_id
+
+        else:
+            raise ValueError(f"Unknown file type: {type}")
+    except DownloadError as e:
+        # Missing video is missing in every format, other errors may be
+        # of this format only and must not hide the menu of the video
+        if e.code == CODES.NOT_FOUND.value:
+            await cb.bot.get('negative_cache').put(str(key), e.code)
+        else:
+            await cb.bot.get('negative_cache').put(key.variant(type, format_id), e.code)
+        raise
+    finally:
+        await status.delete()
+
+    link_url = youtube_link_url(video_id, type, format_id)
+    file = await File.add_file(db, File(type, result, file_id))
+    link = Link(link_url, key.platform.upper(), file.id, db_user.id)
+    await Link.add_link(db, link)
+    await cb.bot.get('link_cache').put(
+        link_url, CachedFile(type, file_id, result))
+    media_cache.mark_uploaded(result)
+    return file_id
+
+
+async def youtube_failure(negative_cache: NegativeCache, video_id: str,
+                          type: str, format_id: str) -> int or None:
+    """Error code of the missing video or of its failed format, if remembered"""
+    key = MediaKey(YOUTUBE, video_id)
+    code = await negative_cache.get(str(key))
+    if code is None:
+        code = await negative_cache.get(key.variant(type, format_id))
+    return code
+
+
+async def send_youtube_from_id(cb: CallbackQuery, callback_data: dict, file_id: str):
+    """Send already uploaded YouTube video or audio by its telegram file id"""
+    if callback_data['type'] == 'video':
         await cb.message.answer_video(
-            InputFile(result),
-            duration=duration,
-            thumb=thumb,
+            file_id,
+            duration=callback_data['duration'],
             caption="@MediaSavingBot",
-            width=width,
-            height=height,
+            width=callback_data['width'],
+            height=callback_data['height'],
             supports_streaming=True
         )
-
-    elif type == 'audio':
-        logger.info(f"User {cb.from_user.id} selected audio download")
-        result = await youtube_audio_download(video_id, format_id, url)
-        logger.success(
-            f"User {cb.from_user.id} downloaded {url}, now sending...")
+    elif callback_data['type'] == 'audio':
         await cb.message.answer_audio(
-            InputFile(result),
-            duration=duration,
-            thumb=thumb,
+            file_id,
+            duration=callback_data['duration'],
             caption="@MediaSavingBot",
             performer="@MediaSavingBot",
             title="@MediaSavingBot"
         )
 
 
+@rate_limit(youtube_download_cost)
+@timed(HANDLER_LATENCY, handler="yt_callback_download")
+async def yt_callback_download(cb: CallbackQuery, callback_data: dict,
+                               db_user: CachedUser):
+    logger.info(f"User {cb.from_user.id} selected download option")
+    db = cb.bot.get('db')
+    singleflight: SingleFlight = cb.bot.get('singleflight')
+    type = callback_data['type']
+    video_id = callback_data['video_id']
+    format_id = callback_data['format_id']
+    logger.debug(f"User {cb.from_user.id} selected {callback_data}")
+
+    key = youtube_link_url(video_id, type, format_id)
+    if singleflight.is_waiting(key, cb.from_user.id):
+        await cb.answer("Already downloading, please wait...")
+        return
+    await cb.answer()
+    await cb.message.edit_reply_markup(reply_markup='')
+
+    link_cache: LinkCache = cb.bot.get('link_cache')
+    file = await link_cache.get(db, key)
+    if file:
+        logger.info(
+            f"User {cb.from_user.id} is trying to download an already downloaded video")
+        cb.bot.get('media_cache').touch(file.path)
+        LINK_REUSE.inc(platform="youtube")
+        try:
+            await send_youtube_from_id(cb, callback_data, file.telegram_file_id)
+            return
+        except STALE_FILE_ID_ERRORS:
+            await forget_file(db, file)
+
+    status = StatusMessage.answer_to(cb.message)
+    url = f"https://youtu.be/{video_id}"
+    code = await youtube_failure(cb.bot.get('negative_cache'), video_id, type, format_id)
+    if code is not None:
+        await reply_download_error(cb, url, code, status)
+        return
+
+    if await enqueue_download(cb, status, {"type": "youtube",
+                                           "callback_query": cb.to_python(),
+                                           "callback_data": callback_data}):
+        return
+
+    try:
+        file_id, shared = await singleflight.do(
+            key, youtube_download_and_send, cb, callback_data, db, db_user, status,
+            member=cb.from_user.id)
+    except AlreadyInFlight:
+        return
+    except QueueFull:
+        await status.update(BUSY_TEXT)
+        return
+    except DownloadError as e:
+        DOWNLOADS.inc(platform="youtube",
+                      result="not_found" if e.code == CODES.NOT_FOUND.value else "error")
+        await reply_download_error(cb, url, e.code, status)
+        return
+
+    if shared:
+        logger.success(
+            f"User {cb.from_user.id} received shared download of {video_id}")
+        await send_youtube_from_id(cb, callback_data, file_id)
+
+
 def register_user(dp: Dispatcher):
     dp.register_message_handler(
         user_start,
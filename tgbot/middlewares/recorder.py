@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import re
+import secrets
+import time
+
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from loguru import logger
+
+
+URL_REGEX = re.compile(r"^(?:https?://)?[\w.-]+\.[a-z]{2,}(?:[/?#]\S*)?$", re.IGNORECASE)
+# Share params identify who shared the link, not the media
+TRACKING_PARAMS = {"igshid", "igsh", "si", "feature", "fbclid", "gclid"}
+REDACTED = "redacted"
+
+
+class RecorderMiddleware(BaseMiddleware):
+    """
+    Appends incoming messages and callback queries to a JSON Lines file,
+    one {"ts": unix time, "update": update} per line, for replaying with
+    benchmarks/replay.py.
+
+    Updates are anonymized: user and chat ids are replaced by salted hashes
+    (the same id gets the same pseudonym, so duplicates and spam are
+    kept), names are dropped, and only links, commands and callback data
+    are kept from the text. The file is opened in append mode with line
+    buffering, so every update is one write and lines of several webhook
+    workers stay whole
+    """
+
+    def __init__(self, path: str, salt: str = "", keep_text: bool = False):
+        self.path = path
+        # blake2b key is limited to 64 bytes
+        self.salt = hashlib.sha256((salt or secrets.token_hex(16)).encode()).digest()
+        self.keep_text = keep_text
+        self._file = None
+        self.recorded = 0
+        super(RecorderMiddleware, self).__init__()
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        try:
+            record = self.anonymize(update.to_python())
+            if record is None:
+                return
+            self.write({"ts": round(time.time(), 3), "update": record})
+        except Exception as e:
+            logger.warning(f"Could not record update {update.update_id}: {e}")
+
+    def write(self, record: dict):
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "a", buffering=1, encoding="utf-8")
+        self._file.write(json.dumps(record, ensure_ascii=False,
+                                    separators=(",", ":")) + "\n")
+        self.recorded += 1
+
+    def pseudonym(self, value: int) -> int:
+        """Stable positive id of the same magnitude, the sign is kept for chats"""
+        digest = hashlib.blake2b(str(abs(value)).encode(), digest_size=5,
+                                 key=self.salt).digest()
+        pseudonym = int.from_bytes(digest, "big")
+        return -pseudonym if value < 0 else pseudonym
+
+    def opaque(self, value: str) -> str:
+        return hashlib.blake2b(value.encode(), digest_size=8, key=self.salt).hexdigest()
+
+    def anonymize(self, update: dict) -> dict or None:
+        if "message" in update:
+            return {"update_id": update["update_id"],
+                    "message": self.message(update["message"])}
+        if "callback_query" in update:
+            query = update["callback_query"]
+            record = {
+                "id": self.opaque(query["id"]),
+                "from": self.user(query["from"]),
+                "chat_instance": self.opaque(query.get("chat_instance", "")),
+                "data": query.get("data"),
+            }
+            if "message" in query:
+                record["message"] = self.message(query["message"], with_text=False)
+            return {"update_id": update["update_id"], "callback_query": record}
+        return None
+
+    def user(self, user: dict) -> dict:
+        return {"id": self.pseudonym(user["id"]),
+                "is_bot": user.get("is_bot", False),
+                "first_name": "User",
+                "language_code": user.get("language_code")}
+
+    def message(self, message: dict, with_text: bool = True) -> dict:
+        chat = message["chat"]
+        record = {
+            "message_id": message["message_id"],
+            "date": message["date"],
+            "chat": {"id": self.pseudonym(chat["id"]), "type": chat["type"]},
+        }
+        if "from" in message:
+            record["from"] = self.user(message["from"])
+        if with_text and "text" in message:
+            record["text"] = self.text(message["text"])
+        return record
+
+    def text(self, text: str) -> str:
+        text = text.strip()
+        if text.startswith("/"):
+            # Arguments of commands may be ids or names
+            return text.split()[0]
+        if URL_REGEX.match(text):
+            return self.strip_tracking(text)
+        return text if self.keep_text else REDACTED
+
+    @staticmethod
+    def strip_tracking(url: str) -> str:
+        parts = urlsplit(url)
+        if not parts.query:
+            return url
+        query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                 if k.lower() not in TRACKING_PARAMS and not k.lower().startswith("utm_")]
+        return urlunsplit(parts._replace(query=urlencode(query)))
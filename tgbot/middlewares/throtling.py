@@ -1,22 +1,27 @@
-from aiogram import types, Dispatcher
-from aiogram.dispatcher import DEFAULT_RATE_LIMIT
+from cachetools import TTLCache
+
+from aiogram import types
 from aiogram.dispatcher.handler import CancelHandler, current_handler
 from aiogram.dispatcher.middlewares import BaseMiddleware
-from aiogram.utils.exceptions import Throttled
+
+from loguru import logger
+
+from tgbot.services.rate_limiter import RateLimiter, RateLimited
 
 
-def rate_limit(limit: int, key=None):
+DEFAULT_COST = 1
+
+
+def rate_limit(cost):
     """
-    Decorator for configuring rate limit and key in different functions.
-    :param limit:
-    :param key:
+    Decorator for configuring cost of the handler in rate limiter tokens.
+    :param cost: number or function (obj, data) -> number, for handlers
+                 whose cost depends on the request
     :return:
     """
 
     def decorator(func):
-        setattr(func, 'throttling_rate_limit', limit)
-        if key:
-            setattr(func, 'throttling_key', key)
+        setattr(func, 'throttling_cost', cost)
         return func
 
     return decorator
@@ -24,30 +29,60 @@ def rate_limit(limit: int, key=None):
 
 class ThrottlingMiddleware(BaseMiddleware):
     """
-    Simple middleware
+    Takes cost of the handler from the user, chat and global token buckets
+    of bot['rate_limiter'], messages and callback queries are cancelled
+    when any bucket is empty
     """
 
-    def __init__(self, limit=DEFAULT_RATE_LIMIT, key_prefix='antiflood_'):
-        self.rate_limit = limit
-        self.prefix = key_prefix
+    def __init__(self, default_cost: float = DEFAULT_COST, notify_interval: int = 10):
+        self.default_cost = default_cost
+        # Users already told to wait, so the bot does not answer every message
+        self._notified = TTLCache(maxsize=10000, ttl=notify_interval)
         super(ThrottlingMiddleware, self).__init__()
 
-    async def on_process_message(self, message: types.Message, data: dict):
+    def get_cost(self, obj, data: dict) -> float:
         handler = current_handler.get()
-        dispatcher = Dispatcher.get_current()
-        if handler:
-            limit = getattr(handler, "throttling_rate_limit", self.rate_limit)
-            key = getattr(handler, "throttling_key",
-                          f"{self.prefix}_{handler.__name__}")
-        else:
-            limit = self.rate_limit
-            key = f"{self.prefix}_message"
-        try:
-            await dispatcher.throttle(key, rate=limit)
-        except Throttled as t:
-            await self.message_throttled(message, t)
+        cost = getattr(handler, "throttling_cost", self.default_cost) \
+            if handler else self.default_cost
+        if callable(cost):
+            cost = cost(obj, data)
+        return cost
+
+    async def throttle(self, obj, chat: types.Chat, data: dict) -> RateLimited or None:
+        limiter: RateLimiter = obj.bot.get('rate_limiter')
+        if not limiter:
+            return None
+        cost = self.get_cost(obj, data)
+        limited = await limiter.check(obj.from_user.id,
+                                      chat.id if chat else obj.from_user.id,
+                                      cost)
+        if limited:
+            logger.info(f"User {obj.from_user.id} is rate limited by "
+                        f"{limited.scope} bucket, cost {cost}")
+        return limited
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        limited = await self.throttle(message, message.chat, data)
+        if limited:
+            if self._should_notify(message.from_user.id):
+                await message.reply(self.limited_text(limited))
             raise CancelHandler()
 
-    async def message_throttled(self, message: types.Message, throttled: Throttled):
-        if throttled.exceeded_count <= 2:
-            await message.reply("Please, do not spam!")
+    async def on_process_callback_query(self, cb: types.CallbackQuery, data: dict):
+        limited = await self.throttle(
+            cb, cb.message.chat if cb.message else None, data)
+        if limited:
+            await cb.answer(self.limited_text(limited), show_alert=True)
+            raise CancelHandler()
+
+    def limited_text(self, limited: RateLimited) -> str:
+        wait = RateLimiter.format_wait(limited.retry_after)
+        if limited.scope == "global":
+            return f"Bot is busy right now. Please try again in {wait} sec."
+        return f"Please, do not spam! Try again in {wait} sec."
+
+    def _should_notify(self, user_id: int) -> bool:
+        if user_id in self._notified:
+            return False
+        self._notified[user_id] = True
+        return True
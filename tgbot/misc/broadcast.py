@@ -1,31 +1,214 @@
-from typing import List
+import asyncio
+import time
+
 from loguru import logger
 
-from aiogram import md
-from aiogram_broadcaster import MessageBroadcaster
-from aiogram import types
+from aiogram import Bot
+from aiogram.utils.exceptions import (
+    RetryAfter, BotBlocked, ChatNotFound, UserDeactivated,
+    CantInitiateConversation, CantTalkWithBots, TelegramAPIError)
+from sqlalchemy.orm import sessionmaker
 
+from tgbot.models.broadcast import Broadcast, BroadcastStatus
 from tgbot.models.user import User
+from tgbot.services.api_governor import Priority, current_priority
+
+
+# Recipient will never receive messages until it writes to the bot again
+BLOCKED_ERRORS = (BotBlocked, ChatNotFound, UserDeactivated,
+                  CantInitiateConversation, CantTalkWithBots)
+
+
+class BroadcastStats:
+    __slots__ = ("delivered", "failed", "blocked", "started_at")
+
+    def __init__(self, delivered: int = 0, failed: int = 0, blocked: int = 0):
+        self.delivered = delivered
+        self.failed = failed
+        self.blocked = blocked
+        self.started_at = time.monotonic()
+
+    @property
+    def per_second(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return self.delivered / elapsed if elapsed else 0.0
+
+    def __str__(self):
+        return f"{self.delivered} delivered, {self.failed} failed, " \
+            f"{self.blocked} blocked, {self.per_second:.1f} msg/sec"
+
+
+class Broadcaster:
+    """
+    Copies the admin's message to all active users.
 
+    Recipients are streamed from the database by keyset batches. The send
+    rate is adapted to flood control: it grows additively after every
+    delivered message and is halved on RetryAfter, when all senders also
+    pause for the requested time. Progress is checkpointed to the broadcast
+    row, so after restart the broadcast resumes from the last checkpoint
+    (messages in flight at the moment of the crash may be sent twice).
+    """
 
-async def get_mention(chat_id, full_name):
-    return md.hlink(full_name, f'tg://user?id={chat_id}')
+    def __init__(self, bot: Bot, db_session: sessionmaker, broadcast,
+                 rate: float = 25, min_rate: float = 1, max_rate: float = 30,
+                 concurrency: int = 10, checkpoint_every: int = 500):
+        self.bot = bot
+        self.db = db_session
+        self.broadcast = broadcast
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.checkpoint_every = checkpoint_every
+        self.stats = BroadcastStats(broadcast.delivered, broadcast.failed,
+                                    broadcast.blocked)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._next_send_at = 0.0
+        self._paused_until = 0.0
+        self._in_flight = set()
+        self._dispatched_id = broadcast.last_user_id
+        self._blocked_ids = []
+        self._processed = 0
 
+    async def run(self) -> BroadcastStats:
+        logger.info(f"Broadcast {self.broadcast.id} started "
+                    f"after user {self.broadcast.last_user_id}")
+        tasks = set()
+        async for user in User.iter_users(
+                self.db, after_id=self.broadcast.last_user_id, active_only=True):
+            await self._semaphore.acquire()
+            await self._pace()
+            self._in_flight.add(user.id)
+            self._dispatched_id = user.id
+            task = asyncio.ensure_future(self._send(user.id, user.telegram_id))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            if self._processed >= self.checkpoint_every:
+                await self.checkpoint()
+        if tasks:
+            await asyncio.gather(*tasks)
+        await self.checkpoint(BroadcastStatus.FINISHED)
+        logger.success(f"Broadcast {self.broadcast.id} finished: {self.stats}")
+        return self.stats
 
-async def prepare_broadcast(m: dict, db):
-    msg = types.Message
-    msg = msg.to_object(m)
-    all_users = await User.get_all_users(db)
-    logger.success(f'{len(all_users)} users found for broadcast')
-    users = [
-        {'chat_id': i.telegram_id,
-         'mention': await get_mention(i.telegram_id, i.fullname)} for i in all_users
-    ]
+    async def checkpoint(self, status: str = BroadcastStatus.RUNNING) -> None:
+        """Save progress and mark blocked users"""
+        self._processed = 0
+        if self._blocked_ids:
+            blocked_ids, self._blocked_ids = self._blocked_ids, []
+            await User.set_blocked(self.db, blocked_ids)
+        # Users before the oldest message in flight are done
+        last_user_id = min(self._in_flight) - 1 if self._in_flight \
+            else self._dispatched_id
+        await Broadcast.save_progress(
+            self.db, self.broadcast.id, last_user_id, self.stats.delivered,
+            self.stats.failed, self.stats.blocked, status)
+        logger.info(f"Broadcast {self.broadcast.id}: {self.stats}, "
+                    f"rate limit {self.rate:.1f} msg/sec")
+
+    async def _pace(self):
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        send_at = max(self._next_send_at, self._paused_until, now)
+        self._next_send_at = send_at + 1 / self.rate
+        if send_at > now:
+            await asyncio.sleep(send_at - now)
+
+    async def _send(self, user_id: int, chat_id: int):
+        # Deliveries to users who are waiting for their files go first
+        current_priority.set(Priority.BULK)
+        try:
+            while True:
+                try:
+                    await self.bot.copy_message(
+                        chat_id, self.broadcast.from_chat_id,
+                        self.broadcast.message_id)
+                except RetryAfter as e:
+                    self._slow_down(e.timeout)
+                    await self._pace()
+                    continue
+                except BLOCKED_ERRORS:
+                    self.stats.blocked += 1
+                    self._blocked_ids.append(chat_id)
+                    user_cache = self.bot.get('user_cache')
+                    if user_cache:
+                        user_cache.invalidate(chat_id)
+                except TelegramAPIError as e:
+                    self.stats.failed += 1
+                    logger.warning(f"Broadcast {self.broadcast.id} to {chat_id} failed: {e}")
+                except Exception as e:
+                    # Network errors which are not wrapped by aiogram, e.g. timeouts
+                    self.stats.failed += 1
+                    logger.error(f"Broadcast {self.broadcast.id} to {chat_id} failed: {e!r}")
+                else:
+                    self.stats.delivered += 1
+                    self._speed_up()
+                break
+        finally:
+            self._in_flight.discard(user_id)
+            self._processed += 1
+            self._semaphore.release()
+
+    def _speed_up(self):
+        # Additive increase by about 1 msg/sec every second
+        self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+
+    def _slow_down(self, retry_after: int):
+        # Multiplicative decrease and pause of all senders
+        loop = asyncio.get_event_loop()
+        self._paused_until = max(self._paused_until, loop.time() + retry_after)
+        self.rate = max(self.min_rate, self.rate / 2)
+        logger.warning(f"Broadcast {self.broadcast.id} hit flood control, "
+                       f"retry after {retry_after} sec., rate {self.rate:.1f} msg/sec")
+
+
+async def run_broadcast(bot: Bot, broadcast) -> BroadcastStats:
+    """Run or resume the broadcast and report the result to the admin"""
+    config = bot['config']
+    broadcaster = Broadcaster(bot, bot['db'], broadcast,
+                              rate=config.broadcast.rate,
+                              min_rate=config.broadcast.min_rate,
+                              max_rate=config.broadcast.max_rate,
+                              concurrency=config.broadcast.concurrency,
+                              checkpoint_every=config.broadcast.checkpoint_every)
     try:
-        await start_broadcast(msg, users)
+        stats = await broadcaster.run()
+    except asyncio.CancelledError:
+        await broadcaster.checkpoint()
+        raise
     except Exception as e:
-        logger.error(f"Error while broadcasting: {e}")
+        logger.exception(f"Error while broadcasting: {e}")
+        await broadcaster.checkpoint()
+        await bot.send_message(
+            broadcast.admin_chat_id,
+            f"Broadcast {broadcast.id} stopped with error, "
+            f"it will be resumed after restart: {broadcaster.stats}")
+        return broadcaster.stats
+    await bot.send_message(broadcast.admin_chat_id,
+                           f"Broadcast {broadcast.id} finished: {stats}")
+    return stats
+
+
+def start_broadcast(bot: Bot, broadcast) -> asyncio.Task:
+    """Run broadcast in background, the task is kept in bot['broadcasts']"""
+    tasks: set = bot['broadcasts']
+    task = asyncio.ensure_future(run_broadcast(bot, broadcast))
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+    return task
+
+
+async def resume_broadcasts(bot: Bot) -> int:
+    """Continue broadcasts interrupted by restart"""
+    broadcasts = await Broadcast.get_running(bot['db'])
+    for broadcast in broadcasts:
+        start_broadcast(bot, broadcast)
+    return len(broadcasts)
 
 
-async def start_broadcast(msg: types.Message, users: List):
-    await MessageBroadcaster(chats=users, message=msg, timeout=0.034).run()
+async def stop_broadcasts(bot: Bot) -> None:
+    """Checkpoint and cancel running broadcasts, they are resumed on start"""
+    tasks: set = bot['broadcasts']
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,87 @@
+import re
+
+from typing import NamedTuple
+
+
+class MediaKey(NamedTuple):
+    """
+    Platform and id of the media a link points to. Every supported form
+    of the link (short links, mobile and embed hosts, reels, share params)
+    gives the same key, str(key) is "platform:media_id"
+    """
+    platform: str
+    media_id: str
+
+    def __str__(self):
+        return f"{self.platform}:{self.media_id}"
+
+    def variant(self, *parts) -> str:
+        """Key of one rendition of the media, e.g. YouTube format"""
+        return ":".join((str(self), *map(str, parts)))
+
+
+INSTAGRAM = "instagram"
+YOUTUBE = "youtube"
+TIKTOK = "tiktok"
+
+# scheme, host, rest of the url
+URL_REGEX = re.compile(r"^\s*(?:https?://)?([^/?#\s]+)(\S*)", re.IGNORECASE)
+# Subdomains which do not change the media
+HOST_PREFIXES = ("www.", "m.", "mobile.", "music.")
+
+INSTAGRAM_PATH = re.compile(r"^/(?:[\w.]+/)?(?:p|reels?|tv)/([\w-]+)")
+YOUTUBE_PATH = re.compile(
+    r"^/(?:shorts|embed|live|v|e)/([\w-]{11})(?![\w-])"
+    r"|^/watch/?\?(?:[^#]*&)?v=([\w-]{11})(?![\w-])")
+YOUTU_BE_PATH = re.compile(r"^/([\w-]{11})(?![\w-])")
+# Short links are not resolved, so they are keyed by their code
+TIKTOK_PATH = re.compile(
+    r"^/(?:@[\w.-]+/(?:video|photo)|v|embed(?:/v2)?)/(\d+)|^/t/([\w-]+)")
+TIKTOK_SHORT_PATH = re.compile(r"^/(?:t/)?([\w-]+)")
+
+# host without prefixes -> (platform, path regex)
+HOSTS = {
+    "instagram.com": (INSTAGRAM, INSTAGRAM_PATH),
+    "instagr.am": (INSTAGRAM, INSTAGRAM_PATH),
+    "youtube.com": (YOUTUBE, YOUTUBE_PATH),
+    "youtube-nocookie.com": (YOUTUBE, YOUTUBE_PATH),
+    "youtu.be": (YOUTUBE, YOUTU_BE_PATH),
+    "tiktok.com": (TIKTOK, TIKTOK_PATH),
+    "vm.tiktok.com": (TIKTOK, TIKTOK_SHORT_PATH),
+    "vt.tiktok.com": (TIKTOK, TIKTOK_SHORT_PATH),
+}
+
+
+def split_host(url: str) -> tuple:
+    """(host without www. and other prefixes, path with query) or (None, None)"""
+    match = URL_REGEX.match(url)
+    if not match:
+        return None, None
+    host = match.group(1).lower()
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    return host, match.group(2)
+
+
+def canonicalize(url: str) -> MediaKey or None:
+    """Key of the media of a supported link, None for other links"""
+    host, path = split_host(url)
+    platform = HOSTS.get(host)
+    if platform is None:
+        return None
+    name, regex = platform
+    match = regex.match(path)
+    if not match:
+        return None
+    return MediaKey(name, match.group(match.lastindex))
+
+
+def link_key(url: str) -> str:
+    """
+    Value of Link.url for the url: media key of a supported link,
+    keys and other urls are returned as is
+    """
+    key = canonicalize(url)
+    return str(key) if key else url
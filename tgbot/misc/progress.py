@@ -0,0 +1,87 @@
+import time
+
+from aiogram import Bot
+from aiogram.types import Message
+from aiogram.utils.exceptions import TelegramAPIError
+
+from loguru import logger
+
+from tgbot.api.youtube import ProgressEvent
+from tgbot.misc.utils import humanbytes
+
+
+class StatusMessage:
+    """
+    One status message per request, edited through every stage
+    (queue position, download progress, sending) instead of new replies.
+
+    The message is sent by the first update. It is identified only by chat
+    and message ids, so it can be passed to a download worker and edited
+    there. Download progress is edited not more often than once in
+    min_interval seconds
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, reply_to_message_id: int = None,
+                 message_id: int = None, min_interval: float = 3.0):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.reply_to_message_id = reply_to_message_id
+        self.message_id = message_id
+        self.min_interval = min_interval
+        self._last_edit = 0.0
+        self._last_text = None
+
+    @classmethod
+    def reply_to(cls, message: Message, **kwargs) -> 'StatusMessage':
+        return cls(message.bot, message.chat.id,
+                   reply_to_message_id=message.message_id, **kwargs)
+
+    @classmethod
+    def answer_to(cls, message: Message, **kwargs) -> 'StatusMessage':
+        return cls(message.bot, message.chat.id, **kwargs)
+
+    async def format(self, event: ProgressEvent) -> str:
+        if event.stage != "downloading":
+            return f"⚙️ {event.stage.capitalize()}..."
+        text = "⬇️ Downloading"
+        if event.percent is not None:
+            text += f": {event.percent:.0f}% of {await humanbytes(event.total_bytes)}"
+        if event.speed:
+            text += f"\n🚀 {await humanbytes(event.speed)}/s"
+        if event.eta is not None:
+            text += f", ETA {event.eta} sec."
+        return text
+
+    async def __call__(self, event: ProgressEvent):
+        now = time.monotonic()
+        # Stage changes are shown at once, download progress is rate-limited
+        if event.stage == "downloading" and now - self._last_edit < self.min_interval:
+            return
+        await self.update(await self.format(event))
+
+    async def update(self, text: str):
+        if text == self._last_text:
+            return
+        self._last_edit = time.monotonic()
+        self._last_text = text
+        try:
+            if self.message_id is None:
+                msg = await self.bot.send_message(
+                    self.chat_id, text,
+                    reply_to_message_id=self.reply_to_message_id,
+                    allow_sending_without_reply=True)
+                self.message_id = msg.message_id
+            else:
+                await self.bot.edit_message_text(text, self.chat_id, self.message_id)
+        except TelegramAPIError as e:
+            logger.debug(f"Could not update status message: {e}")
+
+    async def delete(self):
+        if self.message_id is None:
+            return
+        try:
+            await self.bot.delete_message(self.chat_id, self.message_id)
+        except TelegramAPIError as e:
+            logger.debug(f"Could not delete status message: {e}")
+        self.message_id = None
+        self._last_text = None
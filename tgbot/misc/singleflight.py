@@ -0,0 +1,89 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable
+
+
+class AlreadyInFlight(Exception):
+    """Raised when the same member is already waiting for the same key"""
+
+
+class SingleFlight:
+    """
+    In-flight registry which coalesces concurrent calls for the same key.
+
+    The first caller of a key (leader) runs the function, every other caller
+    (follower) waits for the leader's result instead of doing the work again.
+    If the leader is cancelled, one of the followers runs the function
+    instead, so other members keep waiting for the result.
+    """
+
+    def __init__(self):
+        self._calls: dict = {}
+        self._members: dict = {}
+        self.leaders = 0
+        self.followers = 0
+        self.reelections = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def is_waiting(self, key: Hashable, member: Hashable) -> bool:
+        return member in self._members.get(key, ())
+
+    async def do(self, key: Hashable, func: Callable[..., Awaitable],
+                 *args, member: Hashable = None, **kwargs) -> tuple:
+        """
+        Run `func(*args, **kwargs)` once per key at a time.
+        Returns tuple (result, shared), where shared is True for followers.
+        """
+        members = self._members.setdefault(key, set())
+        if member is not None:
+            if member in members:
+                raise AlreadyInFlight(key)
+            members.add(member)
+
+        try:
+            future = self._calls.get(key)
+            if future is not None:
+                self.followers += 1
+            while future is not None:
+                try:
+                    # shield: a cancelled follower must not cancel the leader
+                    return await asyncio.shield(future), True
+                except asyncio.CancelledError:
+                    if not future.cancelled():
+                        raise
+                # The leader was cancelled, not this follower: the first
+                # follower to wake up becomes the new leader
+                self.reelections += 1
+                future = self._calls.get(key)
+
+            future = asyncio.get_event_loop().create_future()
+            self._calls[key] = future
+            self.leaders += 1
+            try:
+                result = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_exception(e)
+                # mark exception as retrieved if nobody is waiting for it
+                future.exception()
+                raise
+            else:
+                future.set_result(result)
+                return result, False
+            finally:
+                del self._calls[key]
+        finally:
+            members.discard(member)
+            if not members and key not in self._calls:
+                self._members.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "reelections": self.reelections,
+        }
@@ -3,23 +3,16 @@ import base64
 import zlib
 import validators
 
-from enum import Enum
-
 from loguru import logger
 
+from tgbot.misc.media_key import MediaKey, YOUTUBE
+
 
 UNIVERSAL_UA = \
     'Mozilla/5.0 (Macintosh; U; Intel Mac OS X 10_6_3; en-us; Silk/1.0.146.3-Gen4_12000410) ' \
     'AppleWebKit/533.16 (KHTML, like Gecko) Version/5.0 Safari/533.16 Silk-Accelerated=true'
 
 
-class SPP_SM_BASE_URLS(Enum):
-    INSTAGRAM = "instagram.com"
-    YOUTUBE = "youtube.com"
-    YOUTUBE_SHORT = "youtu.be"
-    # TIKTOK = "tiktok.com"
-
-
 async def clean_url(url: str) -> str:
     """Clean url from "http://", "https://", "www.", last "/" and params"""
     url = url.replace("http://", "")
@@ -31,6 +24,11 @@ async def clean_url(url: str) -> str:
     return url
 
 
+def youtube_link_url(video_id: str, type: str, format_id: str) -> str:
+    """Link url of downloaded YouTube video or audio in selected format"""
+    return MediaKey(YOUTUBE, video_id).variant(type, format_id)
+
+
 async def is_url(url: str) -> bool:
     """Check if url is valid"""
     try:
@@ -40,15 +38,6 @@ async def is_url(url: str) -> bool:
         return False
 
 
-async def is_allowed_social_media(url: str) -> str or None:
-    """Check if url is from allowed social media"""
-    url = await clean_url(url)
-    for sm in SPP_SM_BASE_URLS:
-        if sm.value in url:
-            return sm.value
-    return False
-
-
 async def humanbytes(num, suffix='B'):
     if num is None:
         num = 0
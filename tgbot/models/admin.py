@@ -3,7 +3,8 @@ from sqlalchemy import (Column, String, BigInteger, DateTime,
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql.sqltypes import BigInteger
 
-from tgbot.services.db_base import Base
+from tgbot.services.db_base import Base, iter_keyset
+from tgbot.services.metrics import DB_QUERY_DURATION, timed
 
 
 class Admin(Base):
@@ -16,6 +17,7 @@ class Admin(Base):
         self.telegram_id = telegram_id
 
     @classmethod
+    @timed(DB_QUERY_DURATION, query="admin.get_admin")
     async def get_admin(cls, db_session: sessionmaker, telegram_id: str) -> 'Admin':
         async with db_session() as db_session:
             sql = select([Admin]).where(Admin.telegram_id == telegram_id)
@@ -23,6 +25,7 @@ class Admin(Base):
             return result.scalar()
 
     @classmethod
+    @timed(DB_QUERY_DURATION, query="admin.add_admin")
     async def add_admin(cls, db_session: sessionmaker, admin: 'Admin') -> 'Admin':
         async with db_session() as db_session:
             sql = insert(Admin).values(
@@ -33,19 +36,18 @@ class Admin(Base):
             return result.first()
 
     @classmethod
-    async def get_all_admins(cls, db_session: sessionmaker) -> list:
-        async with db_session() as db_session:
-            sql = select([Admin])
-            result = await db_session.execute(sql)
-            return result.fetchall()
+    def iter_admins(cls, db_session: sessionmaker, batch_size: int = 1000):
+        return iter_keyset(db_session, Admin, batch_size)
 
     @classmethod
+    @timed(DB_QUERY_DURATION, query="admin.count_admins")
     async def count_admins(cls, db_session: sessionmaker) -> int:
         async with db_session() as db_session:
-            sql = select([Admin]).count()
+            sql = select([func.count()]).select_from(Admin)
             result = await db_session.execute(sql)
-            return result.scalar()[0]
+            return result.scalar()
 
+    @timed(DB_QUERY_DURATION, query="admin.update_admin")
     async def update_admin(self, db_session: sessionmaker, admin: 'Admin') -> 'Admin':
         async with db_session() as db_session:
             sql = update(Admin).where(Admin.telegram_id == self.telegram_id).values(
@@ -56,6 +58,7 @@ class Admin(Base):
             return result.scalar()
 
     @classmethod
+    @timed(DB_QUERY_DURATION, query="admin.delete_admin")
     async def delete_admin(cls, db_session: sessionmaker, telegram_id: str) -> None:
         async with db_session() as db_session:
             sql = delete(Admin).where(Admin.telegram_id == telegram_id)
@@ -0,0 +1,85 @@
+from sqlalchemy import (Column, String, BigInteger, DateTime,
+                        insert, update, func, select)
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.sqltypes import BigInteger
+
+from tgbot.services.db_base import Base
+from tgbot.services.metrics import DB_QUERY_DURATION, timed
+
+
+class BroadcastStatus:
+    RUNNING = "running"
+    FINISHED = "finished"
+
+
+class Broadcast(Base):
+    """Broadcast of the admin's message with checkpointed progress"""
+    __tablename__ = "broadcast"
+    id = Column(BigInteger, primary_key=True)
+    from_chat_id = Column(BigInteger)
+    message_id = Column(BigInteger)
+    admin_chat_id = Column(BigInteger)
+    status = Column(String(length=20), default=BroadcastStatus.RUNNING)
+    # All users with id <= last_user_id were processed
+    last_user_id = Column(BigInteger, default=0)
+    delivered = Column(BigInteger, default=0)
+    failed = Column(BigInteger, default=0)
+    blocked = Column(BigInteger, default=0)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now())
+
+    def __init__(self, from_chat_id: int, message_id: int, admin_chat_id: int):
+        self.from_chat_id = from_chat_id
+        self.message_id = message_id
+        self.admin_chat_id = admin_chat_id
+
+    @classmethod
+    @timed(DB_QUERY_DURATION, query="broadcast.add_broadcast")
+    async def add_broadcast(cls, db_session: sessionmaker,
+                            broadcast: 'Broadcast') -> 'Broadcast':
+        async with db_session() as db_session:
+            sql = insert(Broadcast).values(
+                from_chat_id=broadcast.from_chat_id,
+                message_id=broadcast.message_id,
+                admin_chat_id=broadcast.admin_chat_id,
+                status=BroadcastStatus.RUNNING,
+                last_user_id=0,
+                delivered=0,
+                failed=0,
+                blocked=0
+            ).returning(*Broadcast.__table__.columns)
+            result = await db_session.execute(sql)
+            await db_session.commit()
+            return result.first()
+
+    @classmethod
+    @timed(DB_QUERY_DURATION, query="broadcast.get_running")
+    async def get_running(cls, db_session: sessionmaker) -> list:
+        """Broadcasts interrupted by restart, to be resumed"""
+        async with db_session() as db_session:
+            sql = select(*Broadcast.__table__.columns).where(
+                Broadcast.status == BroadcastStatus.RUNNING
+            ).order_by(Broadcast.id)
+            result = await db_session.execute(sql)
+            return result.all()
+
+    @classmethod
+    @timed(DB_QUERY_DURATION, query="broadcast.save_progress")
+    async def save_progress(cls, db_session: sessionmaker, broadcast_id: int,
+                            last_user_id: int, delivered: int, failed: int,
+                            blocked: int, status: str = BroadcastStatus.RUNNING) -> None:
+        async with db_session() as db_session:
+            sql = update(Broadcast).where(Broadcast.id == broadcast_id).values(
+                last_user_id=last_user_id,
+                delivered=delivered,
+                failed=failed,
+                blocked=blocked,
+                status=status,
+                updated_at=func.now()
+            )
+            await db_session.execute(sql)
+            await db_session.commit()
+
+    def __repr__(self):
+        return f"<Broadcast(id={self.id}, status={self.status}, " \
+            f"last_user_id={self.last_user_id})>"
@@ -3,7 +3,8 @@ from sqlalchemy import (Column, String, BigInteger, DateTime,
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql.sqltypes import BigInteger
 
-from tgbot.services.db_base import Base
+from tgbot.services.db_base import Base, iter_keyset, estimate_count
+from tgbot.services.metrics import DB_QUERY_DURATION, timed
 
 
 class File(Base):
@@ -14,6 +15,9 @@ class File(Base):
     telegram_file_id = Column(String(length=2000), unique=True)
     downloaded_at = Column(DateTime, default=func.now())
 
+    # Coroutines called with telegram_file_id when the file is changed or deleted
+    change_hooks = []
+
     def __init__(self, type: str, path: str,
                  telegram_file_id: str):
         self.type = type
@@ -21,6 +25,7 @@ class File(Base):
         self.telegram_file_id = telegram_file_id
 
     @classmethod
+    @timed(DB_QUERY_DURATION, query="file.get_file")
     async def get_file(cls, db_session: sessionmaker, telegram_file_id: str) -> 'File':
         async with db_session() as db_session:
             sql = select([File]).where(
@@ -29,6 +34,7 @@ class File(Base):
             return result.scalar()
 
     @classmethod
+    @timed(DB_QUERY_DURATION, query="file.add_file")
     async def add_file(cls, db_session: sessionmaker, file: 'File') -> 'File':
         async with db_session() as db_session:
             sql = insert(File).values(
@@ -41,19 +47,20 @@ class File(Base):
             return result.first()
 
     @classmethod
-    async def get_all_files(cls, db_session: sessionmaker) -> list:
-        async with db_session() as db_session:
-            sql = select([File])
-            result = await db_session.execute(sql)
-            return result.fetchall()
+    def iter_files(cls, db_session: sessionmaker, batch_size: int = 1000):
+        return iter_keyset(db_session, File, batch_size)
 
     @classmethod
-    async def count_files(cls, db_session: sessionmaker) -> int:
+    @timed(DB_QUERY_DURATION, query="file.count_files")
+    async def count_files(cls, db_session: sessionmaker, estimate: bool = False) -> int:
+        if estimate:
+            return await estimate_count(db_session, File.__tablename__)
         async with db_session() as db_session:
-            sql = select([File]).count()
+            sql = select([func.count()]).select_from(File)
             result = await db_session.execute(sql)
-            return result.scalar()[0]
+            return result.scalar()
 
+    @timed(DB_QUERY_DURATION, query="file.update_file")
     async def update_file(self, db_session: sessionmaker, file: 'File') -> 'File':
         async with db_session() as db_session:
             sql = update(File).where(File.telegram_file_id == self.telegram_file_id).values(
@@ -63,14 +70,22 @@ class File(Base):
             )
             result = await db_session.execute(sql)
             await db_session.commit()
-            return result.scalar()
+        await self.notify_change(self.telegram_file_id)
+        return result.scalar()
 
+    @timed(DB_QUERY_DURATION, query="file.delete_file")
     async def delete_file(self, db_session: sessionmaker) -> None:
         async with db_session() as db_session:
             sql = delete(File).where(
                 File.telegram_file_id == self.telegram_file_id)
             await db_session.execute(sql)
             await db_session.commit()
+        await self.notify_change(self.telegram_file_id)
+
+    @classmethod
+    async def notify_change(cls, telegram_file_id: str) -> None:
+        for hook in cls.change_hooks:
+            await hook(telegram_file_id)
 
     async def __repr__(self):
         return f"<File(id={self.id}, type={self.type}, " \
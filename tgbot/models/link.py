@@ -1,10 +1,12 @@
 from sqlalchemy import (Column, String, BigInteger, DateTime, ForeignKey,
-                        insert, update, func, delete, select)
+                        update, func, delete, select)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql.sqltypes import BigInteger
 
-from tgbot.services.db_base import Base
-from tgbot.misc.utils import clean_url
+from tgbot.services.db_base import Base, iter_keyset, estimate_count
+from tgbot.services.metrics import DB_QUERY_DURATION, timed
+from tgbot.misc.media_key import link_key
 from tgbot.models.user import User
 from tgbot.models.file import File
 
@@ -15,8 +17,8 @@ class Link(Base):
     url = Column(String(length=255), unique=True)
     social_media = Column(String(length=50))
     created_at = Column(DateTime, default=func.now())
-    file_id = Column(BigInteger, ForeignKey(File.id, ondelete='SET NULL'))
-    user_id = Column(BigInteger, ForeignKey(User.id, ondelete='SET NULL'))
+    file_id = Column(BigInteger, ForeignKey(File.id, ondelete='SET NULL'), index=True)
+    user_id = Column(BigInteger, ForeignKey(User.id, ondelete='SET NULL'), index=True)
 
     def __init__(self, url: str, social_media: str, file_id: int, user_id: int):
         self.url = url
@@ -25,43 +27,65 @@ class Link(Base):
         self.user_id = user_id
 
     @classmethod
+    @timed(DB_QUERY_DURATION, query="link.get_link")
     async def get_link(cls, db_session: sessionmaker, url: str) -> 'Link':
         async with db_session() as db_session:
-            sql = select([Link]).where(Link.url == await clean_url(url))
+            sql = select([Link]).where(Link.url == link_key(url))
             result = await db_session.execute(sql)
             return result.scalar()
 
     @classmethod
+    @timed(DB_QUERY_DURATION, query="link.get_link_file")
+    async def get_link_file(cls, db_session: sessionmaker, url: str):
+        """
+        Get file of the link by one joined query.
+        Returns row (type, telegram_file_id, path) or None
+        """
+        async with db_session() as db_session:
+            sql = select([File.type, File.telegram_file_id, File.path]) \
+                .join(Link, Link.file_id == File.id) \
+                .where(Link.url == link_key(url))
+            result = await db_session.execute(sql)
+            return result.first()
+
+    @classmethod
+    @timed(DB_QUERY_DURATION, query="link.add_link")
     async def add_link(cls, db_session: sessionmaker, link: 'Link') -> 'Link':
+        """Insert link, or point the existing one to the new file of its media"""
         async with db_session() as db_session:
-            sql = insert(Link).values(
-                url=await clean_url(link.url),
+            sql = pg_insert(Link).values(
+                url=link_key(link.url),
                 social_media=link.social_media,
                 file_id=link.file_id,
                 user_id=link.user_id
+            )
+            sql = sql.on_conflict_do_update(
+                index_elements=[Link.url],
+                set_=dict(file_id=sql.excluded.file_id)
             ).returning('*')
             result = await db_session.execute(sql)
             await db_session.commit()
             return result.scalar()
 
     @classmethod
-    async def get_all_links(cls, db_session: sessionmaker) -> list:
-        async with db_session() as db_session:
-            sql = select([Link])
-            result = await db_session.execute(sql)
-            return await result.fetchall()
+    def iter_links(cls, db_session: sessionmaker, batch_size: int = 1000):
+        return iter_keyset(db_session, Link, batch_size)
 
     @classmethod
-    async def count_links(cls, db_session: sessionmaker) -> int:
+    @timed(DB_QUERY_DURATION, query="link.count_links")
+    async def count_links(cls, db_session: sessionmaker, estimate: bool = False) -> int:
+        if estimate:
+            return await estimate_count(db_session, Link.__tablename__)
         async with db_session() as db_session:
-            sql = select([Link]).count()
+            sql = select([func.count()]).select_from(Link)
             result = await db_session.execute(sql)
-            return await result.fetchone()[0]
+            return result.scalar()
 
+    @timed(DB_QUERY_DURATION, query="link.update_link")
     async def update_link(self, db_session: sessionmaker, link: 'Link') -> 'Link':
         async with db_session() as db_session:
             sql = update(Link).where(Link.url == self.url).values(
-                url=await clean_url(link.url),
+                url=link_key(link.url),
                 social_media=link.social_media,
                 file_id=link.file_id,
                 user_id=link.user_id
@@ -70,18 +94,21 @@ class Link(Base):
             await db_session.commit()
             return result.scalar()
 
+    @timed(DB_QUERY_DURATION, query="link.delete_link")
     async def delete_link(self, db_session: sessionmaker) -> None:
         async with db_session() as db_session:
-            sql = delete(Link).where(await clean_url(Link.url) == self.url)
+            sql = delete(Link).where(Link.url == self.url)
             await db_session.execute(sql)
             await db_session.commit()
 
+    @timed(DB_QUERY_DURATION, query="link.get_user")
     async def get_user(self, db_session: sessionmaker) -> User:
         async with db_session() as db_session:
             sql = select([User]).where(User.id == self.user_id)
             result = await db_session.execute(sql)
             return result.scalar()
 
+    @timed(DB_QUERY_DURATION, query="link.get_file")
     async def get_file(self, db_session: sessionmaker) -> File:
         async with db_session() as db_session:
             sql = select([File]).where(File.id == self.file_id)
@@ -1,9 +1,11 @@
-from sqlalchemy import (Column, String, BigInteger, DateTime,
-                        insert, update, func, select)
+from sqlalchemy import (Column, String, BigInteger, Boolean, DateTime,
+                        insert, update, func, select, false)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql.sqltypes import BigInteger
 
-from tgbot.services.db_base import Base
+from tgbot.services.db_base import Base, iter_keyset, estimate_count
+from tgbot.services.metrics import DB_QUERY_DURATION, timed
 
 
 class User(Base):
@@ -15,6 +17,9 @@ class User(Base):
     username = Column(String(length=200))
     lang_code = Column(String(length=10), default='ru')
     created_at = Column(DateTime, default=func.now())
+    # User blocked the bot or deleted the account, skipped by broadcasts
+    is_blocked = Column(Boolean, default=False, server_default=false(),
+                        nullable=False)
 
     def __init__(self, telegram_id: int, firstname: str, lastname: str,
                  username: str, lang_code: str = "ru"):
@@ -25,6 +30,7 @@ class User(Base):
         self.lang_code = lang_code
 
     @classmethod
+    @timed(DB_QUERY_DURATION, query="user.get_user")
     async def get_user(cls, db_session: sessionmaker, telegram_id: int) -> 'User':
         async with db_session() as db_session:
             sql = select([User]).where(User.telegram_id == telegram_id)
@@ -32,6 +38,7 @@ class User(Base):
             return result.scalar()
 
     @classmethod
+    @timed(DB_QUERY_DURATION, query="user.add_user")
     async def add_user(cls, db_session: sessionmaker, user: 'User') -> 'User':
         async with db_session() as db_session:
             sql = insert(User).values(
@@ -45,6 +52,33 @@ class User(Base):
             await db_session.commit()
             return result.scalar()
 
+    @classmethod
+    @timed(DB_QUERY_DURATION, query="user.upsert_user")
+    async def upsert_user(cls, db_session: sessionmaker, user: 'User'):
+        """Insert user or update its profile fields, returns the stored row"""
+        async with db_session() as db_session:
+            sql = pg_insert(User).values(
+                telegram_id=user.telegram_id,
+                firstname=user.firstname,
+                lastname=user.lastname,
+                username=user.username,
+                lang_code=user.lang_code
+            )
+            sql = sql.on_conflict_do_update(
+                index_elements=[User.telegram_id],
+                set_=dict(
+                    firstname=sql.excluded.firstname,
+                    lastname=sql.excluded.lastname,
+                    username=sql.excluded.username,
+                    # User writes to the bot again, so it is unblocked
+                    is_blocked=False
+                )
+            ).returning(*User.__table__.columns)
+            result = await db_session.execute(sql)
+            await db_session.commit()
+            return result.first()
+
+    @timed(DB_QUERY_DURATION, query="user.update_user")
     async def update_user(self, db_session: sessionmaker, user: 'User') -> 'User':
         async with db_session() as db_session:
             sql = update(User).where(User.telegram_id == self.telegram_id).values(
@@ -58,18 +92,31 @@ class User(Base):
             return result.scalar()
 
     @classmethod
-    async def get_all_users(cls, db_session: sessionmaker) -> list:
+    def iter_users(cls, db_session: sessionmaker, batch_size: int = 1000,
+                   after_id: int = 0, active_only: bool = False):
+        criteria = [User.is_blocked == false()] if active_only else []
+        return iter_keyset(db_session, User, batch_size, after_id, *criteria)
+
+    @classmethod
+    @timed(DB_QUERY_DURATION, query="user.set_blocked")
+    async def set_blocked(cls, db_session: sessionmaker, telegram_ids: list,
+                          blocked: bool = True) -> None:
         async with db_session() as db_session:
-            sql = select([User])
-            result = await db_session.execute(sql)
-            return result.fetchall()
+            sql = update(User).where(User.telegram_id.in_(telegram_ids)).values(
+                is_blocked=blocked
+            )
+            await db_session.execute(sql)
+            await db_session.commit()
 
     @classmethod
-    async def count_users(cls, db_session: sessionmaker) -> int:
+    @timed(DB_QUERY_DURATION, query="user.count_users")
+    async def count_users(cls, db_session: sessionmaker, estimate: bool = False) -> int:
+        if estimate:
+            return await estimate_count(db_session, User.__tablename__)
         async with db_session() as db_session:
             sql = select([func.count(User.id)]).select_from(User)
             result = await db_session.execute(sql)
-            return result.scalar()[0]
+            return result.scalar()
 
     def __repr__(self):
         return f'User (id: {self.telegram_id}, firstname: {self.firstname}, ' \
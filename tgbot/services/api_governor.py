@@ -0,0 +1,278 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+from contextvars import ContextVar
+from enum import IntEnum
+
+from aiogram import Bot
+from aiogram.bot import api
+from aiogram.utils.exceptions import RetryAfter
+from aioredis import Redis
+from aioredis.exceptions import RedisError
+from cachetools import TTLCache
+from loguru import logger
+
+from tgbot.services.rate_limiter import TOKEN_BUCKET_SCRIPT
+
+
+class Priority(IntEnum):
+    """Requests with lower value are sent first when the bot is throttled"""
+    MEDIA = 0  # deliveries of downloaded files
+    DEFAULT = 1  # replies
+    STATUS = 2  # progress edits and chat actions, may be coalesced
+    BULK = 3  # broadcasts
+
+
+MEDIA_METHODS = {
+    api.Methods.SEND_PHOTO, api.Methods.SEND_VIDEO, api.Methods.SEND_AUDIO,
+    api.Methods.SEND_DOCUMENT, api.Methods.SEND_ANIMATION,
+    api.Methods.SEND_VOICE, api.Methods.SEND_MEDIA_GROUP,
+    api.Methods.COPY_MESSAGE, api.Methods.FORWARD_MESSAGE,
+}
+STATUS_METHODS = {
+    api.Methods.EDIT_MESSAGE_TEXT, api.Methods.EDIT_MESSAGE_CAPTION,
+    api.Methods.EDIT_MESSAGE_REPLY_MARKUP, api.Methods.SEND_CHAT_ACTION,
+}
+
+# Priority of requests of the current task, overrides the method priority
+current_priority: ContextVar = ContextVar("api_priority", default=None)
+
+
+class PendingEdit:
+    """editMessageText waiting for its turn, newer edits replace its text"""
+    __slots__ = ("data", "future", "started")
+
+    def __init__(self, data: dict, future: asyncio.Future):
+        self.data = data
+        self.future = future
+        self.started = False
+
+
+class ApiGovernor:
+    """
+    Schedules outgoing Bot API requests which send or edit messages.
+
+    Every chat gets one message per chat_interval seconds after a burst of
+    chat_burst messages (one per group_interval seconds for groups and
+    channels), and the whole bot sends global_rate messages per second.
+    When requests wait for the global limit, they are sent in priority
+    order, so files are delivered before status messages. Pending edits of
+    the same message are coalesced into the last one, and RetryAfter
+    pauses the chat and the whole bot, then retries the request. Status
+    edits and broadcasts are not retried, their callers decide what to do.
+
+    With Redis the global rate is shared by all processes of the bot
+    (webhook and download workers), otherwise it is enforced per process.
+    """
+
+    def __init__(self, global_rate: float = 30, chat_interval: float = 1,
+                 group_interval: float = 3, chat_burst: int = 3,
+                 max_retries: int = 3, redis: Redis = None,
+                 prefix: str = "media_saving_bot"):
+        self.global_rate = global_rate
+        self.global_interval = 1 / global_rate
+        self.chat_interval = chat_interval
+        self.chat_burst = chat_burst
+        self.group_interval = group_interval
+        self.max_retries = max_retries
+        self._global_next = 0.0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._dispatcher = None
+        # Chat id -> time when the chat can receive the next message
+        self._chat_next = TTLCache(maxsize=100000, ttl=max(60, group_interval))
+        self._edits = {}
+        self.sent = {p.name.lower(): 0 for p in Priority}
+        self.coalesced = 0
+        self.retried = 0
+        self.flood_waits = 0
+        # Bucket of one token refilled at the global rate, shared through Redis
+        self._shared_script = redis.register_script(TOKEN_BUCKET_SCRIPT) if redis else None
+        self._shared_key = f"{prefix}:api_global"
+
+    @staticmethod
+    def priority(method: str) -> Priority:
+        priority = current_priority.get()
+        if priority is not None:
+            return priority
+        if method in MEDIA_METHODS:
+            return Priority.MEDIA
+        if method in STATUS_METHODS:
+            return Priority.STATUS
+        return Priority.DEFAULT
+
+    @staticmethod
+    def is_governed(method: str, data: dict) -> bool:
+        """Only requests posting to the chat count towards the limits"""
+        if not data or 'chat_id' not in data:
+            return False
+        return method.startswith("send") or method.startswith("editMessage") \
+            or method in MEDIA_METHODS
+
+    async def call(self, request, method: str, data: dict = None):
+        """Run request() when the limits allow it"""
+        if not self.is_governed(method, data):
+            return await request()
+        if method == api.Methods.EDIT_MESSAGE_TEXT:
+            return await self._edit(request, data)
+        return await self._send(request, data['chat_id'], self.priority(method))
+
+    def stats(self) -> dict:
+        return {
+            "sent": dict(self.sent),
+            "coalesced": self.coalesced,
+            "retried": self.retried,
+            "flood_waits": self.flood_waits,
+            "waiting": len(self._waiters),
+            "backend": "redis" if self._shared_script else "memory",
+        }
+
+    async def _edit(self, request, data: dict):
+        key = (data['chat_id'], data.get('message_id'))
+        pending = self._edits.get(key)
+        if pending and not pending.started:
+            # Request of the pending edit will send the newest text
+            pending.data.clear()
+            pending.data.update(data)
+            self.coalesced += 1
+            return await asyncio.shield(pending.future)
+
+        loop = asyncio.get_event_loop()
+        pending = PendingEdit(data, loop.create_future())
+        self._edits[key] = pending
+
+        def on_start():
+            pending.started = True
+            if self._edits.get(key) is pending:
+                del self._edits[key]
+
+        try:
+            result = await self._send(request, data['chat_id'],
+                                      self.priority(api.Methods.EDIT_MESSAGE_TEXT),
+                                      on_start)
+        except Exception as e:
+            on_start()
+            pending.future.set_exception(e)
+            pending.future.exception()  # followers may not exist
+            raise
+        except BaseException:
+            on_start()
+            pending.future.cancel()
+            raise
+        pending.future.set_result(result)
+        return result
+
+    async def _send(self, request, chat_id, priority: Priority, on_start=None):
+        retries = 0
+        while True:
+            await self._acquire_chat(chat_id)
+            await self._acquire_global(priority)
+            if on_start:
+                on_start()
+            try:
+                result = await request()
+            except RetryAfter as e:
+                self._pause_chat(chat_id, e.timeout)
+                self._pause_global(e.timeout)
+                # Status messages are outdated after the pause, broadcasts
+                # slow down on their own
+                if priority in (Priority.STATUS, Priority.BULK) \
+                        or retries >= self.max_retries:
+                    raise
+                retries += 1
+                self.retried += 1
+                continue
+            self.sent[priority.name.lower()] += 1
+            return result
+
+    async def _acquire_chat(self, chat_id):
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        interval = self._chat_interval(chat_id)
+        burst = self.chat_burst if interval == self.chat_interval else 1
+        # Idle private chat may receive a short burst of messages at once
+        next_free = max(self._chat_next.get(chat_id, 0.0),
+                        now - (burst - 1) * interval)
+        self._chat_next[chat_id] = next_free + interval
+        if next_free > now:
+            await asyncio.sleep(next_free - now)
+
+    async def _acquire_global(self, priority: Priority):
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        if not self._waiters and now >= self._global_next and not self._shared_script:
+            self._global_next = now + self.global_interval
+            return
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        """Wake up waiters one by one in priority order at the global rate"""
+        loop = asyncio.get_event_loop()
+        try:
+            while self._waiters:
+                now = loop.time()
+                if now < self._global_next:
+                    await asyncio.sleep(self._global_next - now)
+                    continue
+                await self._acquire_shared()
+                if not self._waiters:  # all callers were cancelled
+                    break
+                _, _, future = heapq.heappop(self._waiters)
+                if future.done():  # caller was cancelled
+                    continue
+                self._global_next = now + self.global_interval
+                future.set_result(None)
+        finally:
+            self._dispatcher = None
+
+    async def _acquire_shared(self):
+        """Wait for a token of the global bucket shared by all processes"""
+        while self._shared_script:
+            try:
+                denied, wait = await self._shared_script(
+                    keys=[self._shared_key],
+                    args=[time.time(), 1, 1, self.global_rate])
+            except RedisError as e:
+                logger.warning(f"Bot API governor falls back to the process rate: {e}")
+                return
+            if not int(denied):
+                return
+            await asyncio.sleep(float(wait))
+
+    def _pause_global(self, seconds: int):
+        """Flood control means the bot is over the limit, not only this chat"""
+        loop = asyncio.get_event_loop()
+        self._global_next = max(self._global_next, loop.time() + seconds)
+        self.flood_waits += 1
+
+    def _pause_chat(self, chat_id, seconds: int):
+        loop = asyncio.get_event_loop()
+        self._chat_next[chat_id] = max(self._chat_next.get(chat_id, 0.0),
+                                       loop.time() + seconds)
+        logger.warning(f"Flood control in chat {chat_id}, paused for {seconds} sec.")
+
+    def _chat_interval(self, chat_id) -> float:
+        # Groups and channels have negative ids or @username
+        if isinstance(chat_id, str) and not chat_id.lstrip("-").isdigit():
+            return self.group_interval
+        return self.group_interval if int(chat_id) < 0 else self.chat_interval
+
+
+class GovernedBot(Bot):
+    """Bot whose requests go through bot['api_governor'] when it is set"""
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        governor: ApiGovernor = self.get('api_governor')
+        if governor is None:
+            return await super().request(method, data, files, **kwargs)
+
+        async def send():
+            return await Bot.request(self, method, data, files, **kwargs)
+
+        return await governor.call(send, method, data)
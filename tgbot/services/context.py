@@ -0,0 +1,121 @@
+import os
+
+from aiogram import Bot
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
+
+from tgbot.api.extractor import CODES, Extractors
+from tgbot.api.youtube import setup_extractor, shutdown_extractor
+from tgbot.config import Config
+from tgbot.misc.singleflight import SingleFlight
+from tgbot.models.file import File
+from tgbot.services.api_governor import ApiGovernor, GovernedBot
+from tgbot.services.database import MEDIA_LOCK, ProcessLock, create_db_session
+from tgbot.services.http import create_http_session
+from tgbot.services.job_queue import RedisJobQueue
+from tgbot.services.link_cache import LinkCache
+from tgbot.services.media_cache import MediaCache
+from tgbot.services.negative_cache import NegativeCache
+from tgbot.services.rate_limiter import RateLimiter, Bucket
+from tgbot.services.redis_client import create_redis
+from tgbot.services.scheduler import JobScheduler
+from tgbot.services.user_cache import UserCache
+
+
+def create_bot(config: Config) -> Bot:
+    server = TELEGRAM_PRODUCTION
+    if config.tg_bot.bot_api_server:
+        server = TelegramAPIServer.from_base(
+            base=config.tg_bot.bot_api_server,
+        )
+    return GovernedBot(token=config.tg_bot.token, parse_mode="HTML", server=server)
+
+
+async def setup_context(bot: Bot, config: Config):
+    """Create services shared by handlers and store them in bot context"""
+    bot['config'] = config
+    # Sender captions need bot username, it never changes while running
+    bot['me'] = await bot.get_me()
+    bot['db'] = await create_db_session(config)
+    bot['http'] = create_http_session(config)
+    bot['redis'] = create_redis(config)
+    # Several processes serve the same bot
+    shared = config.distributed.enabled or \
+        (config.webhook.enabled and config.webhook.workers > 1)
+    bot['api_governor'] = None
+    if config.api_governor.enabled:
+        bot['api_governor'] = ApiGovernor(
+            global_rate=config.api_governor.global_rate,
+            chat_interval=config.api_governor.chat_interval,
+            group_interval=config.api_governor.group_interval,
+            chat_burst=config.api_governor.chat_burst,
+            max_retries=config.api_governor.max_retries,
+            redis=bot['redis'] if shared else None,
+            prefix=f"{config.tg_bot.redis_prefix}_rate")
+    bot['singleflight'] = SingleFlight()
+    bot['broadcasts'] = set()
+    bot['rate_limiter'] = None
+    if config.rate_limit.enabled:
+        limits = config.rate_limit
+        bot['rate_limiter'] = RateLimiter(
+            user=Bucket(limits.user_capacity, limits.user_rate),
+            chat=Bucket(limits.chat_capacity, limits.chat_rate),
+            global_=Bucket(limits.global_capacity, limits.global_rate),
+            redis=bot['redis'],
+            prefix=f"{config.tg_bot.redis_prefix}_rate")
+    bot['user_cache'] = UserCache(maxsize=config.cache.user_cache_size,
+                                  ttl=config.cache.user_cache_ttl)
+    bot['link_cache'] = LinkCache(redis=bot['redis'],
+                                  maxsize=config.cache.link_cache_size,
+                                  local_ttl=config.cache.link_cache_ttl,
+                                  redis_ttl=config.cache.link_redis_ttl,
+                                  prefix=f"{config.tg_bot.redis_prefix}_cache")
+    await bot['link_cache'].start()
+    bot['negative_cache'] = NegativeCache(
+        redis=bot['redis'],
+        ttls={CODES.NOT_FOUND.value: config.cache.not_found_ttl},
+        default_ttl=config.cache.error_ttl,
+        maxsize=config.cache.negative_cache_size,
+        prefix=f"{config.tg_bot.redis_prefix}_cache")
+    bot['scheduler'] = JobScheduler(io_workers=config.scheduler.io_workers,
+                                    cpu_workers=config.scheduler.cpu_workers,
+                                    max_queue=config.scheduler.max_queue)
+    await bot['scheduler'].start()
+    bot['job_queue'] = None
+    if config.distributed.enabled:
+        if not bot['redis']:
+            raise ValueError("Distributed mode requires use_redis")
+        bot['job_queue'] = RedisJobQueue(
+            bot['redis'], f"{config.tg_bot.redis_prefix}_jobs",
+            visibility_timeout=config.distributed.visibility_timeout,
+            max_attempts=config.distributed.max_attempts,
+            retry_delay=config.distributed.retry_delay)
+    bot['media_cache'] = MediaCache(
+        os.path.join(os.getcwd(), "media"),
+        max_bytes=config.media.max_size_mb * 1024 * 1024,
+        hit_weight=config.media.hit_weight,
+        min_age=config.media.min_age,
+        # They share media/ too, one of them keeps it under the budget
+        lock=ProcessLock(bot['db'], MEDIA_LOCK) if shared else None,
+        rescan_interval=config.media.rescan_interval)
+    await bot['media_cache'].load(
+        file.path async for file in File.iter_files(bot['db']))
+    await bot['media_cache'].start()
+    setup_extractor(workers=config.youtube.extract_workers,
+                    use_processes=config.youtube.extract_in_process,
+                    cache_ttl=config.youtube.metadata_cache_ttl,
+                    cache_mb=config.youtube.metadata_cache_mb,
+                    ytdlp_path=config.youtube.ytdlp_path)
+    bot['extractors'] = Extractors(bot)
+
+
+async def close_context(bot: Bot):
+    if bot.get('metrics'):
+        await bot['metrics'].cleanup()
+    await bot['scheduler'].stop()
+    await bot['link_cache'].stop()
+    await bot['media_cache'].stop()
+    if bot['redis']:
+        await bot['redis'].close()
+    await bot['http'].close()
+    shutdown_extractor()
+    await bot.session.close()
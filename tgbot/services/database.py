@@ -1,17 +1,37 @@
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 
 from tgbot.config import Config
 from tgbot.services.db_base import Base
+from tgbot.services.migrations import run_migrations
+
+
+# pg_advisory_lock key taken while the schema is created and migrated
+SCHEMA_LOCK = 4_101_996_312
+# pg_try_advisory_lock key of the process evicting the shared media/
+MEDIA_LOCK = 4_101_996_313
 
 
 async def create_db_session(config: Config):
     engine = create_async_engine(
-        f"postgresql+asyncpg://{config.db.user}:{config.db.password}@{config.db.host}:{config.db.port}/{config.db.database}",
+        f"postgresql+asyncpg://{config.db.user}:{config.db.password}@{config.db.host}:{config.db.port}/{config.db.database}"
+        # asyncpg keeps prepared statements of every connection in this cache
+        f"?prepared_statement_cache_size={config.db.statement_cache_size}",
+        pool_size=config.db.pool_size,
+        max_overflow=config.db.max_overflow,
         future=True
     )
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    # Webhook workers start at once, the lock lets one process change the
+    # schema while the others wait, then they find nothing left to do
+    async with engine.connect() as lock_conn:
+        await lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": SCHEMA_LOCK})
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            await run_migrations(engine)
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SCHEMA_LOCK})
 
     # expire_on_commit=False will prevent attributes from being expired
     # after commit.
@@ -19,3 +39,46 @@ async def create_db_session(config: Config):
         engine, expire_on_commit=False, class_=AsyncSession
     )
     return async_session
+
+
+class ProcessLock:
+    """
+    Advisory lock owned by one of the processes sharing the database.
+    The owner keeps it on its own connection until release() or exit
+    (the connection is closed then), acquire() does not wait, so other
+    processes retry later and take over
+    """
+
+    def __init__(self, db_session: sessionmaker, key: int):
+        self._engine = db_session.kw['bind']
+        self.key = key
+        self._conn = None
+
+    @property
+    def held(self) -> bool:
+        return self._conn is not None
+
+    async def acquire(self) -> bool:
+        if self._conn is not None:
+            return True
+        conn = await self._engine.connect()
+        try:
+            result = await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key})
+            locked = result.scalar()
+        except Exception:
+            await conn.close()
+            raise
+        if not locked:
+            await conn.close()
+            return False
+        self._conn = conn
+        return True
+
+    async def release(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        try:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.key})
+        finally:
+            await conn.close()
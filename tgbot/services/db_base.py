@@ -1,3 +1,32 @@
-from sqlalchemy.orm import declarative_base
+from sqlalchemy import select, text
+from sqlalchemy.orm import declarative_base, sessionmaker
 
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+
+async def iter_keyset(db_session: sessionmaker, model, batch_size: int = 1000,
+                      after_id: int = 0, *criteria):
+    """
+    Iterate over all rows of the model (matching criteria) ordered by
+    primary key. Rows are fetched by batches with keyset pagination
+    (WHERE id > last id), every batch in its own short session
+    """
+    while True:
+        async with db_session() as session:
+            sql = select(model).where(model.id > after_id, *criteria) \
+                .order_by(model.id).limit(batch_size)
+            result = await session.execute(sql)
+            rows = result.scalars().all()
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        after_id = rows[-1].id
+
+
+async def estimate_count(db_session: sessionmaker, table_name: str) -> int:
+    """Estimated number of rows from planner statistics, without table scan"""
+    async with db_session() as session:
+        sql = text("SELECT reltuples::bigint FROM pg_class WHERE relname = :name")
+        result = await session.execute(sql, {"name": table_name})
+        return max(result.scalar() or 0, 0)
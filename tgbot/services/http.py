@@ -0,0 +1,23 @@
+import aiohttp
+
+from tgbot.config import Config
+
+
+def create_http_session(config: Config) -> aiohttp.ClientSession:
+    """
+    Create application-scoped HTTP client for all upstream traffic.
+    Must be called inside of running event loop and closed on shutdown
+    """
+    connector = aiohttp.TCPConnector(
+        limit=config.http.limit,
+        limit_per_host=config.http.limit_per_host,
+        ttl_dns_cache=config.http.dns_cache_ttl,
+        keepalive_timeout=config.http.keepalive_timeout,
+        enable_cleanup_closed=True,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=config.http.total_timeout or None,
+        connect=config.http.connect_timeout,
+        sock_read=config.http.read_timeout,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
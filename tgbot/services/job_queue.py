@@ -0,0 +1,136 @@
+import json
+import time
+import uuid
+import asyncio
+
+from aioredis import Redis
+from loguru import logger
+
+
+# Move the oldest pending job to processing with visibility deadline
+RESERVE_SCRIPT = """
+local id = redis.call('RPOP', KEYS[1])
+if not id then
+    return nil
+end
+redis.call('ZADD', KEYS[2], ARGV[1], id)
+redis.call('HINCRBY', KEYS[4], id, 1)
+return {id, redis.call('HGET', KEYS[3], id), redis.call('HGET', KEYS[4], id)}
+"""
+
+# Return expired jobs to pending, or to dead list after max attempts
+REQUEUE_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, id in ipairs(ids) do
+    redis.call('ZREM', KEYS[2], id)
+    local attempts = tonumber(redis.call('HGET', KEYS[4], id) or '0')
+    if attempts >= tonumber(ARGV[2]) then
+        redis.call('LPUSH', KEYS[5], id)
+    else
+        redis.call('LPUSH', KEYS[1], id)
+    end
+end
+return #ids
+"""
+
+
+class QueuedJob:
+    """Job reserved by the worker, must be acked or nacked"""
+    __slots__ = ("id", "payload", "attempts")
+
+    def __init__(self, id: str, payload: dict, attempts: int):
+        self.id = id
+        self.payload = payload
+        self.attempts = attempts
+
+    def __repr__(self):
+        return f"<QueuedJob(id={self.id}, type={self.payload.get('type')}, " \
+            f"attempts={self.attempts})>"
+
+
+class RedisJobQueue:
+    """
+    Reliable job queue in Redis with at-least-once delivery.
+
+    Reserved job stays in processing set until its visibility deadline.
+    If the worker does not ack the job before it (crashed or hung), the
+    job is returned to pending and retried, up to max_attempts times,
+    then it is moved to the dead list
+    """
+
+    def __init__(self, redis: Redis, name: str, visibility_timeout: int = 600,
+                 max_attempts: int = 3, retry_delay: int = 10):
+        self.redis = redis
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._keys = [f"{name}:pending", f"{name}:processing",
+                      f"{name}:payloads", f"{name}:attempts", f"{name}:dead"]
+        self._reserve = redis.register_script(RESERVE_SCRIPT)
+        self._requeue = redis.register_script(REQUEUE_SCRIPT)
+
+    async def enqueue(self, payload: dict) -> str:
+        job_id = uuid.uuid4().hex
+        pending, _, payloads, _, _ = self._keys
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(payloads, job_id, json.dumps(payload))
+            pipe.lpush(pending, job_id)
+            await pipe.execute()
+        return job_id
+
+    async def reserve(self, timeout: float = 5.0,
+                      poll_interval: float = 0.2) -> QueuedJob or None:
+        """Wait up to timeout seconds for the next job"""
+        deadline = time.time() + timeout
+        while True:
+            result = await self._reserve(
+                keys=self._keys,
+                args=[time.time() + self.visibility_timeout])
+            if result:
+                job_id, payload, attempts = [
+                    v.decode() if isinstance(v, bytes) else v for v in result]
+                if payload is None:  # acked by the previous owner
+                    await self._delete(job_id)
+                    continue
+                return QueuedJob(job_id, json.loads(payload), int(attempts))
+            if time.time() >= deadline:
+                return None
+            await asyncio.sleep(poll_interval)
+
+    async def extend(self, job: QueuedJob) -> None:
+        """Move visibility deadline of the running job"""
+        await self.redis.zadd(
+            self._keys[1], {job.id: time.time() + self.visibility_timeout}, xx=True)
+
+    async def ack(self, job: QueuedJob) -> None:
+        await self._delete(job.id)
+
+    async def nack(self, job: QueuedJob) -> None:
+        """Retry job after retry_delay, requeue() decides if it is dead"""
+        await self.redis.zadd(
+            self._keys[1], {job.id: time.time() + self.retry_delay * job.attempts})
+
+    async def requeue(self) -> int:
+        """Return jobs with expired deadline to pending"""
+        count = await self._requeue(
+            keys=self._keys, args=[time.time(), self.max_attempts])
+        if count:
+            logger.warning(f"Requeued {count} expired jobs")
+        return count
+
+    async def stats(self) -> dict:
+        pending, processing, _, _, dead = self._keys
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.llen(pending)
+            pipe.zcard(processing)
+            pipe.llen(dead)
+            pending, processing, dead = await pipe.execute()
+        return {"pending": pending, "processing": processing, "dead": dead}
+
+    async def _delete(self, job_id: str):
+        _, processing, payloads, attempts, _ = self._keys
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(processing, job_id)
+            pipe.hdel(payloads, job_id)
+            pipe.hdel(attempts, job_id)
+            await pipe.execute()
@@ -0,0 +1,206 @@
+import json
+import asyncio
+
+from aioredis import Redis
+from aioredis.exceptions import RedisError
+from cachetools import TTLCache
+from loguru import logger
+from sqlalchemy.orm import sessionmaker
+
+from tgbot.models.file import File
+from tgbot.models.link import Link
+
+
+class CachedFile:
+    """Compact copy of the file row which is enough to resend it"""
+    __slots__ = ("type", "telegram_file_id", "path")
+
+    def __init__(self, type: str, telegram_file_id: str, path: str):
+        self.type = type
+        self.telegram_file_id = telegram_file_id
+        self.path = path
+
+    def dumps(self) -> str:
+        return json.dumps([self.type, self.telegram_file_id, self.path])
+
+    @classmethod
+    def loads(cls, value: str or bytes) -> 'CachedFile':
+        return cls(*json.loads(value))
+
+    def __repr__(self):
+        return f"<CachedFile(type={self.type}, telegram_file_id={self.telegram_file_id})>"
+
+
+class LinkCache:
+    """
+    Link url -> file lookup with two cache tiers:
+    in-process LRU/TTL cache and Redis shared by all bot instances.
+    Entries are invalidated when the file is updated or deleted (File.change_hooks),
+    other instances drop their local entries through Redis pub/sub.
+    When Redis fails, lookups go on with the local cache and the database
+    """
+
+    # Seconds between reconnects of the invalidation listener
+    min_reconnect_delay = 1
+    max_reconnect_delay = 60
+
+    def __init__(self, redis: Redis = None, maxsize: int = 50000,
+                 local_ttl: int = 600, redis_ttl: int = 86400,
+                 prefix: str = "media_saving_bot"):
+        self._local = TTLCache(maxsize=maxsize, ttl=local_ttl)
+        # telegram_file_id -> urls which were cached locally with it. Urls
+        # expired from _local are left here until the index is rebuilt
+        self._local_urls = {}
+        self._redis = redis
+        self._redis_ttl = redis_ttl
+        self._prefix = prefix
+        self._channel = f"{prefix}:link_invalidate"
+        self._listener = None
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.redis_errors = 0
+        File.change_hooks.append(self.invalidate_file)
+
+    async def start(self):
+        if self._redis:
+            self._listener = asyncio.ensure_future(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+        if self.invalidate_file in File.change_hooks:
+            File.change_hooks.remove(self.invalidate_file)
+
+    async def get(self, db_session: sessionmaker, url: str) -> CachedFile or None:
+        file = self._local.get(url)
+        if file is not None:
+            self.local_hits += 1
+            return file
+
+        if self._redis:
+            try:
+                value = await self._redis.get(self._link_key(url))
+            except RedisError as e:
+                self._redis_failed("get", e)
+                value = None
+            if value is not None:
+                self.redis_hits += 1
+                file = CachedFile.loads(value)
+                self._put_local(url, file)
+                return file
+
+        self.misses += 1
+        row = await Link.get_link_file(db_session, url)
+        if not row:
+            return None
+        file = CachedFile(row.type, row.telegram_file_id, row.path)
+        await self.put(url, file)
+        return file
+
+    async def put(self, url: str, file: CachedFile) -> None:
+        self._put_local(url, file)
+        if self._redis:
+            try:
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    pipe.set(self._link_key(url), file.dumps(), ex=self._redis_ttl)
+                    file_key = self._file_key(file.telegram_file_id)
+                    pipe.sadd(file_key, url)
+                    pipe.expire(file_key, self._redis_ttl)
+                    await pipe.execute()
+            except RedisError as e:
+                self._redis_failed("put", e)
+
+    async def invalidate_file(self, telegram_file_id: str) -> None:
+        """Drop all links to the file from both tiers"""
+        self._drop_local(telegram_file_id)
+        if self._redis:
+            file_key = self._file_key(telegram_file_id)
+            try:
+                urls = await self._redis.smembers(file_key)
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    for url in urls:
+                        if isinstance(url, bytes):
+                            url = url.decode()
+                        pipe.delete(self._link_key(url))
+                    pipe.delete(file_key)
+                    pipe.publish(self._channel, telegram_file_id)
+                    await pipe.execute()
+            except RedisError as e:
+                # Redis entries expire after redis_ttl at the latest
+                self._redis_failed("invalidate", e)
+
+    def stats(self) -> dict:
+        total = self.local_hits + self.redis_hits + self.misses
+        return {
+            "size": len(self._local),
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "redis_errors": self.redis_errors,
+            "hit_ratio": (self.local_hits + self.redis_hits) / total if total else 0.0,
+        }
+
+    def _redis_failed(self, operation: str, error: RedisError):
+        self.redis_errors += 1
+        logger.warning(f"Link cache {operation} falls back to memory: {error}")
+
+    def _put_local(self, url: str, file: CachedFile):
+        self._local[url] = file
+        self._local_urls.setdefault(file.telegram_file_id, set()).add(url)
+        # Rebuilt from live entries when expired ones may outnumber them
+        if len(self._local_urls) > 2 * self._local.maxsize:
+            self._local_urls = {}
+            for url, file in self._local.items():
+                self._local_urls.setdefault(file.telegram_file_id, set()).add(url)
+
+    def _drop_local(self, telegram_file_id: str):
+        for url in self._local_urls.pop(telegram_file_id, ()):
+            file = self._local.get(url)
+            if file is not None and file.telegram_file_id == telegram_file_id:
+                self._local.pop(url, None)
+
+    def _clear_local(self):
+        self._local.clear()
+        self._local_urls = {}
+
+    def _link_key(self, url: str) -> str:
+        return f"{self._prefix}:link:{url}"
+
+    def _file_key(self, telegram_file_id: str) -> str:
+        return f"{self._prefix}:file_links:{telegram_file_id}"
+
+    async def _listen(self):
+        """
+        Drop local entries invalidated by other instances. The listener
+        reconnects after Redis errors, local entries are cleared then,
+        because invalidations published meanwhile were missed
+        """
+        delay = self.min_reconnect_delay
+        reconnecting = False
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(self._channel)
+                if reconnecting:
+                    self._clear_local()
+                    logger.info("Link cache invalidation listener reconnected")
+                delay = self.min_reconnect_delay
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    data = message["data"]
+                    if isinstance(data, bytes):
+                        data = data.decode()
+                    self._drop_local(data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Link cache invalidation listener failed: {e}, "
+                             f"reconnecting in {delay} s")
+            finally:
+                await pubsub.reset()
+            reconnecting = True
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
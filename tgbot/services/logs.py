@@ -0,0 +1,58 @@
+import os
+import random
+import sys
+
+from loguru import logger
+
+from tgbot.config import Config
+
+
+LOG_FORMAT = "{time:YYYY-MM-DD HH:mm:ss} | {level} | {name}:{file}:{line} {message}"
+
+# Share of requests whose raw payloads (API responses) are logged
+_payload_sample_rate = 0.0
+
+
+def setup_logging(config: Config, name: str = "bot") -> None:
+    """
+    Replace default stderr sink with sinks configured in [logging].
+    Sink with empty level is disabled
+    """
+    global _payload_sample_rate
+    conf = config.logging
+    _payload_sample_rate = conf.payload_sample_rate
+    os.makedirs(os.path.join(os.getcwd(), "logs"), exist_ok=True)
+
+    logger.remove()
+    if conf.console_level:
+        logger.add(sys.stderr, level=conf.console_level,
+                   backtrace=conf.backtrace, diagnose=conf.diagnose)
+    sinks = [
+        (f"logs/{name}.log", conf.file_level, "10 days", "90 days"),
+        (f"logs/error.log", conf.error_level, "30 days", "366 days"),
+        (f"logs/debug.log", conf.debug_level, "30 days", "366 days"),
+    ]
+    for sink, level, rotation, retention in sinks:
+        if not level:
+            continue
+        logger.add(
+            sink=sink,
+            format=LOG_FORMAT,
+            rotation=rotation,
+            retention=retention,
+            compression="zip",
+            backtrace=conf.backtrace,
+            diagnose=conf.diagnose,
+            enqueue=conf.enqueue,
+            catch=True,
+            level=level,
+        )
+
+
+def sample_payload() -> bool:
+    """
+    Should this request log its payload. Use with lazy formatting,
+    so the dump is built only when DEBUG is enabled:
+    logger.opt(lazy=True).debug("Data: {}", lambda: json.dumps(data))
+    """
+    return _payload_sample_rate > 0 and random.random() < _payload_sample_rate
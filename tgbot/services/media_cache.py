@@ -0,0 +1,272 @@
+import os
+import time
+import heapq
+import shutil
+import asyncio
+
+from loguru import logger
+
+from tgbot.misc.utils import delete_file
+
+
+class MediaEntry:
+    """Tracked media file (or carousel directory)"""
+    __slots__ = ("path", "size", "last_access", "hits", "uploaded")
+
+    def __init__(self, path: str, size: int, last_access: float,
+                 hits: int = 0, uploaded: bool = False):
+        self.path = path
+        self.size = size
+        self.last_access = last_access
+        self.hits = hits
+        self.uploaded = uploaded
+
+    def __repr__(self):
+        return f"<MediaEntry(path={self.path}, size={self.size}, " \
+            f"hits={self.hits}, uploaded={self.uploaded})>"
+
+
+class MediaCache:
+    """
+    Keeps size of media/ directory under the disk budget.
+
+    Every saved file is registered in the in-memory index, so the directory
+    is scanned only once on startup. When the budget is exceeded entries
+    are evicted down to the low watermark: files already uploaded to
+    Telegram go first (they can be sent again by file_id), then the least
+    popular ones. Every hit extends the life of the entry by hit_weight
+    seconds. Entries are kept in a heap by score, so eviction pops the
+    first ones instead of sorting the whole index.
+
+    Processes sharing the directory (webhook and job workers) pass a lock
+    of the same key: only its owner evicts, and it rescans the directory
+    every rescan_interval seconds to count files saved by the others.
+    """
+
+    # Directories whose subdirectories are tracked as one entry
+    group_dirs = (os.path.join("instagram", "carousels"),)
+    skip_files = ("cookies.txt",)
+
+    def __init__(self, root: str, max_bytes: int, low_watermark: float = 0.9,
+                 hit_weight: int = 3600, min_age: int = 300,
+                 lock=None, rescan_interval: int = 600):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.low_watermark = low_watermark
+        self.hit_weight = hit_weight
+        self.min_age = min_age
+        # ProcessLock of the evicting process, None if the only one
+        self.lock = lock
+        self.rescan_interval = rescan_interval
+        self.total_bytes = 0
+        self.evicted = 0
+        self._entries = {}
+        # (score, path), items whose score changed since are skipped on pop
+        self._heap = []
+        self._evicting = False
+        self._rescanner = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def load(self, uploaded_paths=None):
+        """
+        Build the index by one scan of the root directory. uploaded_paths
+        is an async iterator of paths of files uploaded to Telegram
+        """
+        loop = asyncio.get_event_loop()
+        entries = await loop.run_in_executor(None, self._scan)
+        for entry in entries:
+            self._put(entry)
+        if uploaded_paths is not None:
+            async for path in uploaded_paths:
+                self.mark_uploaded(path)
+        logger.info(f"Media cache loaded: {len(self._entries)} entries, "
+                    f"{self.total_bytes} bytes")
+        if self.lock is not None and await self.lock.acquire():
+            logger.info("Media cache evicts the shared directory in this process")
+        self._maybe_evict()
+
+    async def start(self):
+        if self.lock is not None:
+            self._rescanner = asyncio.ensure_future(self._rescan())
+
+    async def stop(self):
+        if self._rescanner:
+            self._rescanner.cancel()
+            await asyncio.gather(self._rescanner, return_exceptions=True)
+        if self.lock is not None:
+            await self.lock.release()
+
+    async def refresh(self):
+        """Rescan the root directory for files saved or deleted by others"""
+        loop = asyncio.get_event_loop()
+        entries = await loop.run_in_executor(None, self._scan)
+        found = set()
+        for entry in entries:
+            found.add(entry.path)
+            old = self._entries.get(entry.path)
+            if old is None:
+                self._put(entry)
+            elif old.size != entry.size:
+                self.total_bytes += entry.size - old.size
+                old.size = entry.size
+        for path in set(self._entries) - found:
+            self._remove(path)
+
+    def add(self, path: str, uploaded: bool = False) -> MediaEntry:
+        """Register saved file or carousel directory"""
+        path = os.path.abspath(path)
+        entry = MediaEntry(path, self._size(path), time.time(),
+                           uploaded=uploaded)
+        old = self._entries.get(path)
+        if old:
+            entry.hits = old.hits
+            entry.uploaded = entry.uploaded or old.uploaded
+        self._put(entry)
+        self._maybe_evict()
+        return entry
+
+    def touch(self, path: str) -> None:
+        """Count the hit of the file"""
+        entry = self._entries.get(os.path.abspath(path))
+        if entry:
+            entry.hits += 1
+            entry.last_access = time.time()
+            self._push(entry)
+
+    def mark_uploaded(self, path: str) -> None:
+        """File was uploaded to Telegram and can be sent by file_id"""
+        entry = self._entries.get(os.path.abspath(path))
+        if entry and not entry.uploaded:
+            entry.uploaded = True
+            self._push(entry)
+
+    def score(self, entry: MediaEntry) -> tuple:
+        """Entries with the lowest score are evicted first"""
+        return (not entry.uploaded,
+                entry.last_access + entry.hits * self.hit_weight)
+
+    async def evict(self) -> int:
+        """Evict entries until size is under the low watermark"""
+        if self.total_bytes <= self.max_bytes:
+            return 0
+        if self.lock is not None and not self.lock.held:
+            # Another process owns the directory
+            return 0
+        target = self.max_bytes * self.low_watermark
+        deadline = time.time() - self.min_age
+        evicted = 0
+        # Too young or not deleted, pushed back when eviction is over
+        kept = []
+        while self._heap and self.total_bytes > target:
+            score, path = heapq.heappop(self._heap)
+            entry = self._entries.get(path)
+            if entry is None or self.score(entry) != score:
+                continue
+            if entry.last_access >= deadline or not await self._delete(path):
+                kept.append((score, path))
+                continue
+            self._remove(path)
+            evicted += 1
+        for item in kept:
+            heapq.heappush(self._heap, item)
+        self.evicted += evicted
+        logger.info(f"Media cache evicted {evicted} entries, "
+                    f"{self.total_bytes} bytes left")
+        return evicted
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "evicted": self.evicted,
+        }
+
+    def _put(self, entry: MediaEntry):
+        self._remove(entry.path)
+        self._entries[entry.path] = entry
+        self.total_bytes += entry.size
+        self._push(entry)
+
+    def _push(self, entry: MediaEntry):
+        heapq.heappush(self._heap, (self.score(entry), entry.path))
+        # Stale items of touched and removed entries are dropped at once
+        # when they outnumber the live ones
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [(self.score(e), e.path) for e in self._entries.values()]
+            heapq.heapify(self._heap)
+
+    def _remove(self, path: str):
+        entry = self._entries.pop(path, None)
+        if entry:
+            self.total_bytes -= entry.size
+
+    async def _rescan(self):
+        while True:
+            await asyncio.sleep(self.rescan_interval)
+            try:
+                if await self.lock.acquire():
+                    await self.refresh()
+                    self._maybe_evict()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Media cache rescan failed: {e}")
+
+    def _maybe_evict(self):
+        if self.total_bytes > self.max_bytes and not self._evicting:
+            self._evicting = True
+            future = asyncio.ensure_future(self.evict())
+            future.add_done_callback(self._evicted)
+
+    def _evicted(self, future: asyncio.Future):
+        self._evicting = False
+        if not future.cancelled() and future.exception():
+            logger.error(f"Media cache eviction failed: {future.exception()}")
+
+    async def _delete(self, path: str) -> bool:
+        if os.path.isdir(path):
+            loop = asyncio.get_event_loop()
+            try:
+                await loop.run_in_executor(None, shutil.rmtree, path)
+                return True
+            except OSError as e:
+                logger.error(e)
+                return False
+        if not os.path.exists(path):
+            return True
+        return await delete_file(path)
+
+    def _is_group(self, path: str) -> bool:
+        parent = os.path.relpath(os.path.dirname(path), self.root)
+        return parent in self.group_dirs
+
+    def _size(self, path: str) -> int:
+        try:
+            if os.path.isdir(path):
+                return sum(f.stat().st_size for f in os.scandir(path)
+                           if f.is_file())
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def _scan(self) -> list:
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if self._is_group(dirpath):
+                entries.append(MediaEntry(
+                    dirpath, self._size(dirpath), os.path.getmtime(dirpath)))
+                dirnames.clear()
+                continue
+            for filename in filenames:
+                if filename in self.skip_files:
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append(MediaEntry(path, stat.st_size, stat.st_mtime))
+        return entries
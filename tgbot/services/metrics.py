@@ -0,0 +1,288 @@
+import functools
+import time
+
+from typing import Callable
+
+from aiohttp import web
+from loguru import logger
+
+from tgbot.services.scheduler import JobKind
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        REGISTRY.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.type}"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value which is set directly or read from the function on every scrape"""
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 func: Callable[[], dict or float] = None):
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def render(self) -> list:
+        if self.func:
+            try:
+                value = self.func()
+            except Exception as e:
+                logger.debug(f"Could not collect {self.name}: {e}")
+                value = {}
+            # Function returns a value or {label values tuple: value}
+            self._values = value if isinstance(value, dict) else {(): value}
+        return super().render()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # per bucket counts, sum, count
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][i] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    def time(self, **labels) -> 'Timer':
+        return Timer(self, labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.type}"]
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Timer:
+    """Context manager observing duration of the block"""
+    __slots__ = ("histogram", "labels", "started_at")
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started_at, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def unregister(self, name: str) -> None:
+        self._metrics.pop(name, None)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def timed(histogram: Histogram, **labels):
+    """Decorator observing duration of the coroutine function"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+HANDLER_LATENCY = Histogram(
+    "bot_handler_seconds", "Handler processing time", ("handler",))
+DOWNLOADS = Counter(
+    "bot_downloads_total", "Downloads by platform and result", ("platform", "result"))
+DOWNLOAD_BYTES = Counter(
+    "bot_download_bytes_total", "Bytes downloaded from platforms", ("platform",))
+DOWNLOAD_DURATION = Histogram(
+    "bot_download_seconds", "Download time, yt-dlp run for YouTube", ("platform", "type"))
+UPLOAD_DURATION = Histogram(
+    "bot_upload_seconds", "Time of sending files to Telegram", ("type",))
+DB_QUERY_DURATION = Histogram(
+    "bot_db_query_seconds", "Database query time", ("query",),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+LINK_REUSE = Counter(
+    "bot_link_reuse_total", "Requests served by already uploaded file", ("platform",))
+NEGATIVE_CACHE_HITS = Counter(
+    "bot_negative_cache_hits_total",
+    "Upstream requests saved by remembered download errors", ("platform",))
+
+
+def _stats_gauge(name: str, documentation: str, service: str, path: tuple,
+                 bot) -> Gauge:
+    """Gauge reading a value from stats() of the service in bot context"""
+
+    def collect():
+        stats = bot[service].stats()
+        for key in path:
+            stats = stats[key]
+        return stats
+
+    REGISTRY.unregister(name)
+    return Gauge(name, documentation, func=collect)
+
+
+def register_bot_gauges(bot) -> None:
+    """Gauges of services in bot context, read on every scrape"""
+    gauges = [
+        ("bot_link_cache_hit_ratio", "Link cache hit ratio", "link_cache", ("hit_ratio",)),
+        ("bot_link_cache_size", "Link cache entries", "link_cache", ("size",)),
+        ("bot_user_cache_size", "User cache entries", "user_cache", ("size",)),
+        ("bot_negative_cache_size", "Remembered download errors",
+         "negative_cache", ("size",)),
+        ("bot_media_cache_bytes", "Bytes in media directory", "media_cache", ("bytes",)),
+        ("bot_media_cache_evicted", "Evicted media entries", "media_cache", ("evicted",)),
+        ("bot_scheduler_io_queued", "Queued IO jobs", "scheduler", ("io", "queued")),
+        ("bot_scheduler_io_running", "Running IO jobs", "scheduler", ("io", "running")),
+        ("bot_scheduler_cpu_queued", "Queued CPU jobs", "scheduler", ("cpu", "queued")),
+        ("bot_scheduler_cpu_running", "Running CPU jobs", "scheduler", ("cpu", "running")),
+        ("bot_singleflight_followers", "Requests joined to a running download",
+         "singleflight", ("followers",)),
+    ]
+    for name, documentation, service, path in gauges:
+        if bot.get(service) is not None:
+            _stats_gauge(name, documentation, service, path, bot)
+
+
+async def queue_depth(bot) -> dict:
+    scheduler = bot['scheduler']
+    depth = {"scheduler": {kind.value: scheduler.depth(kind) for kind in JobKind}}
+    job_queue = bot.get('job_queue')
+    if job_queue:
+        depth.update(await job_queue.stats())
+    return depth
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=REGISTRY.render(),
+                        content_type="text/plain", charset="utf-8")
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok"})
+
+
+async def handle_ready(request: web.Request) -> web.Response:
+    """Ready while every queue of the scheduler has free place"""
+    bot = request.app['bot']
+    try:
+        depth = await queue_depth(bot)
+    except Exception as e:
+        return web.json_response({"status": "error", "error": str(e)}, status=503)
+    full = [kind.value for kind in JobKind if bot['scheduler'].is_full(kind)]
+    ready = not full
+    return web.json_response({"status": "ok" if ready else "busy",
+                              "queue": depth, "full": full},
+                             status=200 if ready else 503)
+
+
+async def start_metrics_server(bot, host: str, port: int) -> web.AppRunner or None:
+    """
+    Serve /metrics, /health and /ready on the local port.
+    Returns None if the port can not be bound, the bot runs without metrics
+    """
+    register_bot_gauges(bot)
+    app = web.Application()
+    app['bot'] = bot
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/ready", handle_ready)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        logger.warning(f"Metrics are not served, {host}:{port} is not available: {e}")
+        await runner.cleanup()
+        return None
+    logger.info(f"Metrics are served on {host}:{port}")
+    return runner
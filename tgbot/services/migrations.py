@@ -0,0 +1,114 @@
+import re
+
+from loguru import logger
+from sqlalchemy import bindparam, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from tgbot.misc.media_key import MediaKey, YOUTUBE, HOSTS, link_key
+
+# Idempotent statements for databases created by older versions,
+# Base.metadata.create_all() creates only missing tables
+MIGRATIONS = [
+    'CREATE INDEX IF NOT EXISTS ix_link_file_id ON link (file_id)',
+    'CREATE INDEX IF NOT EXISTS ix_link_user_id ON link (user_id)',
+    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS is_blocked BOOLEAN NOT NULL DEFAULT false',
+    'CREATE TABLE IF NOT EXISTS schema_migration ('
+    'name VARCHAR(100) PRIMARY KEY, applied_at TIMESTAMP NOT NULL DEFAULT now())',
+]
+
+# Link url of a YouTube format before media keys
+OLD_YOUTUBE_LINK = re.compile(r"^youtu\.be/([\w-]{11})/(video|audio)/([\w-]+)$")
+
+
+async def run_migrations(engine: AsyncEngine) -> None:
+    """
+    Apply the idempotent statements, then every data migration which is
+    not recorded in schema_migration yet. A data migration is recorded
+    after it succeeds, so it runs once per database
+    """
+    async with engine.begin() as conn:
+        for statement in MIGRATIONS:
+            await conn.execute(text(statement))
+        result = await conn.execute(text("SELECT name FROM schema_migration"))
+        applied = set(result.scalars())
+    logger.info(f"Applied {len(MIGRATIONS)} migrations")
+
+    for name, migrate in DATA_MIGRATIONS.items():
+        if name in applied:
+            continue
+        await migrate(engine)
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "INSERT INTO schema_migration (name) VALUES (:name) "
+                "ON CONFLICT DO NOTHING"), {"name": name})
+        logger.info(f"Data migration {name} applied")
+
+
+def canonical_link_url(url: str) -> str:
+    match = OLD_YOUTUBE_LINK.match(url)
+    if match:
+        video_id, type, format_id = match.groups()
+        return MediaKey(YOUTUBE, video_id).variant(type, format_id)
+    return link_key(url)
+
+
+async def rewrite_link_urls(engine: AsyncEngine, batch_size: int = 1000) -> None:
+    """
+    Replace link urls saved by older versions ("instagram.com/reel/X") with
+    media keys ("instagram:X"). Only urls which are not keys are read, by
+    batches in their own transactions. Keys already taken by another link
+    of the same media are looked up once per batch, the old links are
+    deleted and the rest are updated by one executemany
+    """
+    not_keys = " ".join(f"AND url NOT LIKE '{platform}:%'"
+                        for platform in sorted({p for p, _ in HOSTS.values()}))
+    select_sql = text(
+        f"SELECT id, url FROM link WHERE id > :after_id {not_keys} "
+        f"ORDER BY id LIMIT :limit")
+    taken_sql = text("SELECT url FROM link WHERE url IN :keys") \
+        .bindparams(bindparam("keys", expanding=True))
+    update_sql = text("UPDATE link SET url = :key WHERE id = :id")
+    delete_sql = text("DELETE FROM link WHERE id IN :ids") \
+        .bindparams(bindparam("ids", expanding=True))
+
+    after_id = 0
+    rewritten = deleted = 0
+    while True:
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                select_sql, {"after_id": after_id, "limit": batch_size})
+            rows = result.all()
+            changed = []
+            for id, url in rows:
+                key = canonical_link_url(url)
+                if key != url:
+                    changed.append((id, key))
+            if changed:
+                result = await conn.execute(
+                    taken_sql, {"keys": list({key for _, key in changed})})
+                taken = set(result.scalars())
+                updates, duplicates = [], []
+                for id, key in changed:
+                    if key in taken:
+                        duplicates.append(id)
+                    else:
+                        taken.add(key)
+                        updates.append({"id": id, "key": key})
+                if duplicates:
+                    await conn.execute(delete_sql, {"ids": duplicates})
+                if updates:
+                    await conn.execute(update_sql, updates)
+                rewritten += len(updates)
+                deleted += len(duplicates)
+        if len(rows) < batch_size:
+            break
+        after_id = rows[-1].id
+    if rewritten or deleted:
+        logger.info(f"Link urls rewritten to media keys: {rewritten}, "
+                    f"duplicates deleted: {deleted}")
+
+
+# Data migrations by name, in order, recorded in schema_migration when done
+DATA_MIGRATIONS = {
+    "link_urls_to_media_keys": rewrite_link_urls,
+}
@@ -0,0 +1,104 @@
+import time
+
+from aioredis import Redis
+from aioredis.exceptions import RedisError
+from cachetools import LRUCache
+from loguru import logger
+
+from tgbot.services.metrics import NEGATIVE_CACHE_HITS
+
+
+class NegativeCache:
+    """
+    Media key -> error code of its failed download, so repeated requests
+    of missing media are answered without asking the platform again.
+    Every code has its own TTL: missing media are remembered for long,
+    transient errors for a short time. Entries are kept in-process and in
+    Redis shared by all bot instances, when Redis fails only in-process
+    """
+
+    def __init__(self, redis: Redis = None, ttls: dict = None,
+                 default_ttl: int = 60, maxsize: int = 50000,
+                 prefix: str = "media_saving_bot"):
+        # key -> (code, monotonic expiry time), TTLCache has one ttl for all
+        self._local = LRUCache(maxsize=maxsize)
+        self._redis = redis
+        self._ttls = ttls or {}
+        self._default_ttl = default_ttl
+        self._prefix = prefix
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.redis_errors = 0
+
+    def ttl(self, code: int) -> int:
+        """Seconds the code is remembered, 0 - not remembered"""
+        return self._ttls.get(code, self._default_ttl)
+
+    async def get(self, key: str) -> int or None:
+        """Error code of the media, or None if it may be requested upstream"""
+        entry = self._local.get(key)
+        if entry is not None:
+            code, expires_at = entry
+            if expires_at > time.monotonic():
+                self.local_hits += 1
+                self._count_saved(key)
+                return code
+            self._local.pop(key, None)
+
+        if self._redis:
+            try:
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    pipe.get(self._key(key))
+                    pipe.ttl(self._key(key))
+                    value, ttl = await pipe.execute()
+            except RedisError as e:
+                self._redis_failed("get", e)
+                value = None
+            if value is not None:
+                self.redis_hits += 1
+                code = int(value)
+                if ttl and ttl > 0:
+                    self._local[key] = (code, time.monotonic() + ttl)
+                self._count_saved(key)
+                return code
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, code: int) -> None:
+        ttl = self.ttl(code)
+        if ttl <= 0:
+            return
+        self.stored += 1
+        self._local[key] = (code, time.monotonic() + ttl)
+        if self._redis:
+            try:
+                await self._redis.set(self._key(key), code, ex=ttl)
+            except RedisError as e:
+                self._redis_failed("put", e)
+
+    def stats(self) -> dict:
+        saved = self.local_hits + self.redis_hits
+        total = saved + self.misses
+        return {
+            "size": len(self._local),
+            "stored": self.stored,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "redis_errors": self.redis_errors,
+            "saved_requests": saved,
+            "hit_ratio": saved / total if total else 0.0,
+        }
+
+    def _redis_failed(self, operation: str, error: RedisError):
+        self.redis_errors += 1
+        logger.warning(f"Negative cache {operation} falls back to memory: {error}")
+
+    def _count_saved(self, key: str):
+        NEGATIVE_CACHE_HITS.inc(platform=key.split(":", 1)[0])
+
+    def _key(self, key: str) -> str:
+        return f"{self._prefix}:failed:{key}"
@@ -0,0 +1,181 @@
+import math
+import time
+
+from aioredis import Redis
+from aioredis.exceptions import RedisError
+from cachetools import TTLCache
+from loguru import logger
+
+
+# Check all buckets of the action and take cost from each of them only if
+# every bucket has enough tokens. ARGV: now, cost, then capacity and refill
+# rate of every key. Returns index of the bucket which denied the action
+# (0 if allowed) and seconds to wait as a string (Lua numbers are truncated)
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local tokens = {}
+local denied = 0
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[1 + i * 2])
+    local rate = tonumber(ARGV[2 + i * 2])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local t = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    t = math.min(capacity, t + math.max(0, now - ts) * rate)
+    tokens[i] = t
+    local need = math.min(cost, capacity)
+    if t < need and (need - t) / rate > wait then
+        wait = (need - t) / rate
+        denied = i
+    end
+end
+if denied == 0 then
+    for i, key in ipairs(KEYS) do
+        local capacity = tonumber(ARGV[1 + i * 2])
+        local rate = tonumber(ARGV[2 + i * 2])
+        redis.call('HSET', key, 'tokens', tokens[i] - math.min(cost, capacity), 'ts', now)
+        redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000))
+    end
+end
+return {denied, tostring(wait)}
+"""
+
+
+class Bucket:
+    """Token bucket settings: burst capacity and refill rate in tokens/sec"""
+    __slots__ = ("capacity", "rate")
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+
+    def refill(self, tokens: float, ts: float, now: float) -> float:
+        return min(self.capacity, tokens + max(0.0, now - ts) * self.rate)
+
+    def __repr__(self):
+        return f"<Bucket(capacity={self.capacity}, rate={self.rate})>"
+
+
+class RateLimited:
+    """Result of the denied check"""
+    __slots__ = ("scope", "retry_after")
+
+    def __init__(self, scope: str, retry_after: float):
+        self.scope = scope
+        self.retry_after = retry_after
+
+    def __repr__(self):
+        return f"<RateLimited(scope={self.scope}, retry_after={self.retry_after:.1f})>"
+
+
+class RateLimiter:
+    """
+    Token buckets per user, per chat and for the whole bot.
+
+    Every action takes its cost from all three buckets at once, or from
+    none of them if any bucket has not enough tokens. With Redis the buckets
+    are shared by all bot instances and checked by one script call, without
+    Redis (or when it fails) the buckets are kept in process memory.
+    """
+
+    scopes = ("user", "chat", "global")
+
+    def __init__(self, user: Bucket, chat: Bucket, global_: Bucket,
+                 redis: Redis = None, prefix: str = "media_saving_bot",
+                 maxsize: int = 100000):
+        self.buckets = {"user": user, "chat": chat, "global": global_}
+        self._redis = redis
+        self._prefix = prefix
+        self._script = redis.register_script(TOKEN_BUCKET_SCRIPT) if redis else None
+        ttl = max(b.capacity / b.rate for b in self.buckets.values())
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.allowed = 0
+        self.limited = {scope: 0 for scope in self.scopes}
+
+    async def check(self, user_id: int, chat_id: int, cost: float = 1) -> RateLimited or None:
+        """Take cost from the buckets, returns RateLimited if action is denied"""
+        keys = self._keys(user_id, chat_id)
+        result = None
+        if self._script:
+            try:
+                result = await self._check_redis(keys, cost)
+            except RedisError as e:
+                logger.warning(f"Rate limiter falls back to memory: {e}")
+        if result is None:
+            result = self._check_local(keys, cost)
+
+        denied, wait = result
+        if not denied:
+            self.allowed += 1
+            return None
+        scope = self.scopes[denied - 1]
+        self.limited[scope] += 1
+        return RateLimited(scope, wait)
+
+    async def inspect(self, user_id: int = None, chat_id: int = None) -> dict:
+        """Tokens left in the buckets of the user and chat and in the global one"""
+        now = time.time()
+        keys = dict(zip(self.scopes, self._keys(user_id, chat_id)))
+        if user_id is None:
+            keys.pop("user")
+        if chat_id is None:
+            keys.pop("chat")
+        state = {}
+        for scope, key in keys.items():
+            bucket = self.buckets[scope]
+            tokens, ts = bucket.capacity, now
+            if self._redis:
+                values = await self._redis.hmget(key, "tokens", "ts")
+                if values[0] is not None:
+                    tokens, ts = float(values[0]), float(values[1])
+            elif key in self._local:
+                tokens, ts = self._local[key]
+            state[scope] = {
+                "tokens": round(bucket.refill(tokens, ts, now), 2),
+                "capacity": bucket.capacity,
+                "rate": bucket.rate,
+            }
+        return state
+
+    def stats(self) -> dict:
+        return {
+            "backend": "redis" if self._redis else "memory",
+            "allowed": self.allowed,
+            "limited": dict(self.limited),
+            "local_buckets": len(self._local),
+        }
+
+    def _keys(self, user_id: int, chat_id: int) -> list:
+        return [f"{self._prefix}:user:{user_id}",
+                f"{self._prefix}:chat:{chat_id}",
+                f"{self._prefix}:global"]
+
+    async def _check_redis(self, keys: list, cost: float) -> tuple:
+        args = [time.time(), cost]
+        for scope in self.scopes:
+            args += [self.buckets[scope].capacity, self.buckets[scope].rate]
+        denied, wait = await self._script(keys=keys, args=args)
+        return int(denied), float(wait)
+
+    def _check_local(self, keys: list, cost: float) -> tuple:
+        now = time.time()
+        tokens = []
+        denied, wait = 0, 0.0
+        for index, (scope, key) in enumerate(zip(self.scopes, keys), start=1):
+            bucket = self.buckets[scope]
+            t, ts = self._local.get(key, (bucket.capacity, now))
+            t = bucket.refill(t, ts, now)
+            tokens.append(t)
+            need = min(cost, bucket.capacity)
+            if t < need and (need - t) / bucket.rate > wait:
+                denied, wait = index, (need - t) / bucket.rate
+        if not denied:
+            for scope, key, t in zip(self.scopes, keys, tokens):
+                self._local[key] = (t - min(cost, self.buckets[scope].capacity), now)
+        return denied, wait
+
+    @staticmethod
+    def format_wait(seconds: float) -> int:
+        return max(1, math.ceil(seconds))
@@ -0,0 +1,15 @@
+import aioredis
+
+from tgbot.config import Config
+
+
+def create_redis(config: Config) -> aioredis.Redis or None:
+    """Create Redis client for shared caches, None if redis is disabled"""
+    if not config.tg_bot.use_redis:
+        return None
+    return aioredis.Redis(
+        host=config.tg_bot.redis_host,
+        port=config.tg_bot.redis_port,
+        db=config.tg_bot.redis_db,
+        password=config.tg_bot.redis_password or None,
+    )
@@ -0,0 +1,197 @@
+import asyncio
+import math
+
+from enum import Enum
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+
+class JobKind(Enum):
+    IO = "io"  # network bound jobs, e.g. Instagram fetches
+    CPU = "cpu"  # jobs spawning heavy processes, e.g. yt-dlp + ffmpeg recode
+
+
+class QueueFull(Exception):
+    """Raised when there is no free place in the queue for a new job"""
+
+
+class Job:
+    """Queued call, await it to get the result"""
+    __slots__ = ("kind", "name", "func", "args", "kwargs",
+                 "future", "enqueued_at", "started_at", "position")
+
+    def __init__(self, kind: JobKind, name: str, func: Callable[..., Awaitable],
+                 args: tuple, kwargs: dict):
+        loop = asyncio.get_event_loop()
+        self.kind = kind
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = loop.create_future()
+        self.enqueued_at = loop.time()
+        self.started_at = None
+        # Number of jobs which should be finished before this job starts
+        self.position = 0
+
+    def __await__(self):
+        return self.future.__await__()
+
+    def __repr__(self):
+        return f"<Job(kind={self.kind.value}, name={self.name}, position={self.position})>"
+
+
+class KindStats:
+    """Queue depth and timings of one kind of jobs"""
+    __slots__ = ("submitted", "rejected", "completed", "failed", "running",
+                 "wait_avg", "wait_max", "duration_avg")
+
+    # Weight of the last value in moving averages
+    alpha = 0.2
+
+    def __init__(self):
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.running = 0
+        self.wait_avg = 0.0
+        self.wait_max = 0.0
+        self.duration_avg = 0.0
+
+    def add_wait(self, seconds: float):
+        self.wait_avg += self.alpha * (seconds - self.wait_avg)
+        self.wait_max = max(self.wait_max, seconds)
+
+    def add_duration(self, seconds: float):
+        if not self.duration_avg:
+            self.duration_avg = seconds
+        self.duration_avg += self.alpha * (seconds - self.duration_avg)
+
+
+class JobScheduler:
+    """
+    Bounded queues with worker pools for download jobs.
+    Every job kind has its own queue and number of workers, so CPU-heavy
+    jobs can not take all workers from I/O-heavy ones
+    """
+
+    def __init__(self, io_workers: int = 8, cpu_workers: int = 2,
+                 max_queue: int = 100):
+        self._workers_count = {JobKind.IO: io_workers,
+                               JobKind.CPU: cpu_workers}
+        self._max_queue = max_queue
+        self._queues = {}
+        self._workers = []
+        self._stats = {kind: KindStats() for kind in JobKind}
+
+    async def start(self):
+        for kind, count in self._workers_count.items():
+            self._queues[kind] = asyncio.Queue(maxsize=self._max_queue)
+            for _ in range(count):
+                self._workers.append(
+                    asyncio.ensure_future(self._worker(kind)))
+        logger.info(f"Scheduler started, io workers: {self._workers_count[JobKind.IO]}, "
+                    f"cpu workers: {self._workers_count[JobKind.CPU]}")
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for queue in self._queues.values():
+            while not queue.empty():
+                queue.get_nowait().future.cancel()
+
+    def submit(self, kind: JobKind, func: Callable[..., Awaitable],
+               *args, name: str = None, **kwargs) -> Job:
+        """
+        Put job to the queue of its kind.
+        Raises QueueFull if the queue has no free place
+        """
+        stats = self._stats[kind]
+        job = Job(kind, name or func.__name__, func, args, kwargs)
+        try:
+            self._queues[kind].put_nowait(job)
+        except asyncio.QueueFull:
+            stats.rejected += 1
+            logger.warning(f"Scheduler queue {kind.value} is full, {job} rejected")
+            raise QueueFull(kind)
+        stats.submitted += 1
+        job.position = max(
+            0,
+            self._queues[kind].qsize() + stats.running
+            - self._workers_count[kind]
+        )
+        return job
+
+    async def run(self, kind: JobKind, func: Callable[..., Awaitable],
+                  *args, **kwargs):
+        """Submit job and wait for its result"""
+        return await self.submit(kind, func, *args, **kwargs)
+
+    def eta(self, job: Job) -> int:
+        """Estimated seconds before job is finished"""
+        stats = self._stats[job.kind]
+        rounds = math.ceil(job.position / self._workers_count[job.kind]) + 1
+        return int(rounds * stats.duration_avg)
+
+    def is_full(self, kind: JobKind) -> bool:
+        """True if a new job of the kind would be rejected"""
+        return kind in self._queues and self._queues[kind].full()
+
+    def depth(self, kind: JobKind = None) -> int:
+        """Number of queued and running jobs"""
+        kinds = [kind] if kind else list(JobKind)
+        return sum(self._queues[k].qsize() + self._stats[k].running
+                   for k in kinds if k in self._queues)
+
+    def stats(self) -> dict:
+        return {
+            kind.value: {
+                "queued": self._queues[kind].qsize() if kind in self._queues else 0,
+                "running": s.running,
+                "workers": self._workers_count[kind],
+                "submitted": s.submitted,
+                "rejected": s.rejected,
+                "completed": s.completed,
+                "failed": s.failed,
+                "wait_avg": round(s.wait_avg, 3),
+                "wait_max": round(s.wait_max, 3),
+                "duration_avg": round(s.duration_avg, 3),
+            }
+            for kind, s in self._stats.items()
+        }
+
+    async def _worker(self, kind: JobKind):
+        loop = asyncio.get_event_loop()
+        queue = self._queues[kind]
+        stats = self._stats[kind]
+        while True:
+            job: Job = await queue.get()
+            try:
+                if job.future.done():  # cancelled by submitter
+                    continue
+                job.started_at = loop.time()
+                stats.add_wait(job.started_at - job.enqueued_at)
+                stats.running += 1
+                try:
+                    result = await job.func(*job.args, **job.kwargs)
+                except asyncio.CancelledError:
+                    job.future.cancel()
+                    raise
+                except Exception as e:
+                    stats.failed += 1
+                    logger.error(f"Scheduler job {job} failed: {e}")
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                else:
+                    stats.completed += 1
+                    if not job.future.done():
+                        job.future.set_result(result)
+                finally:
+                    stats.running -= 1
+                    stats.add_duration(loop.time() - job.started_at)
+            finally:
+                queue.task_done()
@@ -0,0 +1,86 @@
+from aiogram import types
+from cachetools import TTLCache
+from sqlalchemy.orm import sessionmaker
+
+from tgbot.models.user import User
+
+
+class CachedUser:
+    """Compact copy of the user row with only the fields handlers need"""
+    __slots__ = ("id", "telegram_id", "firstname",
+                 "lastname", "username", "lang_code")
+
+    def __init__(self, id: int, telegram_id: int, firstname: str,
+                 lastname: str, username: str, lang_code: str):
+        self.id = id
+        self.telegram_id = telegram_id
+        self.firstname = firstname
+        self.lastname = lastname
+        self.username = username
+        self.lang_code = lang_code
+
+    @classmethod
+    def from_row(cls, row) -> 'CachedUser':
+        return cls(row.id, row.telegram_id, row.firstname,
+                   row.lastname, row.username, row.lang_code)
+
+    def is_outdated(self, telegram_user: types.User) -> bool:
+        """Check if profile fields were changed in telegram"""
+        return (self.firstname != telegram_user.first_name
+                or self.lastname != telegram_user.last_name
+                or self.username != telegram_user.username)
+
+    @property
+    def fullname(self) -> str:
+        if self.lastname:
+            return f"{self.firstname} {self.lastname}"
+        return self.firstname
+
+    def __repr__(self):
+        return f'CachedUser (id: {self.telegram_id}, firstname: {self.firstname}, ' \
+            f'lastname: {self.lastname}, username: {self.username}, lang_code: {self.lang_code})'
+
+
+class UserCache:
+    """Bounded LRU/TTL cache of users keyed by telegram id"""
+
+    def __init__(self, maxsize: int = 10000, ttl: int = 3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    async def get_user(self, db_session: sessionmaker,
+                       telegram_user: types.User) -> CachedUser:
+        """
+        Return cached user. On miss the row is read from the database, it
+        is written only if the user is new, changed the profile or was
+        blocked (writes to the bot again)
+        """
+        user = self._cache.get(telegram_user.id)
+        if user is not None and not user.is_outdated(telegram_user):
+            self.hits += 1
+            return user
+
+        self.misses += 1
+        row = await User.get_user(db_session, telegram_user.id)
+        if row is None or row.is_blocked or CachedUser.from_row(row).is_outdated(telegram_user):
+            row = await User.upsert_user(
+                db_session,
+                User(telegram_user.id, telegram_user.first_name,
+                     telegram_user.last_name, telegram_user.username)
+            )
+        user = CachedUser.from_row(row)
+        self._cache[telegram_user.id] = user
+        return user
+
+    def invalidate(self, telegram_id: int) -> None:
+        self._cache.pop(telegram_id, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
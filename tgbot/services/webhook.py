@@ -0,0 +1,95 @@
+import hmac
+import asyncio
+
+from aiohttp import web
+from loguru import logger
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.bot import api
+
+from tgbot.config import Config
+
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+async def process_update(dp: Dispatcher, update: types.Update):
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+    try:
+        await dp.process_update(update)
+    except Exception as e:
+        logger.exception(f"Error while processing update {update.update_id}: {e}")
+
+
+async def handle_update(request: web.Request) -> web.Response:
+    """
+    Validate secret token and answer Telegram at once,
+    the update is processed in background task. When too many updates
+    are being processed, answer 503 so Telegram delivers it again later
+    """
+    secret = request.app['secret_token']
+    if secret and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), secret):
+        logger.warning(f"Webhook request with wrong secret token from {request.remote}")
+        return web.Response(status=401)
+
+    tasks: set = request.app['tasks']
+    if len(tasks) >= request.app['max_pending_updates']:
+        return web.Response(status=503)
+
+    try:
+        update = types.Update(**await request.json())
+    except ValueError:
+        return web.Response(status=400)
+
+    task = asyncio.ensure_future(process_update(request.app['dp'], update))
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+    return web.Response()
+
+
+def create_webhook_app(dp: Dispatcher, config: Config) -> web.Application:
+    app = web.Application()
+    app['dp'] = dp
+    app['secret_token'] = config.webhook.secret_token
+    app['tasks'] = set()
+    app['max_pending_updates'] = config.webhook.max_pending_updates
+    app.router.add_post(config.webhook.path, handle_update)
+    return app
+
+
+async def set_webhook(bot: Bot, config: Config):
+    # secret_token is not supported by Bot.set_webhook of this aiogram version
+    payload = {
+        "url": config.webhook.url.rstrip("/") + config.webhook.path,
+        "max_connections": config.webhook.max_connections,
+    }
+    if config.webhook.secret_token:
+        payload["secret_token"] = config.webhook.secret_token
+    await bot.request(api.Methods.SET_WEBHOOK, payload)
+    logger.success(f"Webhook is set to {payload['url']}")
+
+
+async def run_webhook(dp: Dispatcher, config: Config, is_main_worker: bool = True):
+    """
+    Serve updates until cancelled. Several worker processes can listen
+    on the same port, only the main one sets the webhook
+    """
+    app = create_webhook_app(dp, config)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.webhook.listen_host,
+                       config.webhook.listen_port,
+                       reuse_port=config.webhook.workers > 1)
+    await site.start()
+    logger.success(f"Webhook server is listening on "
+                   f"{config.webhook.listen_host}:{config.webhook.listen_port}")
+    if is_main_worker:
+        await set_webhook(dp.bot, config)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        if app['tasks']:
+            await asyncio.gather(*app['tasks'], return_exceptions=True)
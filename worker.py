@@ -0,0 +1,117 @@
+import asyncio
+import multiprocessing
+
+from loguru import logger
+
+from aiogram import Bot
+
+from tgbot.config import load_config
+from tgbot.handlers.jobs import execute_job, notify_failed
+from tgbot.services.context import create_bot, setup_context, close_context
+from tgbot.services.job_queue import RedisJobQueue, QueuedJob
+from tgbot.services.logs import setup_logging
+from tgbot.services.metrics import start_metrics_server
+
+
+# How often expired jobs are returned to the queue, seconds
+REQUEUE_INTERVAL = 15
+
+
+async def keep_alive(queue: RedisJobQueue, job: QueuedJob):
+    """Extend visibility of the running job, so it is not retried by others"""
+    while True:
+        await asyncio.sleep(queue.visibility_timeout / 3)
+        await queue.extend(job)
+
+
+async def process_job(bot: Bot, queue: RedisJobQueue, job: QueuedJob):
+    logger.info(f"Worker got {job}")
+    heartbeat = asyncio.ensure_future(keep_alive(queue, job))
+    try:
+        await execute_job(bot, job)
+    except Exception as e:
+        if job.attempts >= queue.max_attempts:
+            logger.error(f"{job} failed after the last attempt: {e}")
+            await queue.ack(job)
+            await notify_failed(bot, job, e)
+        else:
+            logger.warning(f"{job} failed, will be retried: {e}")
+            await queue.nack(job)
+    else:
+        await queue.ack(job)
+        logger.success(f"{job} done")
+    finally:
+        heartbeat.cancel()
+
+
+async def consume(bot: Bot, queue: RedisJobQueue):
+    while True:
+        job = await queue.reserve()
+        if job is None:
+            continue
+        try:
+            await process_job(bot, queue, job)
+        except asyncio.CancelledError:
+            # Job stays in processing and is retried after visibility timeout
+            raise
+        except Exception as e:
+            logger.exception(f"Worker could not process {job}: {e}")
+
+
+async def requeue_expired(queue: RedisJobQueue):
+    while True:
+        try:
+            await queue.requeue()
+        except Exception as e:
+            logger.error(f"Could not requeue expired jobs: {e}")
+        await asyncio.sleep(REQUEUE_INTERVAL)
+
+
+async def main(process: int = 0):
+    config = load_config("bot.ini")
+    setup_logging(config, "worker")
+    logger.success(f"Starting download worker {process}")
+    if not config.distributed.enabled:
+        logger.error("Distributed mode is disabled in bot.ini")
+        return
+
+    bot = create_bot(config)
+    Bot.set_current(bot)
+    await setup_context(bot, config)
+
+    if config.metrics.enabled:
+        bot['metrics'] = await start_metrics_server(
+            bot, config.metrics.host, config.metrics.worker_port + process)
+
+    queue: RedisJobQueue = bot['job_queue']
+    tasks = [asyncio.ensure_future(consume(bot, queue))
+             for _ in range(config.distributed.worker_concurrency)]
+    if process == 0:
+        tasks.append(asyncio.ensure_future(requeue_expired(queue)))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await close_context(bot)
+
+
+def run(process: int = 0):
+    try:
+        asyncio.new_event_loop().run_until_complete(main(process))
+    except (KeyboardInterrupt, SystemExit):
+        logger.error("Worker stopped!")
+
+
+if __name__ == '__main__':
+    distributed = load_config("bot.ini").distributed
+    # Workers share nothing but Redis and the database, so they can be
+    # started on several machines as well
+    processes = [multiprocessing.Process(target=run, args=(process,))
+                 for process in range(1, distributed.worker_processes)]
+    for process in processes:
+        process.start()
+    run()
+    for process in processes:
+        process.join()